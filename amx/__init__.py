@@ -30,7 +30,10 @@ _import_instruct = {
 		{'source':'gromacs_commands.py','target':'automacs.py','name':'gmx_commands_interpret'},
 		{'source':'gromacs_commands.py','target':'postprocess.py','name':'gmx_commands_interpret'},
 		{'source':'calls.py','target':'postprocess.py','name':'gmx'},
+		{'source':'calls.py','target':'postprocess.py','name':'gmx_async'},
+		{'source':'calls.py','target':'postprocess.py','name':'gmx_wait'},
 		{'source':'gromacs_commands.py','target':'calls.py','name':'gmx_convert_template_to_call'},
+		{'source':'gromacs_commands.py','target':'calls.py','name':'gmx_call_argv'},
 		{'source':'gromacs_commands.py','target':'postprocess.py','name':'gmx_get_last_call'},
 		#---! move the machine configuration to amx and generalize it?
 		{'source':'calls.py','target':'lammps.py','name':'gmx_get_machine_config'},][:-1],
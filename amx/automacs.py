@@ -60,7 +60,8 @@ def init():
 	if prev_states: 
 		state.before = []
 		from datapack import DotDict
-		for fn in sorted(prev_states):
+		#---sort by step number so the last state is the latest one
+		for fn in sorted(prev_states,key=lambda x:int(re.match(r'^state_(\d+)\.json$',x).group(1))):
 			with open(fn) as fp: state.before.append(DotDict(**json.load(fp)))
 	#---store settings for posterity minus the _protect
 	state.settings = dict(settings)
@@ -80,7 +81,9 @@ def make_step(name):
 		prev_state = state.before[-1]
 		if state.stepno: state.stepno += 1
 		else: state.stepno = prev_state['stepno'] + 1
-		state.steps = list(prev_state['steps'])
+		#---a step after several branches of a metarun graph follows the lineage of all of them
+		state.steps = []
+		for before in state.before: state.steps.extend([i for i in before.get('steps',[]) if i not in state.steps])
 	else:
 		if 'stepno' not in state: state.stepno = 1
 		if 'steps' not in state: state.steps = []
@@ -12,7 +12,9 @@ import os,sys,subprocess,re,time,glob,shutil,json,copy
 
 __all__ = ['locate','flag_search','config','watch','layout','gromacs_config',
 	'setup','notebook','upload','download','cluster','submit','gitcheck','gitpull','rewrite_config',
-	'codecheck','collect_parameters','write_continue_script','show_kickstarters','hardstart']
+	'codecheck','collect_parameters','write_continue_script','show_kickstarters','hardstart','cache',
+	'profile','tune_mdrun','perf','ensemble','chain','progress',
+	'topology_benchmark']
 
 from datapack import asciitree,delve,delveset,yamlb,jsonify,check_repeated_keys
 from makeface import fab
@@ -103,6 +105,7 @@ def layout(name=None):
 def gromacs_config(where=None):
 	"""
 	Make sure there is a gromacs configuration available.
+	Use `make gromacs_config refresh` to rebuild the cached toolchain (see gmx_get_paths).
 	"""
 	config_std = '~/.automacs.py'
 	config_local = 'gromacs_config.py'
@@ -110,12 +113,18 @@ def gromacs_config(where=None):
 	#---the global configuration is overridden if a local config file exists
 	#---we source the config from a default copy in the amx directory
 	default_config = 'gromacs/gromacs_config.py.bak'
+	if where=='refresh':
+		amx = get_amx()
+		gmxpaths = amx.gmx_get_paths(refresh=True)
+		print('[STATUS] refreshed the gromacs toolchain cache')
+		asciitree({'gmxpaths':gmxpaths})
+		return gmxpaths
 	if where:
 		if where not in ['home','local']:
 			#---! print the error message here?
 			raise Exception('[ERROR] options are `make gromacs_config local` or `make gromacs_config home`. '+
 				'the argument tells us whether to write a local (%s) or global (%s) configuration'%
-				(config_local,config_std))
+				(config_local,config_std)+'. use `make gromacs_config refresh` to rebuild the toolchain cache')
 		else:
 			dest_fn = config_local if where=='local' else config_std
 			dest_fn_abs = os.path.abspath(os.path.expanduser(dest_fn))
@@ -215,10 +224,11 @@ def upload(alias,path='~',sure=False,state_fn='state.json',bulk=False):
 	from amx.gromacs.gromacs_commands import gmx_get_last_call
 	serial_number()
 	last_step = amx.state['here']
-	gmx_get_last_call('mdrun',this_state=amx.state)
 	#---upload requires knowledge of the last mdrun so we only send up cpt and tpr
 	last_mdrun = gmx_get_last_call('mdrun',this_state=amx.state)
 	restart_fns = [last_step+i for i in [last_mdrun['flags']['-s'],last_mdrun['flags']['-cpo']]]
+	#---the gmx journal holds the call history referenced by state.json
+	if 'gmx_journal' in amx.state: restart_fns.append(amx.state.gmx_journal['path'])
 	#---upload cluster files if they are already prepared by users who wish to run cluster before sending it
 	for fn in ['script-continue.sh','cluster-continue.sh']:
 		if os.path.isfile(os.path.join(last_step,fn)):
@@ -227,6 +237,15 @@ def upload(alias,path='~',sure=False,state_fn='state.json',bulk=False):
 		error = '[STATUS] could not find necessary upload files from get_last_gmx_call'+\
 			"\n[ERROR] missing: %s"%str([fn for fn in restart_fns if not os.path.isfile(fn)])
 		raise Exception(error)
+	#---report the progress of the checkpoint so users know where the simulation will resume
+	from makeface import import_remote
+	cpt_progress = import_remote('amx/gromacs/cpt.py')['cpt_progress']
+	try: progress = cpt_progress(restart_fns[1])
+	except Exception as e: 
+		progress = None
+		print('[WARNING] cannot read the checkpoint %s: %s'%(restart_fns[1],e))
+	if progress: print('[STATUS] uploading %s at step %d (%.1f ps)'%(
+		restart_fns[1],progress['step'],progress['time']))
 	#---get defaults list
 	default_fns,default_dirs = ['makefile','config.py','state.json'],['amx','runner']
 	if os.path.isfile('gromacs_config.py'): default_fns += ['gromacs_config.py']
@@ -258,6 +277,7 @@ def upload(alias,path='~',sure=False,state_fn='state.json',bulk=False):
 		ts = make_timestamp()
 		from runner.states import state_set_and_save
 		this_upload = dict(to=destination,when=ts)
+		if progress: this_upload['progress'] = dict([(i,progress[i]) for i in ['step','time']])
 		state_set_and_save(amx.state,upload=this_upload)
 		upload_history = amx.state.get('upload_history',[])
 		upload_history.append(this_upload)
@@ -359,8 +379,11 @@ def cluster(hostname=None,overwrite=True):
 	#---get the most recent step (possibly duplicate code from base)
 	last_step = amx.state.here if 'here' in amx.state else False
 	#---gmxpaths can be saved to the state or retrieved automatically
-	try: gmxpaths = get_gmx_paths(hostname=hostname,override=True if hostname else False)
-	except: gmxpaths = amx.state.gmxpaths
+	#---we use gmx_get_paths from amx because it needs the state and cache_dir for the toolchain cache
+	try: gmxpaths = dict(amx.gmx_get_paths(hostname=hostname,override=True if hostname else False))
+	except Exception as e: 
+		print('[WARNING] using gmxpaths from the state because gmx_get_paths failed: %s'%e)
+		gmxpaths = dict(amx.state.gmxpaths)
 	#---override the mdrun command if the cluster definition says so
 	if 'mdrun_command' in machine_configuration: gmxpaths['mdrun'] = machine_configuration['mdrun_command']
 	if last_step:
@@ -411,6 +434,8 @@ def cluster(hostname=None,overwrite=True):
 		#---the header gets settings substitutions
 		for key,val in settings.items(): head = re.sub(key.upper(),str(val),head,re.M)
 		with open(cluster_continue,'w') as fp: fp.write(head+continue_script)
+		#---the header with settings is also used for job chains (see `make chain`)
+		with open(os.path.join(last_step,'cluster-header.sh'),'w') as fp: fp.write(head)
 	#---for each python script in the root directory we write an equivalent cluster script
 	pyscripts = glob.glob('script-*.py')
 	if len(pyscripts)>0: 
@@ -438,6 +463,38 @@ def submit():
 	print('[STATUS] running "%s"'%cmd)
 	subprocess.check_call(cmd,cwd=here,shell=True)
 
+def chain(until=None,hostname=None,scheduler=None,jobs=20):
+	"""
+	Submit a chain of jobs which continue the simulation in the last step until it reaches `until` (in ps).
+	Each job submits its successor with a dependency on itself when it starts, and the chain stops when the 
+	target time is reached, a part fails, or a job makes no progress. The scheduler (slurm, pbs, or local for 
+	testing) is inferred from the submit_command in the machine configuration. Without `until` we report the 
+	status of the chain in the last step.
+	"""
+	amx = get_amx()
+	here = amx.state.here
+	from amx.gromacs.schedulers import chain_begin,chain_read,chain_fn
+	if until==None:
+		chain = chain_read(os.path.join(here,chain_fn))
+		asciitree({'chain in %s'%here:{'status':chain['status'],'until':'%s ps'%chain['until'],
+			'scheduler':chain['scheduler'],'jobs':dict([('%02d %s'%(ii+1,i['id']),'%s%s'%(i['status'],
+			' at %s ps'%i['time'] if i.get('time',None)!=None else '')) for ii,i in enumerate(chain['jobs'])])}})
+		return
+	from amx.gromacs.calls import gmx_get_machine_config
+	machine_configuration = gmx_get_machine_config(hostname=hostname)
+	submit_command = machine_configuration.get('submit_command',None) if scheduler!='local' else None
+	if scheduler!='local' and 'cluster_header' in machine_configuration:
+		#---cluster writes the continuation script and the header with the settings for this machine
+		cluster(hostname=hostname)
+		with open(os.path.join(here,'cluster-header.sh')) as fp: header = fp.read()
+	else:
+		write_continue_script(hostname=hostname)
+		header = '#!/bin/bash\n'
+	chain = chain_begin(until,scheduler=scheduler,header=header,here=here,max_jobs=jobs,
+		submit_command=submit_command)
+	print('[STATUS] started a %s chain in %s until %s ps. use `make chain` for the status'%(
+		chain['scheduler'],here,until))
+
 def notebook(procedure,rewrite=False,go=False,name='notebook.ipynb'):
 	"""
 	Make an IPython notebook for a particular procedure.
@@ -580,11 +637,463 @@ def hardstart():
 	get_gmx_paths = import_remote('amx/gromacs/calls.py')['gmx_get_paths']
 	gmxpaths = get_gmx_paths()
 	state = dict(here=here,gmxpaths=gmxpaths)
-	state['history_gmx'] = [{'call':'mdrun','flags':{}}]
-	#---detect the last mdrun by modification time
+	last_mdrun = {'call':'mdrun','flags':{}}
+	#---detect the last mdrun by the step in each checkpoint since copies lose their modification times
+	cpt_progress = import_remote('amx/gromacs/cpt.py')['cpt_progress']
+	def cpt_order(fn):
+		try: return (cpt_progress(fn)['step'],os.path.getmtime(fn))
+		except: return (-1,os.path.getmtime(fn))
 	for suf in ['cpt','tpr']:
 		fns = sorted([fn for fn in glob.glob(os.path.join(here,'*.%s'%suf)) 
-			if re.match('md\.part\d{4}\.%s'%suf,os.path.basename(fn))],key=lambda x:os.path.getmtime(x))
+			if re.match('md\.part\d{4}\.%s'%suf,os.path.basename(fn))],
+			key=cpt_order if suf=='cpt' else lambda x:os.path.getmtime(x))
 		if not fns: raise Exception('cannot find a %s file in %s'%(suf,here))
-		state['history_gmx'][-1]['flags'][{'cpt':'-cpo','tpr':'-s'}[suf]] = os.path.basename(fns[-1])
+		last_mdrun['flags'][{'cpt':'-cpo','tpr':'-s'}[suf]] = os.path.basename(fns[-1])
+	#---the run input must belong to the checkpoint
+	tpr = re.sub(r'\.cpt$','.tpr',last_mdrun['flags']['-cpo'])
+	if os.path.isfile(os.path.join(here,tpr)): last_mdrun['flags']['-s'] = tpr
+	try: 
+		progress = cpt_progress(os.path.join(here,last_mdrun['flags']['-cpo']))
+		print('[STATUS] restarting from %s at step %d (%.1f ps)'%(
+			last_mdrun['flags']['-cpo'],progress['step'],progress['time']))
+	except Exception as e: print('[WARNING] cannot read the checkpoint: %s'%e)
+	#---record the restart files as the last mdrun in a new gmx journal
+	journal = import_remote('amx/gromacs/journal.py')
+	journal_fn = os.path.realpath(journal['gmx_journal_fn'])
+	n = journal['gmx_journal_open'](journal_fn).append(last_mdrun,step=os.path.basename(dns[-1]),here=here)
+	state['gmx_journal'] = {'path':journal_fn,'count':n+1}
 	with open('state.json','w') as fp: fp.write(json.dumps(state))
+
+def cache(what='stats',size=None,where=None,which='gmx'):
+	"""
+	Manage the content-addressed cache of GROMACS preprocessing calls (enable it with the gmx_cache setting).
+	Use `make cache stats` for a summary or `make cache prune size=<MB>` to evict the least-recently used calls.
+	Use which=topology for the cache of parsed topologies (disable it with the topology_cache setting).
+	"""
+	if what not in ['stats','prune']: raise Exception('usage: `make cache stats` or `make cache prune`')
+	if which not in ['gmx','topology']: raise Exception('which must be gmx or topology')
+	amx = get_amx()
+	if which=='topology':
+		from amx.gromacs.topology_cache import GMXTopologyCache
+		root = where if where else amx.state.get('topology_cache_dir',
+			amx.settings.get('topology_cache_dir',None))
+		if not root: root = amx.cache_dir('topology_cache')
+		store = GMXTopologyCache(root,size_limit=amx.state.get('topology_cache_size',
+			amx.settings.get('topology_cache_size',256)))
+		if what=='prune':
+			evicted = store.prune(size_limit=size)
+			print('[STATUS] evicted %d topologies from the topology cache'%len(evicted))
+		asciitree({'topology cache':store.stats()})
+		return
+	root = where if where else amx.state.get('gmx_cache_dir',amx.settings.get('gmx_cache_dir',None))
+	if not root: root = amx.cache_dir('gmx_cache')
+	store = amx.GMXCallCache(root,size_limit=amx.state.get('gmx_cache_size',
+		amx.settings.get('gmx_cache_size',2048)))
+	if what=='prune':
+		evicted = store.prune(size_limit=size)
+		print('[STATUS] evicted %d calls from the gmx cache'%len(evicted))
+	asciitree({'gmx cache':store.stats()})
+
+def profile(collapsed=None):
+	"""
+	Summarize the resources used by each step, reported function, and GROMACS utility.
+	Reads the profiles written by call_reporter to profile.jsonl (or saved in the states by older versions) and
+	the gmx calls from state.json, all state_*.json files, and the gmx journal.
+	Use `make profile collapsed=<file>` to write a flamegraph-compatible collapsed-stack file (milliseconds).
+	"""
+	fns = sorted(glob.glob('state_*.json'),key=lambda x:int(re.findall(r'state_(\d+)\.json',x)[0])
+		if re.match(r'^state_\d+\.json$',x) else 0)
+	if os.path.isfile('state.json'): fns.append('state.json')
+	if not fns and not os.path.isfile('profile.jsonl'): raise Exception('cannot find any states to profile')
+	#---states carry the history forward so we remove duplicates
+	records,gmx_calls,journal_fns = {},{},set()
+	if os.path.isfile('profile.jsonl'):
+		with open('profile.jsonl') as fp:
+			for line in fp:
+				try: record = json.loads(line)
+				except: continue
+				records[(record['step'],record['id'],record['name'])] = record
+	for fn in fns:
+		with open(fn) as fp: state = json.load(fp)
+		for record in state.get('history_profile',[]):
+			if 'wall' in record: records[(record['step'],record['id'],record['name'])] = record
+		for call in state.get('history_gmx',[]):
+			if 'profile' in call: gmx_calls[json.dumps(call,sort_keys=True)] = call
+		if 'gmx_journal' in state: journal_fns.add(state['gmx_journal']['path'])
+	#---calls recorded in the gmx journal are unique
+	for journal_fn in journal_fns:
+		if not os.path.isfile(journal_fn): continue
+		with open(journal_fn) as fp:
+			for ii,line in enumerate(fp):
+				try: call = json.loads(line)
+				except: continue
+				if 'profile' in call: gmx_calls[(journal_fn,ii)] = call
+	records = list(records.values())
+	#---self time excludes the time spent in reported children. ids are only unique within a step
+	children = {}
+	for record in records:
+		key = (record['step'],record['parent'])
+		children[key] = children.get(key,0.)+record['wall']
+	for record in records: 
+		record['self'] = max(0.,record['wall']-children.get((record['step'],record['id']),0.))
+	def tally(groups,name,record,wall='wall'):
+		if name not in groups: groups[name] = {'calls':0,'wall':0.,'cpu':0.,'maxrss':0,'bytes':0}
+		group = groups[name]
+		group['calls'] += 1
+		group['wall'] += record[wall]
+		group['cpu'] += record.get('cpu_children',record.get('cpu',0.))+record.get('cpu_self',0.)
+		group['maxrss'] = max(group['maxrss'],record.get('maxrss_children',record.get('maxrss',0)))
+		group['bytes'] += record.get('bytes_written',0)
+	by_step,by_function,by_tool = {},{},{}
+	for record in records:
+		if record['parent']==None: tally(by_step,str(record['step']),record)
+		tally(by_function,record['name'],record,wall='self')
+	for call in gmx_calls.values(): tally(by_tool,call['call'],call['profile'])
+	def report(title,groups):
+		print('[STATUS] %s'%title)
+		print('%-32s %6s %10s %10s %10s %10s'%('name','calls','wall (s)','cpu (s)','peak (MB)','write (MB)'))
+		for name,group in sorted(groups.items(),key=lambda x:-x[1]['wall']):
+			print('%-32s %6d %10.2f %10.2f %10.1f %10.1f'%(name,group['calls'],group['wall'],group['cpu'],
+				group['maxrss']/1024.,group['bytes']/1024.**2))
+	report('time by step',by_step)
+	report('self time by reported function',by_function)
+	report('time by GROMACS utility',by_tool)
+	if collapsed:
+		stacks = {}
+		for record in records:
+			stack = ';'.join([str(record['step'])]+record['stack'].split(';'))
+			if record.get('tool',None): stack += ':%s'%record['tool']
+			stacks[stack] = stacks.get(stack,0)+int(round(record['self']*1000))
+		with open(collapsed,'w') as fp:
+			for stack,value in sorted(stacks.items()): fp.write('%s %d\n'%(stack,value))
+		print('[STATUS] wrote collapsed stacks to %s'%collapsed)
+
+def tune_mdrun(tpr=None,nsteps=2000,timeout=600,nt=None,ntmpi=None,npme=None,pin='on',
+	trials=24,hostname=None,dry=False):
+	"""
+	Run short mdrun trials over a grid of launch options and save the fastest in the machine configuration.
+	Uses the TPR from the last mdrun (or the newest TPR) in the current step unless you send tpr. Send
+	space-separated options for ntmpi, npme, or pin (e.g. `make tune_mdrun ntmpi="1 2 4" pin="on auto"`) to
+	override the default grid over all thread-MPI splits of nt cores. The winning flags are written to the
+	gromacs configuration as `mdrun_tuned` for this machine and are then used by gmx_get_paths and the
+	continuation script. Use `dry` to report the trials without changing the configuration.
+	"""
+	amx = get_amx()
+	#---! a rare connection down to gromacs which needs to be revised
+	from amx.gromacs.calls import gmx_get_machine_config,gmx_set_machine_config,gmx_mdrun_tune_grid
+	from amx.gromacs.gromacs_commands import gmx_get_last_call
+	from amx.gromacs.mdlog import gmx_mdlog_parse
+	here = amx.state.get('here','./')
+	if not tpr:
+		try: tpr = os.path.join(here,gmx_get_last_call('mdrun',this_state=amx.state)['flags']['-s'])
+		except: 
+			tprs = sorted(glob.glob(os.path.join(here,'*.tpr')),key=lambda x:os.path.getmtime(x))
+			if not tprs: raise Exception('cannot find a tpr in %s. send one with `make tune_mdrun tpr=<path>`'%here)
+			tpr = tprs[-1]
+	if not os.path.isfile(tpr): raise Exception('cannot find tpr %s'%tpr)
+	tpr = os.path.abspath(tpr)
+	machine_config = gmx_get_machine_config(hostname=hostname)
+	if 'mdrun_command' in machine_config: 
+		raise Exception('the trials use thread-MPI flags which do not apply to the mdrun_command for this machine')
+	#---gmx_get_paths from amx uses the toolchain cache because it has the state and cache_dir
+	gmxpaths = amx.gmx_get_paths(hostname=hostname)
+	#---remove any launch flags from mdrun so that the trials control them
+	mdrun = re.sub(r'\s+-(nt|ntmpi|ntomp|npme|pin)\s+\S+','',gmxpaths['mdrun'])
+	if not nt: 
+		import multiprocessing
+		nt = machine_config.get('nprocs',None) or multiprocessing.cpu_count()
+	nt = int(nt)
+	grid = gmx_mdrun_tune_grid(nt,ntmpi=ntmpi,npme=npme,pin=pin)
+	if len(grid)>int(trials):
+		print('[WARNING] running the first %d of %d trials (set trials to run more)'%(int(trials),len(grid)))
+		grid = grid[:int(trials)]
+	tune_dn = os.path.join(here,'tune-mdrun')
+	if not os.path.isdir(tune_dn): os.mkdir(tune_dn)
+	results = []
+	for num,flags in enumerate(grid):
+		trial_dn = os.path.join(tune_dn,'trial%02d'%num)
+		if os.path.isdir(trial_dn): shutil.rmtree(trial_dn)
+		os.mkdir(trial_dn)
+		cmd = '%s -s %s -deffnm tune -nsteps %d -resethway -noconfout %s'%(mdrun,tpr,int(nsteps),flags)
+		print('[STATUS] trial %d/%d: %s'%(num+1,len(grid),flags))
+		start = time.time()
+		with open(os.path.join(trial_dn,'log-mdrun'),'w') as log:
+			proc = subprocess.Popen(cmd,shell=True,executable='/bin/bash',cwd=trial_dn,
+				stdout=log,stderr=log,preexec_fn=os.setsid)
+			#---trials are bounded by the step count and the timeout
+			while proc.poll()==None and time.time()-start<float(timeout): time.sleep(0.1)
+			if proc.poll()==None:
+				import signal
+				os.killpg(proc.pid,signal.SIGTERM)
+				proc.wait()
+		perf = gmx_mdlog_parse(os.path.join(trial_dn,'tune.log'))
+		performance = perf['ns/day'] if perf else None
+		results.append({'flags':flags,'ns/day':performance,'wall':time.time()-start,'returncode':proc.returncode})
+		#---keep the logs but not the outputs
+		for fn in glob.glob(os.path.join(trial_dn,'*')):
+			if os.path.basename(fn) not in ['tune.log','log-mdrun']: os.remove(fn)
+	with open(os.path.join(tune_dn,'tune.json'),'w') as fp: json.dump({'tpr':tpr,'results':results},fp)
+	print('%-48s %10s %10s'%('flags','ns/day','wall (s)'))
+	for result in sorted(results,key=lambda x:-(x['ns/day'] or 0)):
+		print('%-48s %10s %10.1f'%(result['flags'],'%.3f'%result['ns/day'] 
+			if result['ns/day']!=None else 'failed',result['wall']))
+	valid = [i for i in results if i['ns/day']!=None]
+	if not valid: raise Exception('every mdrun trial failed. see the logs in %s'%tune_dn)
+	best = max(valid,key=lambda x:x['ns/day'])
+	print('[STATUS] fastest launch configuration: %s (%.3f ns/day)'%(best['flags'],best['ns/day']))
+	if not dry:
+		config_fn,this_machine = gmx_set_machine_config('mdrun_tuned',best['flags'],hostname=hostname)
+		print('[STATUS] wrote mdrun_tuned for machine %s to %s'%(this_machine,config_fn))
+
+def perf(step=None,threshold=10,save=None):
+	"""
+	Report mdrun throughput for each part in each step and flag regressions between consecutive parts.
+	Reads the performance recorded by gmx in the gmx journal and parses any other mdrun logs in the step
+	folders (e.g. parts written by script-continue.sh). A regression is a drop in ns/day larger than the 
+	threshold (percent) from the previous part in the same step. Use save=<file> to write the results as JSON.
+	"""
+	from makeface import import_remote
+	gmx_mdlog_parse = import_remote('amx/gromacs/mdlog.py')['gmx_mdlog_parse']
+	dns = sorted([fn for fn in glob.glob('s*-*') if re.match(r'^s\d+-.+$',fn) and os.path.isdir(fn)],
+		key=lambda x:int(re.match(r'^s(\d+)-',x).group(1)))
+	if step: dns = [i for i in dns if re.search(step,i)]
+	if not dns: raise Exception('cannot find any steps')
+	#---performance recorded by gmx is reused so we only parse the logs from other sources
+	recorded = {}
+	if os.path.isfile('state.json'):
+		with open('state.json') as fp: pointer = json.load(fp).get('gmx_journal',None)
+		if pointer and os.path.isfile(pointer['path']):
+			with open(pointer['path']) as fp:
+				for line in fp:
+					try: call = json.loads(line)
+					except: continue
+					if call.get('call',None)=='mdrun' and call.get('perf',None) and '-g' in call['flags']:
+						recorded[os.path.abspath(os.path.join(call.get('cwd',call.get('here','.')),
+							call['flags']['-g']))] = call['perf']
+	def part_order(fn):
+		part = re.search(r'part(\d+)',os.path.basename(fn))
+		return (os.path.getmtime(fn),int(part.group(1)) if part else 0)
+	results,regressions = [],[]
+	for dn in dns:
+		prev = None
+		for fn in sorted(glob.glob(os.path.join(dn,'*.log')),key=part_order):
+			this = recorded.get(os.path.abspath(fn),None) or gmx_mdlog_parse(fn)
+			if not this: continue
+			result = {'step':dn,'log':os.path.basename(fn),'ns/day':this['ns/day'],
+				'pme_load':this.get('pme_load',None),'dd_imbalance':this.get('dd_imbalance',None),
+				'steps':this.get('steps',None),'change':None}
+			costs = [i for i in this.get('accounting',[]) if i['name'] not in ['Total','Rest']]
+			if costs: result['top'] = '%s (%.0f%%)'%tuple(max(costs,key=lambda x:x['percent'])[i] 
+				for i in ['name','percent'])
+			if prev and prev['ns/day']>0:
+				result['change'] = (this['ns/day']-prev['ns/day'])/prev['ns/day']*100.
+				if result['change']<-float(threshold): regressions.append(result)
+			results.append(result)
+			prev = result
+	if not results: raise Exception('cannot find any mdrun logs with performance data')
+	def show(value,form): return form%value if value!=None else '-'
+	print('%-24s %-24s %10s %8s %8s %8s  %s'%('step','log','ns/day','change','PME','DD (%)','largest cost'))
+	for result in results:
+		flag = ' '+fab('[REGRESSION]','red_black') if result in regressions else ''
+		print('%-24s %-24s %10.3f %8s %8s %8s  %s%s'%(result['step'][:24],result['log'][:24],result['ns/day'],
+			show(result['change'],'%+.1f%%'),show(result['pme_load'],'%.3f'),
+			show(result['dd_imbalance'],'%.1f'),result.get('top','-'),flag))
+	summary = {}
+	for dn in dns:
+		values = [i['ns/day'] for i in results if i['step']==dn]
+		if values: summary[dn] = {'parts':len(values),'mean ns/day':'%.3f'%(sum(values)/len(values)),
+			'min':'%.3f'%min(values),'max':'%.3f'%max(values)}
+	asciitree({'mdrun performance':summary})
+	if regressions:
+		print(fab('[WARNING]','white_black')+' %d parts dropped by more than %s%% from the previous part: %s'%(
+			len(regressions),threshold,', '.join(['%s/%s'%(i['step'],i['log']) for i in regressions])))
+	if save:
+		with open(save,'w') as fp: json.dump({'results':results,'regressions':regressions},fp)
+		print('[STATUS] wrote performance results to %s'%save)
+
+def progress(step=None):
+	"""
+	Report the current step and time of the latest checkpoint in each step folder without GROMACS.
+	The target time comes from a resubmission chain (see `make chain`) if there is one.
+	"""
+	from makeface import import_remote
+	cpt_progress = import_remote('amx/gromacs/cpt.py')['cpt_progress']
+	dns = sorted([fn for fn in glob.glob('s*-*') if re.match(r'^s\d+-.+$',fn) and os.path.isdir(fn)],
+		key=lambda x:int(re.match(r'^s(\d+)-',x).group(1)))
+	if step: dns = [i for i in dns if re.search(step,i)]
+	if not dns: raise Exception('cannot find any steps')
+	report = {}
+	for dn in dns:
+		found = []
+		for fn in glob.glob(os.path.join(dn,'*.cpt')):
+			try: found.append((cpt_progress(fn),fn))
+			except Exception as e: report.setdefault(dn,{})[os.path.basename(fn)] = 'unreadable: %s'%e
+		if not found: continue
+		latest,fn = max(found,key=lambda x:(x[0]['step'],os.path.getmtime(x[1])))
+		this = {'checkpoint':os.path.basename(fn),'step':'%d'%latest['step'],
+			'time':'%.1f ps'%latest['time'],'part':'%d'%latest['part'],'atoms':'%d'%latest['natoms'],
+			'age':'%.1f minutes'%((time.time()-os.path.getmtime(fn))/60.)}
+		if os.path.isfile(os.path.join(dn,'chain.json')):
+			with open(os.path.join(dn,'chain.json')) as fp: chain = json.load(fp)
+			this['chain'] = '%s until %.1f ps (%.0f%%)'%(chain['status'],chain['until'],
+				100.*latest['time']/chain['until'] if chain['until'] else 0)
+		report.setdefault(dn,{}).update(**this)
+	if not report: raise Exception('cannot find any checkpoints')
+	asciitree({'progress':report})
+
+def topology_benchmark(ff=None,repeats=3,files=None):
+	"""
+	Time the line and regex ITP parsers on the force field files in the landscape specification and check that 
+	they return the same molecules. Use ff=<charmm|martini> to select a force field or files=<glob> for others.
+	We also check that the streaming ITP writer reproduces the output of the original writer byte for byte.
+	"""
+	amx = get_amx()
+	from amx.gromacs.topology_tools import GMXTopology
+	from amx.gromacs.force_field_tools import landscape_spec
+	if files: fns = sorted(glob.glob(files))
+	else:
+		exprs = [expr for key,cats in landscape_spec.items() if not ff or key==ff 
+			for spec in cats.values() for expr in ([spec['files']] if type(spec['files'])!=list else spec['files'])]
+		fns = sorted(set([fn for expr in exprs for fn in glob.glob(expr)]))
+	if not fns: raise Exception('cannot find any ITP files to parse')
+	def best(fn,parser):
+		times = []
+		for i in range(int(repeats)):
+			start = time.time()
+			top = GMXTopology(fn,parser=parser,cache=False)
+			times.append(time.time()-start)
+		return min(times),top
+	import tempfile
+	tmpdir = tempfile.mkdtemp()
+	print('%-48s %10s %10s %8s  %s'%('file','regex (ms)','lines (ms)','speedup','match'))
+	totals,mismatches = [0.,0.],[]
+	for fn in fns:
+		(t_regex,top_regex),(t_lines,top_lines) = best(fn,'regex'),best(fn,'lines')
+		match = top_regex.molecules==top_lines.molecules
+		#---compare the writers
+		written = []
+		for method in ['write','write_legacy']:
+			fn_out = os.path.join(tmpdir,method+'.itp')
+			getattr(top_lines,method)(fn_out,overwrite=True)
+			with open(fn_out,'rb') as fp: written.append(fp.read())
+		match = match and written[0]==written[1]
+		if not match: mismatches.append(fn)
+		totals[0] += t_regex
+		totals[1] += t_lines
+		print('%-48s %10.2f %10.2f %8.1f  %s'%(fn[-48:],t_regex*1000,t_lines*1000,
+			t_regex/t_lines if t_lines else 0,'yes' if match else fab('NO','red_black')))
+	print('[STATUS] parsed %d files in %.1f ms (regex) and %.1f ms (lines)'%(
+		len(fns),totals[0]*1000,totals[1]*1000))
+	shutil.rmtree(tmpdir)
+	if mismatches:
+		print(fab('[WARNING]','white_black')+' the parsers or writers disagree on: %s'%', '.join(mismatches))
+
+def ensemble_points(sweep=None):
+	"""
+	Interpret a sweep as a list of settings overrides.
+	The sweep is either "key:value value ..." or a JSON file with a dictionary of lists (we run every
+	combination) or a list of dictionaries (we run each one).
+	"""
+	if not sweep: return [{}]
+	if os.path.isfile(sweep):
+		with open(sweep) as fp: spec = json.load(fp)
+	elif re.match(r'^\w+:',sweep):
+		key,values = re.match(r'^(\w+):(.*)$',sweep).groups()
+		spec = {key:values.split()}
+	else: raise Exception('sweep must be "key:value value ..." or a JSON file: %s'%sweep)
+	if type(spec)==list: return spec
+	import itertools
+	keys = sorted(spec.keys())
+	return [dict(zip(keys,values)) for values in itertools.product(*[spec[k] for k in keys])]
+
+def ensemble_override(text,overrides):
+	"""
+	Add overrides to a settings_overrides block, replacing any lines with the same keys.
+	"""
+	lines = [i for i in (text or '').splitlines() if not any([re.match(r'^\s*%s\s*:'%re.escape(k),i) 
+		for k in overrides])]
+	return '\n'.join(lines+['%s: %s'%(k,v) for k,v in sorted(overrides.items())])+'\n'
+
+def ensemble_throughput(dn):
+	"""
+	Get the throughput of the latest mdrun log in a job folder.
+	"""
+	from makeface import import_remote
+	gmx_mdlog_parse = import_remote('amx/gromacs/mdlog.py')['gmx_mdlog_parse']
+	fns = sorted(glob.glob(os.path.join(dn,'s*-*','*.log')),key=lambda x:os.path.getmtime(x))
+	for fn in fns[::-1]:
+		perf = gmx_mdlog_parse(fn)
+		if perf: return {'ns/day':perf['ns/day'],'log':os.path.relpath(fn,dn),'parts':len(fns)}
+	return None
+
+def ensemble(procname,replicas=1,sweep=None,cores=None,threads=1,where='ensemble',clean=False,poll=5):
+	"""
+	Run many copies of an experiment concurrently under a core budget.
+	Each job gets an isolated folder in `where` with its own configuration and links to the shared code
+	(everything in this folder except for simulation products listed in the cleanup setting). Use replicas
+	for repeated runs and sweep for settings overrides (see ensemble_points). Jobs start in order whenever 
+	their thread count fits in the budget (all cores by default) and each job sets AMX_NPROCS so that mdrun 
+	uses only its own threads. Run `./script-stop-ensemble.sh` to stop the scheduler and the running jobs. 
+	The status and throughput of each job are written to summary.json in `where`.
+	"""
+	import multiprocessing
+	from control import prep,read_config,schedule
+	cores = int(cores) if cores else multiprocessing.cpu_count()
+	threads,replicas = int(threads),int(replicas)
+	if threads>cores: raise Exception('each job uses %d threads but the budget is %d cores'%(threads,cores))
+	if clean and os.path.isdir(where): shutil.rmtree(where)
+	#---prepare the experiment once and copy it into each job
+	config = read_config()
+	products = [fn for pat in config.get('cleanup',[]) for fn in glob.glob(pat)]
+	if any([re.match(r'^(script|expt)(_\d+)?\.(py|json)$',i) for i in products]):
+		raise Exception('refusing to run an ensemble if script or expt files are here. use `make clean` first')
+	prep(procname)
+	prepared = [i for i in glob.glob('script*.py')+glob.glob('expt*.json') 
+		if re.match(r'^(script|expt)(_\d+)?\.(py|json)$',i)]
+	runtype = 'metarun' if any([re.match(r'^script_\d+\.py$',i) for i in prepared]) else 'run'
+	#---link everything except products and the ensemble itself
+	shared = [fn for fn in glob.glob('*') if fn not in products+prepared+[where,'config.py'] 
+		and not fn.startswith('script-stop-')]
+	jobs = []
+	for pnum,point in enumerate(ensemble_points(sweep)):
+		for rnum in range(replicas):
+			name = procname+''.join(['-%s%s'%(k,v) for k,v in sorted(point.items())])+\
+				('-r%02d'%(rnum+1) if replicas>1 else '')
+			jobs.append({'name':re.sub(r'[^\w\-\.]','_',name),'overrides':point,'threads':threads,
+				'status':'pending'})
+	if not os.path.isdir(where): os.mkdir(where)
+	summary_fn = os.path.join(where,'summary.json')
+	previous = {}
+	if os.path.isfile(summary_fn):
+		with open(summary_fn) as fp: previous = dict([(i['name'],i) for i in json.load(fp)['jobs']])
+	for job in jobs:
+		job['dn'] = os.path.join(where,job['name'])
+		#---completed jobs are skipped so that an interrupted ensemble can be resumed
+		if previous.get(job['name'],{}).get('status',None)=='done':
+			job.update(**previous[job['name']])
+			continue
+		if os.path.isdir(job['dn']): 
+			raise Exception('found an incomplete job at %s. use `make ensemble ... clean` to start over'%job['dn'])
+		os.mkdir(job['dn'])
+		for fn in shared: os.symlink(os.path.relpath(os.path.abspath(fn),job['dn']),os.path.join(job['dn'],fn))
+		shutil.copyfile('config.py',os.path.join(job['dn'],'config.py'))
+		for fn in prepared:
+			if fn.startswith('expt') and job['overrides']:
+				with open(fn) as fp: expt = json.load(fp)
+				expt['settings_overrides'] = ensemble_override(expt.get('settings_overrides',None),job['overrides'])
+				with open(os.path.join(job['dn'],fn),'w') as fp: json.dump(expt,fp)
+			else: shutil.copyfile(fn,os.path.join(job['dn'],fn))
+	for fn in prepared: os.remove(fn)
+	def report():
+		for job in jobs: 
+			if job['status'] in ['running','done','failed']: job['throughput'] = ensemble_throughput(job['dn'])
+		with open(summary_fn,'w') as fp: 
+			json.dump({'procname':procname,'cores':cores,'runtype':runtype,
+				'jobs':[dict([(k,v) for k,v in job.items() if k!='proc']) for job in jobs]},fp)
+	for job in jobs: job.update(command='make %s'%runtype,log=os.path.join(job['dn'],'log-ensemble'))
+	print('[STATUS] running %d jobs with %d threads each on %d cores'%(len(jobs),threads,cores))
+	schedule(jobs,cores,'script-stop-ensemble.sh',poll=poll,update=report)
+	asciitree({'ensemble %s'%procname:dict([(job['name'],{'status':job['status'],
+		'ns/day':'%.3f'%job['throughput']['ns/day'] if job.get('throughput',None) else '-'}) for job in jobs])})
+	if any([i['status']=='failed' for i in jobs]): 
+		raise Exception('some jobs failed. see log-ensemble in each job folder in %s'%where)
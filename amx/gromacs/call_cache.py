@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Content-addressed cache for GROMACS preprocessing calls.
+Calls are keyed by the command, the flags, piped input, and the contents of all input files (including any
+files included by topologies). Outputs are resolved from the output flags of each call (or the GROMACS defaults)
+and stored by content hash so that identical outputs share storage. See gmx_run_cached in calls.py.
+"""
+
+import os,sys,re,json,hashlib,shutil,time,threading,glob
+from topology_cache import GMXTopologyCacheLock
+
+#---input flags for each cacheable utility
+gmx_cache_inputs = {
+	'grompp':['-f','-c','-p','-r','-n','-t'],
+	'editconf':['-f','-n'],
+	'genconf':['-f'],
+	'pdb2gmx':['-f'],
+	'make_ndx':['-f','-n'],
+	'trjconv':['-f','-s','-n'],
+	'genbox':['-cp','-cs','-p'],
+	'solvate':['-cp','-cs','-p'],}
+
+#---output flags for each cacheable utility with the file GROMACS writes when the flag is absent
+#---...outputs without a default are only written when the flag is given
+gmx_cache_outputs = {
+	'grompp':{'-o':'topol.tpr','-po':'mdout.mdp','-pp':None},
+	'editconf':{'-o':'out.gro'},
+	'genconf':{'-o':'out.gro'},
+	'pdb2gmx':{'-o':'conf.gro','-p':'topol.top','-i':'posre.itp','-n':None,'-q':None},
+	'make_ndx':{'-o':'index.ndx'},
+	'trjconv':{'-o':'trajout.xtc'},
+	'genbox':{'-o':'out.gro','-p':None},
+	'solvate':{'-o':'out.gro','-p':None},}
+
+#---pdb2gmx writes one topology and restraint file per chain next to these outputs e.g. topol_Protein_chain_A.itp
+gmx_cache_companions = {'pdb2gmx':{'-p':'.itp','-i':'.itp'}}
+
+#---automacs never edits these outputs in place so it is safe to hardlink them into the store
+gmx_cache_hardlink = ['.tpr','.trr','.xtc','.edr','.cpt']
+
+#---topologies may include other files which are part of the input
+regex_include = re.compile(r'^\s*#include\s+["<](.*?)[">]',re.M)
+
+#---utilities which read force fields from local *.ff folders before the GROMACS share folder
+gmx_cache_forcefields = ['pdb2gmx']
+
+class GMXCallCache:
+	"""
+	A content-addressed store of GROMACS outputs with a manifest of calls and LRU eviction.
+	"""
+	def __init__(self,root,size_limit=2048):
+		self.root = os.path.abspath(os.path.expanduser(root))
+		self.objects = os.path.join(self.root,'objects')
+		self.manifest_fn = os.path.join(self.root,'manifest.json')
+		self.lock_fn = os.path.join(self.root,'manifest.lock')
+		#---size limit is in megabytes
+		self.size_limit = float(size_limit)
+		#---other simulations may make the store at the same time
+		try: os.makedirs(self.objects)
+		except OSError:
+			if not os.path.isdir(self.objects): raise
+		self.lock = threading.Lock()
+		#---file hashes are memoized by path, size, and modification time
+		self.hashes = {}
+	def locked(self):
+		"""Lock the manifest against other threads and other simulations which share the store."""
+		return GMXTopologyCacheLock(self)
+	def manifest(self):
+		"""Read the manifest."""
+		if not os.path.isfile(self.manifest_fn): return {}
+		try:
+			with open(self.manifest_fn) as fp: return json.load(fp)
+		except: return {}
+	def manifest_write(self,manifest):
+		"""Write the manifest atomically because other simulations may share the store."""
+		fn_temp = self.manifest_fn+'.%d.%d'%(os.getpid(),threading.current_thread().ident)
+		with open(fn_temp,'w') as fp: json.dump(manifest,fp)
+		os.rename(fn_temp,self.manifest_fn)
+	def hash_file(self,fn):
+		"""Hash the contents of a file."""
+		stat = os.stat(fn)
+		signature = (os.path.abspath(fn),stat.st_size,stat.st_mtime)
+		if signature not in self.hashes:
+			hasher = hashlib.sha1()
+			with open(fn,'rb') as fp:
+				for chunk in iter(lambda:fp.read(2**20),b''): hasher.update(chunk)
+			self.hashes[signature] = hasher.hexdigest()
+		return self.hashes[signature]
+	def hash_inputs(self,fn,cwd,seen):
+		"""Hash an input file along with any local files it includes."""
+		if fn in seen: return []
+		seen.add(fn)
+		hashes = [(os.path.relpath(fn,cwd),self.hash_file(fn))]
+		if os.path.splitext(fn)[1] in ['.top','.itp']:
+			with open(fn) as fp: text = fp.read()
+			for incl in regex_include.findall(text):
+				#---includes are relative to the including file or the working directory
+				found = [i for i in [os.path.join(os.path.dirname(fn),incl),os.path.join(cwd,incl)]
+					if os.path.isfile(i)]
+				#---includes from the GROMACS share folder are covered by the version in the key
+				if not found: hashes.append((incl,None))
+				else: hashes.extend(self.hash_inputs(os.path.abspath(found[0]),cwd,seen))
+		return hashes
+	def hash_folder(self,dn,cwd):
+		"""Hash every file in a folder."""
+		hashes = []
+		for root,dns,fns in os.walk(dn):
+			dns.sort()
+			hashes.extend([(os.path.relpath(os.path.join(root,fn),cwd),self.hash_file(os.path.join(root,fn)))
+				for fn in sorted(fns)])
+		return hashes
+	def key(self,program,cmd,recorded,cwd,inpipe=None,version=None):
+		"""
+		Make a key for a call or return None if the call cannot be cached.
+		"""
+		if program not in gmx_cache_inputs: return None
+		inputs = []
+		for flag in gmx_cache_inputs[program]:
+			if flag not in recorded['flags']: continue
+			fn = os.path.join(cwd,str(recorded['flags'][flag]))
+			#---missing inputs mean that the call will fail or is not what we expect
+			if not os.path.isfile(fn): return None
+			inputs.append((flag,self.hash_inputs(os.path.abspath(fn),os.path.abspath(cwd),set())))
+		#---local force fields may be chosen with -ff or from the menu so we hash all of them
+		if program in gmx_cache_forcefields:
+			for dn in sorted(glob.glob(os.path.join(cwd,'*.ff'))):
+				if os.path.isdir(dn): inputs.append((os.path.basename(dn),self.hash_folder(dn,os.path.abspath(cwd))))
+		signature = json.dumps([program,cmd,inpipe,version,inputs],sort_keys=True)
+		return hashlib.sha1(signature.encode()).hexdigest()
+	def outputs(self,program,recorded,cwd):
+		"""Resolve the output files of a call from its flags."""
+		paths,patterns = [],[]
+		for flag,default in gmx_cache_outputs.get(program,{}).items():
+			if flag in recorded['flags']: fn = str(recorded['flags'][flag])
+			elif default: fn = default
+			else: continue
+			#---gromacs adds the default extension to names without one
+			if default and not os.path.splitext(fn)[1]: fn += os.path.splitext(default)[1]
+			path = os.path.abspath(os.path.join(cwd,fn))
+			paths.append(path)
+			if flag in gmx_cache_companions.get(program,{}):
+				base = os.path.splitext(path)[0]
+				if hasattr(glob,'escape'): base = glob.escape(base)
+				patterns.append(base+'_*'+gmx_cache_companions[program][flag])
+		return paths,patterns
+	def snapshot(self,program,recorded,cwd):
+		"""Record the output files of a call so we can tell which ones it wrote."""
+		paths,patterns = self.outputs(program,recorded,cwd)
+		snap = {}
+		for path in paths+[i for j in patterns for i in glob.glob(j)]:
+			if os.path.isfile(path):
+				stat = os.stat(path)
+				snap[path] = (stat.st_size,stat.st_mtime)
+			else: snap[path] = None
+		return snap
+	def object_path(self,sha):
+		"""Location of an object in the store."""
+		return os.path.join(self.objects,sha[:2],sha[2:])
+	def object_put(self,fn):
+		"""Add a file to the store and return its hash."""
+		sha = self.hash_file(fn)
+		dest = self.object_path(sha)
+		if not os.path.isfile(dest):
+			if not os.path.isdir(os.path.dirname(dest)): os.makedirs(os.path.dirname(dest))
+			fn_temp = dest+'.%d'%os.getpid()
+			shutil.copyfile(fn,fn_temp)
+			os.rename(fn_temp,dest)
+		return sha
+	def object_get(self,sha,dest):
+		"""Restore an object from the store to a destination."""
+		source = self.object_path(sha)
+		if os.path.isfile(dest) or os.path.islink(dest): os.remove(dest)
+		if os.path.splitext(dest)[1] in gmx_cache_hardlink:
+			try:
+				os.link(source,dest)
+				return
+			except OSError: pass
+		shutil.copyfile(source,dest)
+	def restore(self,key,cwd,log_fn):
+		"""Restore the outputs and log for a call. Returns True on a hit."""
+		with self.locked():
+			manifest = self.manifest()
+			if key not in manifest: return False
+			entry = manifest[key]
+			if not all([os.path.isfile(self.object_path(sha)) for sha in
+				list(entry['outputs'].values())+[entry['log']]]): return False
+			#---outputs are relative to the working directory unless the call wrote them elsewhere
+			if not all([os.path.isdir(os.path.dirname(os.path.join(cwd,fn))) for fn in entry['outputs']]): return False
+			for fn,sha in entry['outputs'].items(): self.object_get(sha,os.path.join(cwd,fn))
+			#---the log is always copied because automacs reads some logs for results
+			self.object_get(entry['log'],log_fn)
+			entry['used'],entry['hits'] = time.time(),entry.get('hits',0)+1
+			self.manifest_write(manifest)
+		return True
+	def store(self,key,program,recorded,cwd,before,log_fn):
+		"""Store the outputs of a successful call."""
+		after = self.snapshot(program,recorded,cwd)
+		#---only the outputs written by this call are stored so concurrent calls in one folder stay separate
+		cwd_abs = os.path.join(os.path.abspath(cwd),'')
+		outputs = dict([(path[len(cwd_abs):] if path.startswith(cwd_abs) else path,path) 
+			for path,stat in after.items() if stat and before.get(path,None)!=stat])
+		with self.locked():
+			entry = {'program':program,'created':time.time(),'used':time.time(),'hits':0,
+				'outputs':dict([(fn,self.object_put(path)) for fn,path in outputs.items()]),
+				'log':self.object_put(log_fn)}
+			manifest = self.manifest()
+			manifest[key] = entry
+			self.manifest_write(manifest)
+		if self.size()>self.size_limit: self.prune()
+	def size(self):
+		"""Total size of the store in megabytes."""
+		total = 0
+		for root,dns,fns in os.walk(self.objects):
+			total += sum([os.path.getsize(os.path.join(root,fn)) for fn in fns])
+		return total/1024.**2
+	def prune(self,size_limit=None):
+		"""Evict the least-recently used calls until the store is under the size limit."""
+		limit = self.size_limit if size_limit==None else float(size_limit)
+		with self.locked():
+			manifest = self.manifest()
+			object_sizes = {}
+			for root,dns,fns in os.walk(self.objects):
+				for fn in fns: object_sizes[os.path.basename(root)+fn] = os.path.getsize(os.path.join(root,fn))
+			def referenced(entries):
+				return set([sha for i in entries for sha in list(i['outputs'].values())+[i['log']]])
+			order = sorted(manifest,key=lambda k:manifest[k].get('used',0))
+			evicted = []
+			while order and sum([object_sizes.get(i,0) for i in
+				referenced(manifest.values())])/1024.**2>limit:
+				key = order.pop(0)
+				evicted.append(key)
+				del manifest[key]
+			keep = referenced(manifest.values())
+			for sha in [i for i in object_sizes if i not in keep]:
+				try: os.remove(self.object_path(sha))
+				except OSError: pass
+			self.manifest_write(manifest)
+		return evicted
+	def stats(self):
+		"""Summarize the store."""
+		manifest = self.manifest()
+		programs = {}
+		for key,entry in manifest.items():
+			if entry['program'] not in programs: programs[entry['program']] = {'calls':0,'hits':0}
+			programs[entry['program']]['calls'] += 1
+			programs[entry['program']]['hits'] += entry.get('hits',0)
+		return {'root':self.root,'calls':len(manifest),'size (MB)':'%.1f'%self.size(),
+			'limit (MB)':'%.1f'%self.size_limit,'programs':programs}
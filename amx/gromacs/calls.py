@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 
 #---see amx/__init__.py for the import instructions
-import os,sys,re,subprocess,shutil,glob
+import os,sys,re,subprocess,shutil,glob,json,hashlib,time,errno
+from call_cache import GMXCallCache,gmx_cache_inputs
+from journal import gmx_journal_open,gmx_journal_fn
+from mdlog import gmx_mdlog_parse
 
-def gmx(program,**kwargs):
+_not_reported = ['gmx_prepare','gmx_run_cached','gmx_cache_open','gmx_log_path','gmx_pool_cores','gmx_which',
+	'gmx_toolchain_key','gmx_toolchain_load','gmx_toolchain_save','gmx_journal_open','gmx_journal_record',
+	'gmx_get_machine_key','gmx_mdlog_parse','gmx_mdrun_perf','gmx_mdrun_launch','gmx_mdrun_tune_grid']
+
+def gmx_prepare(program,**kwargs):
 	"""
-	Construct a GROMACS command and either run it or queue it in a script.
+	Construct a GROMACS command from the templates and return it with the record and protected kwargs.
+	The argv list is None when the command requires a shell (e.g. a custom mdrun_command).
 	"""
 	#---pop off protected kwargs
-	protected,_protected_kwargs = {},['log','inpipe','nonessential','custom']
+	protected,_protected_kwargs = {},['log','inpipe','nonessential','custom','cwd']
 	for key in _protected_kwargs: protected[key] = kwargs.pop(key,None)
 	#---we always require a log
 	if not protected['log']: raise Exception(
@@ -20,7 +28,7 @@ def gmx(program,**kwargs):
 	else: program_spec = state.gmxcalls[program]
 	#---construct the command from the template
 	call_spec = gmx_convert_template_to_call(kwargs=kwargs,spec=program_spec)
-	cmd,recorded = call_spec['call'],call_spec['recorded']
+	cmd,argv,recorded = call_spec['call'],call_spec['argv'],call_spec['recorded']
 	#---check for automatic overrides
 	if 'gmx_call_rules' in state:
 		#---check and apply all rules with the same command name
@@ -34,15 +42,164 @@ def gmx(program,**kwargs):
 				recorded['flags']['-'+rule['flag']] = rule['value']
 				#---append to the command
 				cmd += ' -%s %s'%(rule['flag'],str(rule['value']))
+				if argv!=None: argv = gmx_call_argv(cmd)
+	return cmd,argv,recorded,protected
+
+def gmx(program,**kwargs):
+	"""
+	Construct a GROMACS command and either run it or queue it in a script.
+	"""
+	cmd,argv,recorded,protected = gmx_prepare(program,**kwargs)
 	#---use the decorator on select functions inside this (amx) module
 	#---decorator is only available at run time because it comes from __init__.py
 	try: gmx_run_decorated = call_reporter(gmx_run,state)
 	except: gmx_run_decorated = gmx_run
-	gmx_run_decorated(cmd,log=protected['log'],
-		inpipe=protected['inpipe'],nonessential=protected['nonessential'])
+	gmx_run_cached(program,cmd,argv,recorded,protected,runner=gmx_run_decorated)
 	#---if the run works, we log the completed command 
-	if 'history_gmx' not in state: state.history_gmx = []
-	state.history_gmx.append(recorded)
+	gmx_journal_record(recorded)
+
+def gmx_journal_record(recorded):
+	"""
+	Add a completed call to the gmx journal. The state only keeps the path and the number of calls it has seen.
+	The path is resolved because metarun workspaces link to the shared journal.
+	"""
+	pointer = state.get('gmx_journal',{})
+	path = os.path.realpath(pointer.get('path',gmx_journal_fn))
+	n = gmx_journal_open(path).append(recorded,step=state.get('step',None),here=state.get('here',None))
+	state.gmx_journal = {'path':path,'count':n+1}
+
+class GMXFuture:
+	"""
+	A gmx call running in the local worker pool. Returned by gmx_async and collected by gmx_wait.
+	"""
+	def __init__(self,future,recorded,log,order):
+		self.future,self.recorded,self.log,self.order = future,recorded,log,order
+		self.collected = False
+	def done(self): return self.future.done()
+	def result(self):
+		"""Block until the call is complete and raise any errors from gmx_run."""
+		return self.future.result()
+
+#---the pool is created on the first asynchronous call and pending futures are tracked in submission order
+gmx_pool = {'executor':None,'cores':None,'pending':[],'count':0}
+
+def gmx_pool_cores():
+	"""
+	Get the core budget for asynchronous gmx calls from the settings or the machine.
+	"""
+	cores = state.q('gmx_async_cores',None) if 'q' in state else None
+	if not cores:
+		import multiprocessing
+		cores = multiprocessing.cpu_count()
+	return int(cores)
+
+def gmx_async(program,**kwargs):
+	"""
+	Submit a GROMACS command to a bounded local worker pool and return a GMXFuture.
+	Each call must have a unique log and may run in a separate directory via the cwd keyword.
+	Use the after keyword to wait for other futures before starting and call gmx_wait to collect the
+	results in the order they were submitted so that the gmx journal matches the serial execution.
+	"""
+	after = kwargs.pop('after',[])
+	if isinstance(after,GMXFuture): after = [after]
+	cmd,argv,recorded,protected = gmx_prepare(program,**kwargs)
+	#---asynchronous calls cannot share a log file with any pending call
+	cwd = protected['cwd'] if protected['cwd'] else state.here
+	log_key = (os.path.abspath(cwd),protected['log'])
+	if any([(os.path.abspath(i.recorded.get('cwd',state.here)),i.log)==log_key
+		for i in gmx_pool['pending'] if not i.done()]):
+		raise Exception('gmx_async received log %s which is already used by a pending call'%protected['log'])
+	if protected['cwd']: recorded['cwd'] = protected['cwd']
+	cores = gmx_pool_cores()
+	if not gmx_pool['executor'] or gmx_pool['cores']!=cores:
+		try: from concurrent.futures import ThreadPoolExecutor
+		except: raise Exception('gmx_async requires concurrent.futures (use the "futures" backport on python 2)')
+		if gmx_pool['executor']: gmx_pool['executor'].shutdown(wait=True)
+		#---threads only wait on the subprocesses so the number of workers is the core budget
+		gmx_pool['executor'],gmx_pool['cores'] = ThreadPoolExecutor(max_workers=cores),cores
+	def worker():
+		#---prerequisites were submitted first so they are either running or complete
+		for upstream in after: upstream.result()
+		gmx_run_cached(program,cmd,argv,recorded,protected)
+	future = GMXFuture(gmx_pool['executor'].submit(worker),
+		recorded=recorded,log=protected['log'],order=gmx_pool['count'])
+	gmx_pool['count'] += 1
+	gmx_pool['pending'].append(future)
+	return future
+
+def gmx_wait(*futures):
+	"""
+	Wait for asynchronous gmx calls (all pending calls by default) and add them to the gmx journal in the order
+	in which they were submitted. Errors are raised after all of the requested calls have finished.
+	"""
+	if not futures: futures = list(gmx_pool['pending'])
+	futures = sorted(futures,key=lambda x:x.order)
+	errors = []
+	for future in futures:
+		try: future.result()
+		except Exception as e: errors.append((future,e))
+	for future in futures:
+		if future in gmx_pool['pending']: gmx_pool['pending'].remove(future)
+		if future.collected or any([future is i for i,j in errors]): continue
+		gmx_journal_record(future.recorded)
+		future.collected = True
+	if errors:
+		for future,e in errors: print('[ERROR] gmx_async call with log %s failed: %s'%(future.log,e))
+		raise errors[0][1]
+	return [future.result() for future in futures]
+
+def gmx_cache_open():
+	"""
+	Open the gmx call cache if it is enabled with the gmx_cache setting.
+	"""
+	if not state.get('gmx_cache',settings.get('gmx_cache',False)): return None
+	root = state.get('gmx_cache_dir',settings.get('gmx_cache_dir',None))
+	if not root: root = cache_dir('gmx_cache')
+	if root not in gmx_cache_stores: gmx_cache_stores[root] = GMXCallCache(root,
+		size_limit=state.get('gmx_cache_size',settings.get('gmx_cache_size',2048)))
+	return gmx_cache_stores[root]
+
+gmx_cache_stores = {}
+
+def gmx_run_cached(program,cmd,argv,recorded,protected,runner=None):
+	"""
+	Run a prepared gmx call and use the content-addressed cache if it is enabled.
+	Calls served from the cache are marked in the gmx journal.
+	"""
+	if not runner: runner = gmx_run
+	kwargs = dict(log=protected['log'],cwd=protected['cwd'],argv=argv,
+		inpipe=protected['inpipe'],nonessential=protected['nonessential'])
+	cache = gmx_cache_open() if program in gmx_cache_inputs else None
+	if cache:
+		cwd = protected['cwd'] if protected['cwd'] else state.here
+		key = cache.key(program,cmd,recorded,cwd,inpipe=protected['inpipe'],
+			version=state.get('gmx_version',None))
+		log_fn = gmx_log_path(protected['log'],cwd)
+		if key and cache.restore(key,cwd,log_fn):
+			print('[STATUS] restored %s outputs from the gmx cache'%program)
+			recorded['cached'] = True
+			return
+		before = cache.snapshot(program,recorded,cwd)
+	#---the reporter profiles gmx_run as well so we label that record with the utility name
+	if hasattr(runner,'profile'): runner.profile.labels = {'tool':program}
+	usage = runner(cmd,**kwargs)
+	#---record the cost of the call for `make profile`
+	if usage: recorded['profile'] = usage
+	if cache and key and not protected['nonessential']: cache.store(key,program,recorded,cwd,before,log_fn)
+	#---record throughput and the cycle accounting from md.log for `make perf`
+	if program=='mdrun': 
+		perf = gmx_mdrun_perf(recorded,protected['cwd'] if protected['cwd'] else state.here)
+		if perf: recorded['perf'] = perf
+
+def gmx_mdrun_perf(recorded,cwd):
+	"""
+	Parse the performance section of the md.log written by an mdrun call.
+	"""
+	flags = recorded['flags']
+	if '-g' in flags: log_fn = str(flags['-g'])
+	elif '-deffnm' in flags: log_fn = str(flags['-deffnm'])+'.log'
+	else: log_fn = 'md.log'
+	return gmx_mdlog_parse(os.path.join(cwd,log_fn))
 
 gmx_error_strings = [
 	'File input/output error:',
@@ -55,29 +212,67 @@ gmx_error_strings = [
 	'Software inconsistency error',
 	'Syntax error']
 
-def gmx_run(cmd,log,nonessential=False,inpipe=None):
+def gmx_log_path(log,cwd):
 	"""
-	Run a GROMACS command instantly and log the results to a file.
+	Get the path to the log file for a gmx call.
 	"""
 	if log == None: raise Exception('[ERROR] gmx_run needs a log file to route output')
 	#---if the log is an absolute path we drop the log there without prepending "log-"
 	elif log and not os.path.basename(log)==log:
 		if not os.path.isdir(os.path.dirname(log)): 
 			raise Exception('cannot find directory for log %s'%log)
-		log_fn = log
+		return log
 	#---local logs get "log-" prepended and drop in the here directory
-	else: log_fn = state.here+'log-'+log
+	else: return os.path.join(cwd,'log-'+log)
+
+def gmx_run(cmd,log,nonessential=False,inpipe=None,cwd=None,argv=None):
+	"""
+	Run a GROMACS command instantly and log the results to a file.
+	The command string is always used for logging while the argv list, if available, runs without a shell.
+	"""
+	if not cwd: cwd = state.here
+	log_fn = gmx_log_path(log,cwd)
 	#---previously wrote a bash-only log but it makes more sense to have a comprehensive automacs log
 	output = open(log_fn,'w')
 	os.chmod(log_fn,0o664)
-	if inpipe == None:
-		proc = subprocess.Popen(cmd,cwd=state.here,shell=True,executable='/bin/bash',
-			stdout=output,stderr=output)
-		proc.communicate()
-	else:
-		proc = subprocess.Popen(cmd,cwd=state.here,shell=True,executable='/bin/bash',
-			stdout=output,stderr=output,stdin=subprocess.PIPE)
-		proc.communicate(input=str(inpipe).encode())
+	if argv: kwargs = dict(args=argv,cwd=cwd,stdout=output,stderr=output)
+	else: kwargs = dict(args=cmd,cwd=cwd,shell=True,executable='/bin/bash',stdout=output,stderr=output)
+	if inpipe != None: kwargs['stdin'] = subprocess.PIPE
+	usage,failed = {},None
+	start = time.time()
+	try: proc = subprocess.Popen(**kwargs)
+	except OSError as e: 
+		#---missing executables raise here instead of in bash so we report them the same way
+		if argv and e.errno==errno.ENOENT and os.path.isdir(cwd): 
+			output.write('%s: command not found\n'%argv[0])
+		#---other failures to start the command (e.g. a missing cwd) are reported as they are
+		else: 
+			failed = e
+			output.write('%s: %s\n'%((argv or [cmd])[0],e))
+	else: 
+		if inpipe != None:
+			#---the child may exit before reading its input in which case the log has the error
+			try: proc.stdin.write(str(inpipe).encode())
+			except (IOError,OSError) as e:
+				if e.errno!=errno.EPIPE: raise
+			try: proc.stdin.close()
+			except (IOError,OSError) as e:
+				if e.errno!=errno.EPIPE: raise
+		#---wait4 reports the resources used by this child alone, even when calls run concurrently
+		if hasattr(os,'wait4'):
+			pid,exit_status,rusage = os.wait4(proc.pid,0)
+			#---decode the status in the same way as subprocess: negative for a signal
+			if os.WIFSIGNALED(exit_status): proc.returncode = -os.WTERMSIG(exit_status)
+			else: proc.returncode = os.WEXITSTATUS(exit_status)
+			usage = {'cpu':rusage.ru_utime+rusage.ru_stime,'maxrss':rusage.ru_maxrss,
+				'bytes_written':512*rusage.ru_oublock}
+		else: proc.wait()
+	usage['wall'] = time.time()-start
+	output.close()
+	if failed!=None:
+		if nonessential: print('[NOTE] command failed but it is nonessential')
+		else: raise Exception('cannot run %s (see %s): %s'%((argv or [cmd])[0],log_fn,failed))
+		return usage
 	#---check for errors
 	with open(log_fn,'r') as logfile: logfile_text = logfile.read()
 	for msg in gmx_error_strings:
@@ -94,10 +289,12 @@ def gmx_run(cmd,log,nonessential=False,inpipe=None):
 				raise Exception('%s in %s'%(msg.strip(':'),log_fn))
 
 				#except: raise Exception('%s in %s'%(msg.strip(':'),log_fn))
+	return usage
 
-def gmx_get_machine_config(hostname=None):
+def gmx_get_machine_key(hostname=None):
 	"""
-	Probe the local or global configuration to see how to run GROMACS.
+	Find the gromacs configuration file and the machine_configuration key for this machine.
+	Returns the configuration file, the key, and the full machine_configuration.
 	"""
 	machine_config = {}
 	#---!
@@ -121,20 +318,127 @@ def gmx_get_machine_config(hostname=None):
 	if len(hostnames)>1: raise Exception('[ERROR] multiple machine hostnames %s'%str(hostnames))
 	elif len(hostnames)==1: this_machine = hostnames[0]
 	else: this_machine = 'LOCAL'
+	return os.path.expanduser(config_fn),this_machine,machine_config
+
+def gmx_get_machine_config(hostname=None):
+	"""
+	Probe the local or global configuration to see how to run GROMACS.
+	"""
+	config_fn,this_machine,machine_config = gmx_get_machine_key(hostname=hostname)
 	print('[STATUS] setting gmxpaths for machine: %s'%this_machine)
 	machine_config = machine_config[this_machine]
 	#---! previously did some ppn calculations here
 	return machine_config
 
+def gmx_mdrun_launch(machine_config,mdrun):
+	"""
+	Add the launch flags from the machine configuration to mdrun.
+	A custom mdrun_command replaces mdrun and is used as it is because MPI builds reject the thread-MPI flags
+	from `make tune_mdrun`.
+	"""
+	if 'mdrun_command' in machine_config: return machine_config['mdrun_command']
+	#---tuned launch flags from `make tune_mdrun` take precedence over the processor count
+	if 'mdrun_tuned' in machine_config: return mdrun+' %s'%machine_config['mdrun_tuned']
+	elif 'nprocs' in machine_config and machine_config['nprocs'] != None: 
+		return mdrun+' -nt %d'%machine_config['nprocs']
+	return mdrun
+
+def gmx_mdrun_tune_grid(nt,ntmpi=None,npme=None,pin='on'):
+	"""
+	Make the launch flags for the `make tune_mdrun` trials.
+	The grid covers every split of nt cores into thread-MPI ranks and OpenMP threads unless ntmpi is set. The
+	ntmpi, npme, and pin arguments are space-separated options.
+	"""
+	nt = int(nt)
+	ntmpis = [int(i) for i in ntmpi.split()] if ntmpi else [i for i in range(1,nt+1) if nt%i==0]
+	grid = []
+	for n_ranks in ntmpis:
+		if nt%n_ranks!=0: raise Exception('ntmpi %d does not divide nt %d'%(n_ranks,nt))
+		#---separate PME ranks only make sense with more than one rank
+		if npme: npmes = [int(i) for i in npme.split() if int(i)<n_ranks]
+		elif n_ranks>1: npmes = sorted(set([-1,0]+([n_ranks//4] if n_ranks>=4 else [])))
+		else: npmes = [None]
+		for n_pme in npmes:
+			for pin_mode in pin.split():
+				flags = '-nt %d -ntmpi %d -ntomp %d'%(nt,n_ranks,nt//n_ranks)
+				if n_pme!=None: flags += ' -npme %d'%n_pme
+				flags += ' -pin %s'%pin_mode
+				grid.append(flags)
+	return grid
+
+def gmx_set_machine_config(key,value,hostname=None):
+	"""
+	Set a key in the configuration for this machine by appending an assignment to the configuration file.
+	Previous assignments to the same key by this function are replaced so the file does not grow.
+	"""
+	config_fn,this_machine,machine_config = gmx_get_machine_key(hostname=hostname)
+	with open(config_fn) as fp: text = fp.read()
+	line = 'machine_configuration[%r][%r] = %r'%(this_machine,key,value)
+	regex = r'^machine_configuration\[%s\]\[%s\] = .*?$'%(
+		re.escape(repr(this_machine)),re.escape(repr(key)))
+	if re.search(regex,text,flags=re.M): text = re.sub(regex,lambda match:line,text,flags=re.M)
+	else: text = text.rstrip('\n')+'\n\n'+line+'\n'
+	with open(config_fn,'w') as fp: fp.write(text)
+	return config_fn,this_machine
+
 def gmx_get_share():
 	"""
 	Figure out the share/gromacs/top directory.
 	"""
-	gmx_dn = subprocess.Popen('which %s'%state.gmxpaths['gmx'],
-		shell=True,stdout=subprocess.PIPE,
-		stderr=subprocess.PIPE).communicate()[0].strip()
-	if sys.version_info>=(3,0): gmx_dn = gmx_dn.decode()
-	return os.path.abspath(os.path.join(gmx_dn,'..','..','share','gromacs','top'))
+	if state.get('gmxshare',None): return state.gmxshare
+	gmx_dn = gmx_which(state.gmxpaths['gmx'].split()[0])
+	return os.path.abspath(os.path.join(gmx_dn if gmx_dn else '','..','..','share','gromacs','top'))
+
+def gmx_which(name):
+	"""
+	Locate an executable in the PATH without spawning a shell.
+	"""
+	if os.path.dirname(name): return name if os.access(name,os.X_OK) else None
+	for dn in os.environ.get('PATH','').split(os.pathsep):
+		fn = os.path.join(dn,name)
+		if os.path.isfile(fn) and os.access(fn,os.X_OK): return fn
+	return None
+
+#---toolchain cache is stored in the automacs user directory and holds a limited number of entries
+gmx_toolchain_fn = 'toolchain.json'
+gmx_toolchain_max = 32
+
+def gmx_toolchain_key(machine_config,hostname=None,**kwargs):
+	"""
+	Hash the machine configuration, hostname, PATH, and the resolved GROMACS binary for the toolchain cache.
+	Returns None if we cannot find a GROMACS binary, in which case the caller should probe as usual.
+	"""
+	suffix = machine_config.get('suffix','')
+	binary = next((j for j in [gmx_which(i+suffix) for i in ['gmx','mdrun']] if j),None)
+	if not binary: return None
+	if not hostname: hostname = os.environ.get('HOSTNAME',os.environ.get('HOST',''))
+	signature = json.dumps([machine_config,hostname,os.environ.get('PATH',''),os.environ.get('AMX_NPROCS',''),
+		os.path.realpath(binary),os.path.getmtime(binary),kwargs],sort_keys=True,default=str)
+	return hashlib.sha1(signature.encode()).hexdigest()
+
+def gmx_toolchain_load():
+	"""
+	Read the toolchain cache.
+	"""
+	fn = os.path.join(cache_dir(),gmx_toolchain_fn)
+	if not os.path.isfile(fn): return {}
+	try:
+		with open(fn) as fp: return json.load(fp)
+	except: 
+		print('[WARNING] ignoring a corrupted toolchain cache at %s'%fn)
+		return {}
+
+def gmx_toolchain_save(toolchain):
+	"""
+	Write the toolchain cache atomically since several simulations may share it.
+	"""
+	fn = os.path.join(cache_dir(),gmx_toolchain_fn)
+	if len(toolchain)>gmx_toolchain_max:
+		for key in sorted(toolchain,key=lambda k:toolchain[k].get('time',0))[:-gmx_toolchain_max]: 
+			del toolchain[key]
+	fn_temp = fn+'.%d'%os.getpid()
+	with open(fn_temp,'w') as fp: json.dump(toolchain,fp)
+	os.rename(fn_temp,fn)
 
 def modules_load(machine_config):
 	"""
@@ -167,9 +471,11 @@ def modules_load(machine_config):
 		#---...to prepare the submission script locally in case automacs is misbehaving on clusters
 		incoming['module']('load',mod)
 	
-def gmx_get_paths(override=False,gmx_series=False,hostname=None):
+def gmx_get_paths(override=False,gmx_series=False,hostname=None,refresh=False):
 	"""
 	Create a list of paths for GROMACS.
+	The result is cached in the automacs user directory so that we only probe GROMACS when the machine 
+	configuration, hostname, PATH, or binary changes. Use `make gromacs_config refresh` to rebuild it.
 	"""
 	gmx4paths = {'grompp':'grompp','mdrun':'mdrun','pdb2gmx':'pdb2gmx','editconf':'editconf',
 		'genbox':'genbox','make_ndx':'make_ndx','genion':'genion','genconf':'genconf',
@@ -183,10 +489,24 @@ def gmx_get_paths(override=False,gmx_series=False,hostname=None):
 	#---check the config for a "modules" keyword in case we need to laod it
 	print('[STATUS] loading modules to prepare gromacs paths')
 	if 'modules' in machine_config: modules_load(machine_config)
+	#---check the toolchain cache after loading modules since they modify the PATH
+	#---note that the cache is only available when we import amx since cache_dir comes from utils.py
+	toolchain_key = gmx_toolchain_key(machine_config,hostname=hostname,
+		override=override,gmx_series=gmx_series) if 'cache_dir' in globals() else None
+	toolchain = gmx_toolchain_load() if toolchain_key else {}
+	if toolchain_key in toolchain and not refresh:
+		cached = toolchain[toolchain_key]
+		print('[STATUS] using cached gromacs toolchain (version %s)'%cached.get('version','unknown'))
+		if 'state' in globals(): 
+			state.gmxpaths,state.gmxshare = cached['gmxpaths'],cached['share']
+			state.gmx_series,state.gmx_version = cached['gmx_series'],cached['version']
+		return cached['gmxpaths']
 	#---basic check for gromacs version series
 	suffix = '' if 'suffix' not in machine_config else machine_config['suffix']
 	check_gmx = subprocess.Popen('gmx%s'%suffix,shell=True,executable='/bin/bash',
 		stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()
+	if sys.version_info<(3,0): check_text = ''.join(check_gmx)
+	else: check_text = ''.join([i.decode(errors='ignore') for i in check_gmx])
 	if override and 'gmx_series' in machine_config: gmx_series = machine_config['gmx_series']
 	elif not gmx_series:
 		#---! is this the best way to search?
@@ -196,6 +516,7 @@ def gmx_get_paths(override=False,gmx_series=False,hostname=None):
 				executable='/bin/bash',stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()
 			if sys.version_info<(3,0): check_mdrun = ''.join(output)
 			else: check_mdrun = ''.join([i.decode() for i in output])
+			check_text += check_mdrun
 			if re.search('VERSION 4',check_mdrun): gmx_series = 4
 			elif not override: raise Exception('gromacs is absent. make sure it is installed. '+
 				'if your system uses the `module` command, try loading it with `module load gromacs` or '+
@@ -216,10 +537,8 @@ def gmx_get_paths(override=False,gmx_series=False,hostname=None):
 			for key,val in gmxpaths.items():
 				gmxpaths[key] = re.sub('gmx ','gmx%s '%suffix,val)
 		else: gmxpaths = dict([(key,val+suffix) for key,val in gmxpaths.items()])
-	if 'nprocs' in machine_config and machine_config['nprocs'] != None: 
-		gmxpaths['mdrun'] += ' -nt %d'%machine_config['nprocs']
-	#---use mdrun_command for quirky mpi-type mdrun calls on clusters
-	if 'mdrun_command' in machine_config: gmxpaths['mdrun'] = machine_config['mdrun_command']
+	#---add launch flags or use mdrun_command for quirky mpi-type mdrun calls on clusters
+	gmxpaths['mdrun'] = gmx_mdrun_launch(machine_config,gmxpaths['mdrun'])
 	#---if any utilities are keys in config we override and then perform uppercase substitutions from config
 	utility_keys = [key for key in gmxpaths if key in machine_config]
 	if any(utility_keys):
@@ -230,7 +549,24 @@ def gmx_get_paths(override=False,gmx_series=False,hostname=None):
 		del name
 	#---even if mdrun is customized in config we treat the gpu flag separately
 	if 'gpu_flag' in machine_config: gmxpaths['mdrun'] += ' -nb %s'%machine_config['gpu_flag']	
+	#---jobs in an ensemble (see `make ensemble`) receive a thread count which replaces the launch flags
+	#---...pinning is dropped too since concurrent jobs would pin to the same cores (the default only pins
+	#---...when a job uses the whole machine)
+	if os.environ.get('AMX_NPROCS',None) and 'mdrun_command' not in machine_config:
+		mdrun = re.sub(r'\s+-(nt|ntmpi|ntomp|npme|pin|pinoffset|pinstride)\s+\S+','',gmxpaths['mdrun'])
+		gmxpaths['mdrun'] = mdrun+' -nt %d'%int(os.environ['AMX_NPROCS'])
+	#---record the version and share folder alongside the paths
+	version = re.findall(r'(?:GROMACS - gmx\S*, (?:VERSION )?|VERSION )(\S+)',check_text)
+	version = version[0] if version else None
+	gmx_binary = gmx_which(gmxpaths['gmx'].split()[0])
+	share = os.path.abspath(os.path.join(gmx_binary,'..','..','share','gromacs','top')) if gmx_binary else None
+	if toolchain_key:
+		toolchain[toolchain_key] = {'gmxpaths':gmxpaths,'gmx_series':gmx_series,'share':share,
+			'version':version,'hostname':hostname,'time':time.time()}
+		gmx_toolchain_save(toolchain)
 	#---export the gmxpaths to the state
-	if 'state' in globals(): state.gmxpaths = gmxpaths
+	if 'state' in globals(): 
+		state.gmxpaths,state.gmxshare = gmxpaths,share
+		state.gmx_series,state.gmx_version = gmx_series,version
 	return gmxpaths
 	
@@ -16,9 +16,11 @@ from generic import component,include
 from force_field_tools import Landscape
 from utils import str_types
 from gromacs_commands import gmx_get_last_call
+from edr import edr_read,EDRFile
+from cpt import cpt_header
 
 #---hide some functions from logging because they are verbose
-_not_reported = ['write_gro','dotplace','unique']
+_not_reported = ['write_gro','dotplace','unique','edr_read','equilibrate_converged','cpt_header']
 #---extensions shared throughout the codes
 _shared_extensions = ['dotplace','unique']
 
@@ -709,6 +711,8 @@ def equilibrate(groups=None,structure='system',top='system',stages_only=False,se
 				except: raise Exception('failed to parse equilibration setting: "%s"'%str(eq_setting))
 			else: seq = eq_setting
 		else: seq = []
+	#---adaptive equilibration runs each stage in chunks until it converges
+	adaptive = state.q('equilibration_adaptive',False)
 	#---sequential equilibration stages
 	for eqnum,name in enumerate(seq):
 		if not equilibrate_check(name):
@@ -716,7 +720,8 @@ def equilibrate(groups=None,structure='system',top='system',stages_only=False,se
 				structure=structure if eqnum == 0 else 'md-%s'%seq[eqnum-1],
 				log='grompp-%s'%name,mdp='input-md-%s-eq-in'%name,
 				maxwarn=state.q('maxwarn',0),**({'n':groups} if groups else {}))
-			gmx('mdrun',base='md-%s'%name,log='mdrun-%s'%name,nonessential=True)
+			if adaptive: equilibrate_adaptive(name,adaptive)
+			else: gmx('mdrun',base='md-%s'%name,log='mdrun-%s'%name,nonessential=True)
 			if not os.path.isfile(state.here+'md-%s.gro'%name): 
 				raise Exception('mdrun failure at %s'%name)
 	#---stages only protects you from beginning with part numbers
@@ -730,6 +735,87 @@ def equilibrate(groups=None,structure='system',top='system',stages_only=False,se
 				maxwarn=state.q('maxwarn',0),**({'n':groups} if groups else {}))
 			gmx('mdrun',base=name,log='mdrun-0001')
 
+#---default tolerances for adaptive equilibration. each term must change by less than "mean" between the last
+#---...two windows and drift by less than "drift" over the last window. terms missing from the EDR are ignored
+equilibrate_tolerances = {
+	'Temperature':{'mean':1.0,'drift':2.0},
+	'Pressure':{'mean':10.0,'drift':20.0},
+	'Density':{'mean':2.0,'drift':4.0},
+	'Box-X':{'mean':0.01,'drift':0.02},
+	'Box-Y':{'mean':0.01,'drift':0.02},
+	'Box-Z':{'mean':0.01,'drift':0.02},}
+
+def equilibrate_converged(data,window,tolerances):
+	"""
+	Compare the windowed averages and drift of energy terms to the tolerances.
+	Returns the convergence status and the achieved values for each term.
+	"""
+	time,report = data['time'],{}
+	#---we need two full windows to compare averages
+	if not len(time) or time[-1]-time[0]<2*window: return False,report
+	last = time>=time[-1]-window
+	previous = (time>=time[-1]-2*window)&~last
+	if last.sum()<3 or previous.sum()<1: return False,report
+	for term,tolerance in tolerances.items():
+		if term not in data: continue
+		values = data[term]
+		mean,mean_previous = float(values[last].mean()),float(values[previous].mean())
+		#---drift is the change over the last window from a linear fit
+		drift = float(np.polyfit(time[last],values[last],1)[0]*window)
+		report[term] = {'mean':mean,'previous':mean_previous,'drift':drift,
+			'converged':bool(abs(mean-mean_previous)<=tolerance['mean'] and abs(drift)<=tolerance['drift'])}
+	return bool(report) and all([i['converged'] for i in report.values()]),report
+
+def equilibrate_adaptive(name,adaptive):
+	"""
+	Run an equilibration stage in chunks and stop when the energy terms converge.
+	The adaptive setting is either True or a dictionary with the chunk size (steps), the window (ps) for the
+	averages, the minimum number of steps, and tolerances which override equilibrate_tolerances. Stages stop
+	at the nsteps from the MDP if they never converge. Results are recorded in state.equilibration_adaptive_results.
+	"""
+	spec = adaptive if type(adaptive)==dict else {}
+	base = 'md-%s'%name
+	#---the stage never runs longer than nsteps from the MDP
+	with open(state.here+'input-md-%s-eq-in.mdp'%name) as fp: 
+		nsteps = re.findall(r'^\s*nsteps\s*=\s*(-?\d+)',fp.read(),flags=re.M)
+	nsteps = int(nsteps[-1]) if nsteps else -1
+	if nsteps<0: nsteps = spec.get('max_steps',None)
+	if not nsteps: raise Exception('adaptive equilibration of %s needs a finite nsteps or max_steps'%name)
+	chunk = int(spec.get('chunk',max(1,nsteps//10)))
+	window = float(spec.get('window',20.0))
+	min_steps = int(spec.get('min_steps',0))
+	tolerances = dict(equilibrate_tolerances)
+	tolerances.update(**spec.get('tolerances',{}))
+	#---the final structure is written to a separate file so that equilibrate_check only sees finished stages
+	confout = base+'-chunk.gro'
+	result = {'nsteps':nsteps,'chunk':chunk,'window':window,'tolerances':tolerances,'chunks':0}
+	steps,converged = 0,False
+	while steps<nsteps:
+		steps = min(steps+chunk,nsteps)
+		kwargs = {'nsteps':steps,'c':confout}
+		#---continue from the checkpoint and append to the outputs after the first chunk
+		if result['chunks']>0: kwargs.update(cpi=base+'.cpt',append=True)
+		#---a failed chunk raises here instead of leaving the previous checkpoint in place
+		gmx('mdrun',base=base,log='mdrun-%s-%02d'%(name,result['chunks']),**kwargs)
+		result['chunks'] += 1
+		if not os.path.isfile(state.here+base+'.cpt'): raise Exception('mdrun failure at %s'%name)
+		#---the checkpoint must reach the end of the chunk
+		reached = cpt_header(state.here+base+'.cpt')['step']
+		if reached<steps: 
+			raise Exception('mdrun for %s stopped at step %d before the end of the chunk at %d'%(name,reached,steps))
+		terms = [i for i in EDRFile(state.here+base+'.edr').names if i in tolerances]
+		converged,report = equilibrate_converged(
+			edr_read(state.here+base+'.edr',terms=terms),window,tolerances)
+		result.update(steps=steps,terms=report)
+		status('%s: %d/%d steps, %s'%(name,steps,nsteps,', '.join(['%s %.3f (drift %.3f)'%(k,v['mean'],v['drift'])
+			for k,v in report.items()]) if report else 'waiting for two windows'),tag='status')
+		if converged and steps>=min_steps: break
+	result['stop'] = 'converged' if converged else 'nsteps'
+	shutil.copyfile(state.here+confout,state.here+base+'.gro')
+	if 'equilibration_adaptive_results' not in state: state.equilibration_adaptive_results = {}
+	state.equilibration_adaptive_results[name] = result
+	status('%s stopped at %d of %d steps (%s)'%(name,steps,nsteps,result['stop']),tag='status')
+
 def restart_clean(part,structure,groups,posres_coords=None,mdp='input-md-in'):
 	"""
 	Perform a hard-restart that mimics the md.part0001 naming scheme.
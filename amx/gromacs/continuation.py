@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Continue a simulation from its latest checkpoint without automacs.
+This engine runs in a step folder. It is called by script-continue.sh (see continue_script.py) which exports the
+machine settings and passes along the same arguments as the original bash loop (-m/-e/-u). Use --append to
+extend the last part in place instead of writing new part files, and --chain to keep starting parts until the
+walltime (MAXHOURS) is spent. Parts are listed in md.parts.json so we can find the latest checkpoint without
+scanning the folder, and each call is recorded in the gmx journal with its timing and performance.
+"""
+
+import os,sys,re,json,glob,time,subprocess,argparse
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from journal import gmx_journal_open,gmx_journal_fn
+from mdlog import gmx_mdlog_parse
+
+continuation_index_fn = 'md.parts.json'
+#---we do not start a part with less than this many hours left on the walltime
+continuation_min_hours = 0.05
+#---output files for each part in the order of the original continuation script
+continuation_flags = [('-s','tpr'),('-cpo','cpt'),('-g','log'),('-e','edr'),('-o','trr'),('-x','xtc'),('-c','gro')]
+
+def continuation_files(part):
+	"""File names for a part in the md.part0001 naming scheme."""
+	return dict([(flag,'md.part%04d.%s'%(part,suffix)) for flag,suffix in continuation_flags])
+
+def continuation_index_read(fn=continuation_index_fn):
+	"""Read the part index."""
+	if not os.path.isfile(fn): return {'parts':[]}
+	with open(fn) as fp: return json.load(fp)
+
+def continuation_index_write(index,fn=continuation_index_fn):
+	"""Replace the part index in one step so an interrupted write cannot corrupt it."""
+	with open(fn+'.tmp','w') as fp: json.dump(index,fp)
+	os.rename(fn+'.tmp',fn)
+
+def continuation_latest(index):
+	"""
+	Find the latest part with a checkpoint. We also look for parts which were written without the index
+	(e.g. md.part0001 from equilibrate or parts from an older continuation script).
+	"""
+	latest = None
+	for entry in index['parts']:
+		if os.path.isfile(entry['files']['-cpo']) and (not latest or entry['part']>=latest['part']): latest = entry
+	found = [int(re.match(r'^md\.part(\d{4})\.cpt$',fn).group(1))
+		for fn in glob.glob('md.part[0-9][0-9][0-9][0-9].cpt')]
+	if found and (not latest or max(found)>latest['part']):
+		latest = {'part':max(found),'files':continuation_files(max(found))}
+	if latest and not os.path.isfile(latest['files']['-s']):
+		raise Exception('found checkpoint %s without its run input %s'%(latest['files']['-cpo'],latest['files']['-s']))
+	return latest
+
+def continuation_run(cmd,log):
+	"""
+	Run a command in the shell with output routed to a log and measure its cost.
+	"""
+	start = time.time()
+	usage = {}
+	with open(log,'w') as fp:
+		proc = subprocess.Popen(cmd,shell=True,executable='/bin/bash',stdout=fp,stderr=fp)
+		#---wait4 reports the resources used by this child alone
+		if hasattr(os,'wait4'):
+			pid,exit_status,rusage = os.wait4(proc.pid,0)
+			#---decode the status in the same way as subprocess: negative for a signal
+			if os.WIFSIGNALED(exit_status): returncode = -os.WTERMSIG(exit_status)
+			else: returncode = os.WEXITSTATUS(exit_status)
+			usage = {'cpu':rusage.ru_utime+rusage.ru_stime,'maxrss':rusage.ru_maxrss,
+				'bytes_written':512*rusage.ru_oublock}
+		else: returncode = proc.wait()
+	usage['wall'] = time.time()-start
+	return returncode,usage
+
+def continuation_part(latest,settings,append,hours,journal=None):
+	"""
+	Extend the run input of the latest part and continue mdrun from its checkpoint.
+	New parts use new files (md.part0002 after md.part0001) while append mode extends the files of the latest part.
+	"""
+	prev = latest['files']
+	if settings['mode']=='extend': extend_flag = ['-extend',str(settings['extend'])]
+	elif settings['mode']=='until': extend_flag = ['-until',str(settings['until'])]
+	else: extend_flag = ['-nsteps','-1']
+	if append: part,files = latest['part'],dict(prev)
+	else: part,files = latest['part']+1,continuation_files(latest['part']+1)
+	#---in append mode the extended run input replaces the one from the latest part only after mdrun succeeds
+	tpr_out = re.sub(r'\.tpr$','.next.tpr',prev['-s']) if append else files['-s']
+	here = os.path.basename(os.getcwd())
+	records = []
+	cmd = ' '.join([settings['tpbconv']]+extend_flag+['-s',prev['-s'],'-o',tpr_out])
+	print('[STATUS] extending %s via: %s'%(prev['-s'],' '.join(extend_flag)))
+	returncode,usage = continuation_run(cmd,'log-tpbconv-%04d'%part)
+	if returncode!=0 or not os.path.isfile(tpr_out):
+		raise Exception('failed to extend %s. see log-tpbconv-%04d'%(prev['-s'],part))
+	records.append({'call':'tpbconv','flags':dict([('-s',prev['-s']),('-o',files['-s']),tuple(extend_flag)]),
+		'command':cmd,'profile':usage})
+	#---continue the simulation
+	flags = [(flag,files[flag]) for flag,suffix in continuation_flags]
+	flags.insert(1,('-cpi',prev['-cpo']))
+	flags.append(('-maxh','%.4f'%hours))
+	#---new parts must not append to the files named in the checkpoint
+	cmd = ' '.join([settings['mdrun']]+['%s %s'%(flag,tpr_out if flag=='-s' else value) for flag,value in flags]+
+		['-append' if append else '-noappend'])
+	log = 'log-mdrun-%04d'%part
+	print('[STATUS] continuing simulation from part %d in %s as part %d%s'%(
+		latest['part'],here,part,' (append)' if append else ''))
+	start = time.time()
+	returncode,usage = continuation_run(cmd,log)
+	#---a failed part in append mode leaves the run input of the latest part as it was
+	if append and returncode==0: os.rename(tpr_out,files['-s'])
+	elif append: os.remove(tpr_out)
+	recorded = {'call':'mdrun','flags':dict(flags),'command':cmd,'profile':usage,
+		'continuation':{'part':part,'append':append,'mode':settings['mode']}}
+	perf = gmx_mdlog_parse(files['-g'])
+	if perf: recorded['perf'] = perf
+	records.append(recorded)
+	if journal!=None:
+		for record in records: journal.append(record,step=here,here=os.path.join(here,''))
+	return {'part':part,'files':files,'append':append,'mode':settings['mode'],'extend':' '.join(extend_flag),
+		'start':start,'wall':usage['wall'],'returncode':returncode,'log':log,
+		'progress':bool(os.path.isfile(files['-cpo']) and os.path.getmtime(files['-cpo'])>=start),
+		'ns/day':perf['ns/day'] if perf else None,'steps':perf.get('steps',None) if perf else None}
+
+def continuation(mode='extend',extend=1000000,until=1000000,append=False,chain=False,maxhours=24.,
+	tpbconv='gmx convert-tpr',mdrun='gmx mdrun',journal=None):
+	"""
+	Continue the simulation in this folder for one part or, when chaining, until the walltime is spent.
+	"""
+	start = time.time()
+	settings = {'mode':mode,'extend':extend,'until':until,'tpbconv':tpbconv,'mdrun':mdrun}
+	print('[STATUS] mode = %s, extend = %s, until = %s, append = %s, chain = %s'%(mode,extend,until,append,chain))
+	if journal==None: journal = os.path.join('..',gmx_journal_fn)
+	#---the journal is empty (hence false) before the first call so we compare with None
+	journal = gmx_journal_open(journal) if journal else None
+	index = continuation_index_read()
+	while True:
+		hours = float(maxhours)-(time.time()-start)/3600.
+		if hours<continuation_min_hours:
+			print('[STATUS] stopping with %.2f hours left on the walltime'%hours)
+			break
+		latest = continuation_latest(index)
+		if not latest: raise Exception('cannot find a checkpoint (md.part0001.cpt) in %s'%os.getcwd())
+		entry = continuation_part(latest,settings,append,hours,journal=journal)
+		index['parts'].append(entry)
+		continuation_index_write(index)
+		if entry['returncode']!=0: raise Exception('mdrun failed in part %d. see %s'%(entry['part'],entry['log']))
+		print('[STATUS] part %d ran for %.1f minutes%s'%(entry['part'],entry['wall']/60.,
+			' at %.3f ns/day'%entry['ns/day'] if entry['ns/day'] else ''))
+		if not chain: break
+		#---a part without a new checkpoint or any steps has reached the end of the run
+		if not entry['progress'] or entry['steps']==0:
+			print('[STATUS] part %d made no progress so the run is complete'%entry['part'])
+			break
+	print('[STATUS] done continuation stage')
+
+def continuation_cli(argv=None):
+	"""
+	Parse the arguments from script-continue.sh. Defaults come from the settings it exports.
+	"""
+	env = os.environ
+	parser = argparse.ArgumentParser(description='continue a simulation from its latest checkpoint')
+	#---modes other than extend and until run without a limit on the number of steps
+	parser.add_argument('-m','--mode',default=env.get('MODE','extend'))
+	parser.add_argument('-e','--extend',default=env.get('EXTEND',1000000))
+	parser.add_argument('-u','--until',default=env.get('UNTIL',1000000))
+	parser.add_argument('-a','--append',action='store_true',default=env.get('APPEND','0') not in ['0','','False'])
+	parser.add_argument('-c','--chain',action='store_true',default=env.get('CHAIN','0') not in ['0','','False'])
+	parser.add_argument('--maxh',default=env.get('MAXHOURS',24.),type=float)
+	parser.add_argument('--journal',default=None)
+	args = parser.parse_args(argv)
+	continuation(mode=args.mode,extend=args.extend,until=args.until,append=args.append,chain=args.chain,
+		maxhours=args.maxh,tpbconv=env.get('TPBCONV','gmx convert-tpr'),mdrun=env.get('MDRUN','gmx mdrun'),
+		journal=args.journal)
+
+if __name__=='__main__': continuation_cli()
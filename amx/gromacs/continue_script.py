@@ -2,9 +2,8 @@
 
 """
 The write_continue_script function gets its own file to hold the BASH continue script and to avoid importing
-the full automacs when writing cluster scripts.
-
-! logging is to ../continue.log for now. it would be good to register this with automacs for later ...
+the full automacs when writing cluster scripts. The script only holds the settings for this machine and calls the
+continuation engine in continuation.py, which records each part in md.parts.json and the gmx journal.
 """
 
 #---! tried and failed to hide this from "import amx"
@@ -22,66 +21,17 @@ echo "[STATUS] continue script"
 MODE="extend"
 EXTEND=1000000
 UNTIL=1000000
+APPEND=0
+CHAIN=0
 
 # SETTINGS
 # SETTINGS OVERRIDES HERE
 
-# arguments (override) for extend flag
-while [ "$#" -gt 0 ]; do
-  case "$1" in
-    -m) MODE="$2"; shift 2;;
-    -e) EXTEND="$2"; shift 2;;
-    -u) UNTIL="$2"; shift 2;;
-    --mode=*) MODE="${1#*=}"; shift 1;;
-    --extend=*) EXTEND="${1#*=}"; shift 1;;
-    --until=*) UNTIL="${1#*=}"; shift 1;;
-    --mode|--extend|--until) echo "$1 requires an argument" >&2; exit 1;;
-    -*) echo "unknown option: $1" >&2; exit 1;;
-	*) die "unrecognized argument: $1"; shift 1;;
-  esac
-done
-
-# formulate the extend flag
-echo "[STATUS] mode = ${MODE}"
-echo "[STATUS] extend = ${EXTEND}"
-echo "[STATUS] until = ${UNTIL}"
-if [ "$MODE" = "extend" ]; then EXTEND_FLAG="-extend $EXTEND";
-elif [ "$MODE" = "until" ]; then EXTEND_FLAG="-until $UNTIL";
-else EXTEND_FLAG="-nsteps -1"; fi
-echo "[STATUS] extending via: ${EXTEND_FLAG}"
-
-# find last CPT
-PRUN=0
-for file in md.part*.cpt
-do
-if [ $(echo ${file:7:4} | sed 's/^0*//') -gt $PRUN ]; 
-then PRUN=$(echo ${file:7:4} | sed 's/^0*//')
-fi
-done
-NRUN=$(($PRUN+1))
-
-# log to standard log
-step=$(pwd | sed -r 's/.+\/(.+)//')
-metalog="../continuation.log"
-echo "[STATUS] continuing simulation from part $PRUN in $step"
-echo "[STATUS] logging to $metalog"
-echo "[STATUS] running ... "
-
-# extend TPR
-log=$(printf tpbconv-%04d $NRUN)
-cmd="$TPBCONV $EXTEND_FLAG -s $(printf md.part%04d.tpr $PRUN) -o $(printf md.part%04d.tpr $NRUN)"
-cmdexec=$cmd" &> log-$log"
-echo "[FUNCTION] gmx_run ('"$cmd"',) {'skip': False, 'log': '$log', 'inpipe': None}" >> $metalog
-eval $cmdexec
-
-# continue simulation
-log=$(printf mdrun-%04d $NRUN)
-cmd="$MDRUN -s $(printf md.part%04d.tpr $NRUN) -cpi $(printf md.part%04d.cpt $PRUN) -cpo $(printf md.part%04d.cpt $NRUN) -g $(printf md.part%04d.log $NRUN) -e $(printf md.part%04d.edr $NRUN) -o $(printf md.part%04d.trr $NRUN) -x $(printf md.part%04d.xtc $NRUN) -c $(printf md.part%04d.gro $NRUN) -maxh $MAXHOURS"
-cmdexec=$cmd" &> log-$log"
-echo "[FUNCTION] gmx_run ('"$cmd"',) {'skip': False, 'log': '$log', 'inpipe': None}" >> $metalog
-eval $cmdexec
-echo "[STATUS] done continuation stage"
-
+# the continuation engine reads these settings and accepts the same arguments (-m/-e/-u) along with
+# --append to extend the last part in place and --chain to continue in new parts until the walltime is spent
+export MODE EXTEND UNTIL APPEND CHAIN MAXHOURS TPBCONV MDRUN NPROCS
+CONTINUATION=${CONTINUATION:-../amx/gromacs/continuation.py}
+${PYTHON:-python} -B $CONTINUATION "$@"
 """
 
 def interpret_walltimes(walltime):
@@ -119,7 +69,7 @@ def interpret_walltimes(walltime):
 def write_continue_script_master(script='script-continue.sh',
 	machine_configuration=None,here=None,hostname=None,override=False,gmxpaths=None,**kwargs):
 	"""
-	Uses a template in amx/procedures to write a bash continuation script.
+	Write a bash continuation script with the settings for this machine which calls continuation.py.
 	"""
 	this_script = str(continue_script)
 	#---remote import to avoid large packages
@@ -141,7 +91,9 @@ def write_continue_script_master(script='script-continue.sh',
 		'tpbconv':gmxpaths['tpbconv'],
 		'mdrun':gmxpaths['mdrun'],
 		'grompp':gmxpaths['grompp'],
-		'maxwarn':0}
+		'maxwarn':0,
+		'append':int(bool(machine_configuration.get('append',False))),
+		'chain':int(bool(machine_configuration.get('chain',False)))}
 	settings_keys = list(settings.keys())
 	#---cluster may use an alternate mdrun
 	if 'mdrun_command' in machine_configuration: settings['mdrun'] = machine_configuration['mdrun_command']
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Read GROMACS checkpoints (.cpt) without GROMACS.
+A checkpoint starts with a header (versions, atoms, integrator, step, time, and flags that say which parts of the
+state follow) and then the state entries in a fixed order. Each state entry is written as a count, an XDR type
+code, and the values, so we can walk past the entries we do not need. We read the header to report the progress
+of a simulation and the box, coordinates, and velocities to recover the last frame.
+"""
+
+import os,re
+import numpy as np
+from xdr import XDRCursor,XDRShort,xdr_datatypes,xdr_dtypes
+
+cpt_magic = 171817
+#---bits in the state flags in the order the entries are written (estLAMBDA through estV in the GROMACS source)
+cpt_state_entries = ['lambda','box','box_rel','boxv','pres_prev','nh_xi','therm_int','x','v']
+#---the header fits in this many bytes unless the version strings are unusually long
+cpt_header_bytes = 2**14
+
+def cpt_header_parse(cursor):
+	"""
+	Read a checkpoint header. Fields were added over time so we check the file version before reading them.
+	"""
+	if cursor.int()!=cpt_magic: raise Exception('bad checkpoint magic number')
+	header = {}
+	for key in ['version','build_time','build_user','build_host','program','generated']:
+		header[key] = cursor.xdr_string()
+	header['file_version'] = version = cursor.int()
+	header['double'] = bool(cursor.int()) if version>=13 else None
+	header['host'] = cursor.xdr_string() if version>=12 else None
+	header['natoms'] = cursor.int()
+	header['ngtc'] = cursor.int()
+	header['nhchainlength'] = cursor.int() if version>=10 else 1
+	header['nnhpres'] = cursor.int() if version>=11 else 0
+	header['nlambda'] = cursor.int() if version>=14 else 0
+	header['integrator'] = cursor.int()
+	header['simulation_part'] = cursor.int() if version>=3 else 1
+	header['step'] = cursor.int64() if version>=5 else cursor.int()
+	header['time'] = cursor.double()
+	header['nranks'] = cursor.int()
+	header['dd'] = [cursor.int() for i in range(3)]
+	header['npme'] = cursor.int()
+	header['flags_state'] = cursor.int()
+	#---flags for the other parts of the checkpoint which follow the state
+	header['flags_eks'] = cursor.int() if version>=4 else 0
+	header['flags_enh'] = cursor.int() if version>=4 else 0
+	header['flags_dfh'] = cursor.int() if version>=14 else 0
+	header['ed'] = cursor.int() if version>=15 else 0
+	header['swap'] = cursor.int() if version>=16 else 0
+	header['flags_awh'] = cursor.int() if version>=17 else 0
+	header['flags_pull'] = cursor.int() if version>=18 else 0
+	header['modular'] = bool(cursor.int()) if version>=19 else False
+	return header
+
+def cpt_header(fn):
+	"""
+	Read the header of a checkpoint. Returns a dict with the step, time, and atoms among other fields.
+	"""
+	size = cpt_header_bytes
+	while True:
+		with open(fn,'rb') as fp: buf = fp.read(size)
+		try: return cpt_header_parse(XDRCursor(buf))
+		except XDRShort:
+			if len(buf)<size: raise Exception('checkpoint %s ends inside its header'%fn)
+			size *= 4
+
+def cpt_read(fn):
+	"""
+	Read the header and the box, coordinates, and velocities from a checkpoint.
+	Entries missing from the checkpoint (e.g. velocities from an energy minimization) are None.
+	"""
+	with open(fn,'rb') as fp: buf = fp.read()
+	cursor = XDRCursor(buf)
+	try: header = cpt_header_parse(cursor)
+	except XDRShort: raise Exception('checkpoint %s ends inside its header'%fn)
+	found = dict([(i,None) for i in cpt_state_entries])
+	for bit,name in enumerate(cpt_state_entries):
+		if not header['flags_state']&(1<<bit): continue
+		try:
+			n,code = cursor.int(),cursor.int()
+			kind = xdr_datatypes.get(code,None)
+			if kind not in xdr_dtypes or n<0:
+				raise Exception('unsupported checkpoint %s (version %d)'%(fn,header['file_version']))
+			values = cursor.array(kind,n)
+		except XDRShort: raise Exception('checkpoint %s ends inside the %s entry'%(fn,name))
+		found[name] = values
+	for name in ['box']:
+		if found[name] is not None: found[name] = found[name].reshape((3,3))
+	for name in ['x','v']:
+		if found[name] is not None:
+			if len(found[name])!=3*header['natoms']:
+				raise Exception('checkpoint %s has %d values for %s but %d atoms'%(
+					fn,len(found[name]),name,header['natoms']))
+			found[name] = found[name].reshape((-1,3))
+	header.update(box=found['box'],x=found['x'],v=found['v'])
+	return header
+
+def cpt_progress(fn):
+	"""Report the step, time, and part of a checkpoint."""
+	header = cpt_header(fn)
+	return {'step':header['step'],'time':header['time'],'part':header['simulation_part'],
+		'natoms':header['natoms'],'version':header['version']}
+
+def cpt_gro_box(box):
+	"""Format the box line of a GRO file. Off-diagonal terms are only written for triclinic boxes."""
+	values = [box[0][0],box[1][1],box[2][2]]
+	offdiag = [box[0][1],box[0][2],box[1][0],box[1][2],box[2][0],box[2][1]]
+	if any(offdiag): values += offdiag
+	return ''.join(['%10.5f'%i for i in values])+'\n'
+
+def cpt_to_gro(cpt,reference,out):
+	"""
+	Write the last frame of a checkpoint to a GRO file. Checkpoints lack atom and residue names so we take these
+	from a reference GRO with the same number of atoms (e.g. the input to the run).
+	"""
+	frame = cpt_read(cpt) if not isinstance(cpt,dict) else cpt
+	if frame['x'] is None or frame['box'] is None: raise Exception('checkpoint lacks coordinates or a box')
+	with open(reference) as fp: lines = fp.readlines()
+	if int(lines[1].split()[0])!=frame['natoms'] or len(lines)<frame['natoms']+3:
+		raise Exception('reference %s does not have %d atoms'%(reference,frame['natoms']))
+	with open(out+'.tmp','w') as fp:
+		title = re.sub(r'\s*t=.*$','',lines[0].strip())
+		fp.write('%s t= %.5f step= %d\n%5d\n'%(title,frame['time'],frame['step'],frame['natoms']))
+		for i in range(frame['natoms']):
+			line = lines[2+i][:20]+'%8.3f%8.3f%8.3f'%tuple(frame['x'][i])
+			if frame['v'] is not None: line += '%8.4f%8.4f%8.4f'%tuple(frame['v'][i])
+			fp.write(line+'\n')
+		fp.write(cpt_gro_box(frame['box']))
+	os.rename(out+'.tmp',out)
+	return out
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Read GROMACS energy files (.edr) without calling `gmx energy`.
+The file starts with the energy term names and units, followed by frames which hold a header, one value (and
+optionally an average and a sum) for each term, and optional data blocks. Frames are streamed from the file in
+chunks so that we can read large files and pick up new frames while mdrun is still writing.
+"""
+
+import os
+import numpy as np
+from xdr import XDRCursor,XDRShort,xdr_datatypes
+
+#---magic numbers and the newest file version from the GROMACS energy file format
+edr_magic_names = -55555
+edr_magic_frame = -7777777
+edr_version = 5
+#---each frame starts with this real and frames from the first file version start with a time above the threshold
+edr_first_real = -2e10
+edr_first_real_threshold = -1e10
+
+class EDRFile:
+	"""
+	Stream frames from an energy file. Use read to get arrays for all frames and tail to get the frames that
+	were written since the last read.
+	"""
+	def __init__(self,fn,chunk=2**20):
+		self.fn,self.chunk = fn,chunk
+		if not os.path.isfile(fn): raise Exception('cannot find energy file %s'%fn)
+		self.names,self.units = [],[]
+		#---precision is detected from the first frame
+		self.double = None
+		self.header()
+	def header(self):
+		"""Read the energy term names and units."""
+		with open(self.fn,'rb') as fp: buf = fp.read(self.chunk)
+		while True:
+			cursor = XDRCursor(buf)
+			try:
+				magic = cursor.int()
+				if magic>0: raise Exception('%s uses the first energy file version which is not supported'%self.fn)
+				elif magic!=edr_magic_names: raise Exception('%s is not a GROMACS energy file'%self.fn)
+				self.version = cursor.int()
+				if self.version>edr_version:
+					raise Exception('energy file version %d is newer than this reader'%self.version)
+				nre = cursor.int()
+				#---names and units are plain XDR strings (edr_strings in the GROMACS source)
+				for i in range(nre):
+					self.names.append(cursor.xdr_string())
+					self.units.append(cursor.xdr_string() if self.version>=2 else 'kJ/mol')
+				break
+			except XDRShort:
+				#---the header is larger than the chunk
+				self.names,self.units = [],[]
+				with open(self.fn,'rb') as fp: more = fp.read(len(buf)*2)
+				if len(more)==len(buf): raise Exception('energy file %s is incomplete'%self.fn)
+				buf = more
+		self.start = self.offset = cursor.offset
+	def precision(self,cursor):
+		"""Detect single or double precision from the first real in a frame header."""
+		start = cursor.offset
+		if abs(cursor.float()/edr_first_real-1.)<1e-6: return False
+		cursor.offset = start
+		if abs(cursor.double()/edr_first_real-1.)<1e-6: return True
+		raise Exception('cannot detect the precision of %s at byte %d'%(self.fn,start))
+	def frame(self,cursor):
+		"""Read one frame from a cursor."""
+		if self.double==None: self.double = self.precision(XDRCursor(cursor.buf,cursor.offset))
+		cursor.double_precision = self.double
+		if cursor.real()>edr_first_real_threshold: raise Exception('unexpected frame in %s (old energy file format)'%self.fn)
+		if cursor.int()!=edr_magic_frame: raise Exception('bad frame magic in %s'%self.fn)
+		version = cursor.int()
+		frame = {'time':cursor.double(),'step':cursor.int64(),'nsum':cursor.int()}
+		frame['nsteps'] = cursor.int64() if version>=3 else max(1,frame['nsum'])
+		frame['dt'] = cursor.double() if version>=5 else 0.
+		nre = cursor.int()
+		#---disres count in old versions and reserved since version 4
+		cursor.int()
+		nblock = cursor.int()
+		blocks = []
+		for b in range(nblock):
+			block = {'id':cursor.int(),'subs':[]}
+			for i in range(cursor.int()): block['subs'].append([xdr_datatypes[cursor.int()],cursor.int()])
+			blocks.append(block)
+		#---sizes which are not used when reading
+		cursor.int(),cursor.int(),cursor.int()
+		#---each term has a value and, if the frame has sums, an average and a sum
+		if frame['nsum']>0:
+			values = cursor.reals(nre*3).reshape(nre,3)
+			frame['energies'],frame['averages'],frame['sums'] = values[:,0],values[:,1],values[:,2]
+		else: frame['energies'] = cursor.reals(nre)
+		for block in blocks:
+			block['data'] = []
+			for kind,nr in block['subs']:
+				#---strings in blocks are written with an extra size (gmx_fio_do_string)
+				if kind=='string': block['data'].append(cursor.strings(nr))
+				else: block['data'].append(cursor.array(kind,nr))
+		frame['blocks'] = blocks
+		return frame
+	def frames(self):
+		"""
+		Stream frames starting after the last complete frame. A frame that is still being written is left
+		for the next call.
+		"""
+		with open(self.fn,'rb') as fp:
+			fp.seek(self.offset)
+			#---the buffer starts at the offset of the first frame that we have not read
+			buf,pos = fp.read(self.chunk),0
+			while True:
+				cursor = XDRCursor(buf,pos)
+				try: frame = self.frame(cursor)
+				except XDRShort:
+					#---extend the buffer or stop at the end of the file
+					more = fp.read(max(self.chunk,len(buf)-pos))
+					if not more: break
+					buf,pos = buf[pos:]+more,0
+					continue
+				self.offset += cursor.offset-pos
+				pos = cursor.offset
+				yield frame
+	def read(self,terms=None):
+		"""Read all frames into arrays of time, step, and the requested terms (all terms by default)."""
+		self.offset = self.start
+		return self.tail(terms=terms)
+	def tail(self,terms=None):
+		"""Read the frames written since the last call to read or tail."""
+		if terms==None: terms = list(self.names)
+		missing = [i for i in terms if i not in self.names]
+		if missing: raise Exception('cannot find terms %s in %s. available terms: %s'%(missing,self.fn,self.names))
+		indices = [self.names.index(i) for i in terms]
+		times,steps,values = [],[],[]
+		for frame in self.frames():
+			#---some frames only hold data blocks
+			if len(frame['energies'])<len(self.names): continue
+			times.append(frame['time'])
+			steps.append(frame['step'])
+			values.append(frame['energies'][indices])
+		values = np.array(values).reshape(len(times),len(indices))
+		result = {'time':np.array(times),'step':np.array(steps,dtype=np.int64)}
+		for ii,i in enumerate(terms): result[i] = values[:,ii]
+		return result
+
+def edr_read(fns,terms=None):
+	"""
+	Read energy terms from one or more parts of a simulation in order.
+	Frames which repeat the time of an earlier part (e.g. the first frame of a continuation) are dropped.
+	"""
+	if type(fns)==str: fns = [fns]
+	parts = [EDRFile(fn).read(terms=terms) for fn in fns]
+	if not parts: raise Exception('no energy files to read')
+	names = [i for i in parts[0] if i not in ['time','step']]
+	for fn,part in zip(fns[1:],parts[1:]):
+		if [i for i in part if i not in ['time','step']]!=names:
+			raise Exception('energy terms in %s differ from the first part'%fn)
+	keeps,last = [],None
+	for part in parts:
+		keep = part['time']>last if last!=None else np.ones(len(part['time']),dtype=bool)
+		keeps.append(keep)
+		if len(part['time']): last = max(last,part['time'].max()) if last!=None else part['time'].max()
+	return dict([(key,np.concatenate([part[key][keep] for part,keep in zip(parts,keeps)])) 
+		for key in ['time','step']+names])
@@ -5,6 +5,7 @@ Force field tools mediate naming schemes between various force fields.
 """
 
 import os,json,glob,re
+import numpy as np
 from topology_tools import GMXTopology
 
 charmm_lipids = {
@@ -49,13 +50,19 @@ def force_field_family():
 		raise Exception('force field matches neither charmm nor martini: %s'%state.force_field)
 	else: return 'charmm' if is_charmm else 'martini'
 	
-class Landscape:
+#---landscapes are shared within a process and keyed by force field family and folder
+landscapes = {}
+
+class Landscape(object):
 	"""
 	Handle force field naming schemes.
 
 	! lay out the types in meta.json?
 	This class reads the force field files according to types and exposes them to automacs in a way that
 	makes it easy to ask for ion definitions by type.
+	Each category is read the first time we ask for it and indexed by names, charges, and atom names so that
+	repeated selections are lookups. Calling Landscape again with the same force field and folder returns the
+	same instance.
 	"""
 
 	#---canonical protein residue names for all force fields
@@ -64,65 +71,121 @@ class Landscape:
 		'ORN','HSP','HID','HIE','LYN','DAB','ASN','CYM','HISD','VAL','THR','HISB','HIS','HIS1',
 		'HIS2','TRP','HISA','ACE','ASH','CYSH','PGLU','LYS','PHE','ALA','QLN','MET','LYSH','NME',
 		'LEU','ARG','TYR']
+	#---instances are reused so we only set them up once
+	ready = False
+
+	def __new__(cls,ff=None,cwd=None):
+		if not ff: ff = force_field_family()
+		key = (ff,os.path.abspath(os.getcwd() if not cwd else cwd))
+		if key not in landscapes: landscapes[key] = super(Landscape,cls).__new__(cls)
+		return landscapes[key]
 
 	def __init__(self,ff=None,cwd=None):
 		"""
 		This class wraps the landscape files.
 		"""
-		self.objects = {}
+		if self.ready: return
 		if not ff: ff = force_field_family()
-		cwd = os.getcwd() if not cwd else cwd
-
-		#---???
-		self.itps = {}
+		if ff not in landscape_spec: raise Exception('no landscape for force field %s'%ff)
+		self.ff,self.cwd = ff,os.getcwd() if not cwd else cwd
 		for cat,spec in landscape_spec[ff].items():
-			if 'files' in spec:
-				files = [spec['files']] if type(spec['files'])!=list else spec['files']
-				files_collect = [i for j in [glob.glob(os.path.join(cwd,expr)) for expr in files] for i in j]
-				if not files_collect: raise Exception('cannot find files via "%s"'%files)
-				for fn in files_collect:
-					#---? check for overwrites
-					#---save the topologies by ITP file
-					self.itps[fn] = GMXTopology(fn).molecules
-					for name,mol in self.itps[fn].items():
-						if name in self.objects: 
-							raise Exception('molecule named %s already registered'%name)
-						resnames = [a['resname'] for a in mol['atoms']]
-						if not len(list(set(resnames)))==1: 
-							raise Exception('molecule with multiple resnames under development: %s'%name)
-						try: charge = sum([float(a['charge']) for a in mol['atoms']])
-						except: raise Exception(
-							'failed to compute charge. problem with the ITP file or reader.')
-						obj = {
-							'cat':cat,
-							'n':len(mol['atoms']),
-							'atoms':[a['atom'] for a in mol['atoms']],
-							'resname':list(set(resnames))[0],
-							'charge':sum([float(a['charge']) for a in mol['atoms']]),
-							'fn':fn,}
-						self.objects[name] = obj
-			else: raise Exception('you must supply files list in the landscape spec')
-
-		#---! recent changes to the data structure above are useful but to get the GMXTopology object
-		#---! ...you have to do: land.itps[land.objects['POPC']['fn']]['POPC']
-
+			if 'files' not in spec: raise Exception('you must supply files list in the landscape spec')
+		#---categories are loaded on demand
+		self.categories = list(landscape_spec[ff].keys())
+		self.loaded,self.index,self._objects,self._itps = [],{},{},{}
 		#---special defs go right into members
 		for key,val in special_defs[ff].items(): self.__dict__[key] = val
+		self.ready = True
 
-		#---populate categories
-		self.categories = list(set([v['cat'] for k,v in self.objects.items()]))
+	def load(self,cat):
+		"""
+		Read the files for one category and index its molecules.
+		"""
+		if cat in self.loaded: return self.index[cat]
+		if cat not in self.categories: raise Exception('category %s not in this landscape'%cat)
+		spec = landscape_spec[self.ff][cat]
+		files = [spec['files']] if type(spec['files'])!=list else spec['files']
+		files_collect = [i for j in [glob.glob(os.path.join(self.cwd,expr)) for expr in files] for i in j]
+		if not files_collect: raise Exception('cannot find files via "%s"'%files)
+		index = {'names':[],'charges':{},'atoms':set(),'pairs':[]}
+		for fn in files_collect:
+			#---save the topologies by ITP file
+			self._itps[fn] = GMXTopology(fn).molecules
+			for name,mol in self._itps[fn].items():
+				if name in self._objects: 
+					raise Exception('molecule named %s already registered'%name)
+				#---atoms are stored in columns (see GMXSection)
+				atoms = mol['atoms']
+				resnames = np.unique(atoms['resname'])
+				if not len(resnames)==1: 
+					raise Exception('molecule with multiple resnames under development: %s'%name)
+				try: charge = float(np.sum(atoms['charge'].astype(float)))
+				except: raise Exception(
+					'failed to compute charge. problem with the ITP file or reader.')
+				obj = {
+					'cat':cat,
+					'n':len(atoms),
+					'atoms':[str(a) for a in atoms['atom']],
+					'resname':str(resnames[0]),
+					'charge':charge,
+					'fn':fn,}
+				self._objects[name] = obj
+				index['names'].append(name)
+				index['charges'][name] = charge
+				index['atoms'].update(obj['atoms'])
+				index['pairs'].extend([(obj['resname'],a) for a in obj['atoms']])
+		index['anions'] = [k for k in index['names'] if index['charges'][k]<0]
+		index['cations'] = [k for k in index['names'] if index['charges'][k]>0]
+		self.index[cat] = index
+		self.loaded.append(cat)
+		return index
+
+	def load_all(self):
+		for cat in self.categories: self.load(cat)
+
+	#---! recent changes to the data structure above are useful but to get the GMXTopology object
+	#---! ...you have to do: land.itps[land.objects['POPC']['fn']]['POPC']
+
+	@property
+	def objects(self):
+		"""All molecules by name. This reads every category."""
+		self.load_all()
+		return self._objects
+
+	@property
+	def itps(self):
+		"""Molecules for each ITP file. This reads every category."""
+		self.load_all()
+		return self._itps
+
+	def names(self,cat):
+		"""Molecule names in a category or an empty list if the force field lacks the category."""
+		if cat not in self.categories: return []
+		return list(self.load(cat)['names'])
+
+	def charges(self,cat):
+		"""Net charges of the molecules in a category."""
+		return dict(self.load(cat)['charges'])
+
+	def atom_names(self,cat):
+		"""The set of atom names in a category."""
+		return self.load(cat)['atoms']
+
+	def residue_atom_pairs(self,cat):
+		"""Pairs of residue and atom names in a category."""
+		return self.load(cat)['pairs']
 
 	def objects_by_category(self,cat):
 		"""
 		Return all object names in a particular category.
 		"""
-		return [k for k,v in self.objects.items() if v['cat']==cat]
+		return self.names(cat)
 
-	def lipids(self): return [k for k,v in self.objects.items() if v['cat']=='lipid']
-	def sterols(self): return [k for k,v in self.objects.items() if v['cat']=='sterol']
-	def anions(self): return [k for k,v in self.objects.items() if v['cat']=='ion' and v['charge'] < 0]
-	def cations(self): return [k for k,v in self.objects.items() if v['cat']=='ion' and v['charge'] > 0]
-	def ions(self): return [k for k,v in self.objects.items() if v['cat']=='ion']
+	def lipids(self): return self.names('lipid')
+	def sterols(self): return self.names('sterol')
+	def anions(self): return list(self.load('ion')['anions']) if 'ion' in self.categories else []
+	def cations(self): return list(self.load('ion')['cations']) if 'ion' in self.categories else []
+	def ions(self): return self.names('ion')
 
 	def protein_selection(self):
 		"""
@@ -138,4 +201,5 @@ class Landscape:
 		"""
 		if not hasattr(self,cat): raise Exception('category %s not in this landscape'%cat)
 		object_names = getattr(self,cat)()
-		return [i for j in [self.objects[o]['atoms'] for o in object_names] for i in j]
+		if not object_names: return []
+		return [i for j in [self._objects[o]['atoms'] for o in object_names] for i in j]
@@ -1,12 +1,24 @@
 #!/usr/bin/env python
 
-import re
+import os,sys,re,json,shlex,collections,copy
+from journal import gmx_journal_open
 #from command_templates import gmx_call_templates
 
+_not_reported = ['gmx_call_argv','gmx_template_compile','gmx_journal_open']
+str_types = [str] if (sys.version_info>(3,0)) else [str,unicode]
+
+#---interpreted and compiled templates are cached so we only parse them once per process
+gmx_commands_cache,gmx_templates_compiled = {},{}
+
+#---calls with any of these characters are sent to bash instead of running the argv directly
+gmx_shell_characters = re.compile(r'[\$`|;&<>()*?~{}\[\]!]')
+
 def gmx_commands_interpret(templates):
 	"""
 	Interpret a block of command templates for GROMACS.
 	"""
+	#---callers may modify the nested calls so they always get a copy of the cached result
+	if templates in gmx_commands_cache: return copy.deepcopy(gmx_commands_cache[templates])
 	gmxcalls = {}
 	for raw in [i for i in templates.splitlines() if not re.match('^\s*$',i)]:
 		extract = re.match('^(\w+)\s+(.*?)$',raw)
@@ -38,58 +50,95 @@ def gmx_commands_interpret(templates):
 			#---! check count?
 			flags[flagno] = (flag[0],result)
 		gmxcalls[command] = {'command':command,'flags':flags,'required':list(set(args_required))}
-	return gmxcalls
+	gmx_commands_cache[templates] = gmxcalls
+	return copy.deepcopy(gmxcalls)
+
+class GMXCallTemplate:
+	"""
+	A GROMACS command template compiled once from a gmxcalls specification.
+	Renders a shell string for logs and the history along with an argv list for execution without a shell.
+	"""
+	def __init__(self,spec):
+		self.command = spec['command']
+		#---flags may arrive as lists instead of tuples after a round trip through state.json
+		self.flags = [tuple(i) for i in spec['flags']]
+		self.required = list(spec['required'])
+	def render(self,gmxpath,kwargs,strict=False):
+		"""Apply kwargs (required substitutions and overrides) to make a call."""
+		kwargs = dict(kwargs)
+		kwargs_copy = dict(kwargs)
+		missing_kwargs = [key for key in self.required if key not in kwargs]
+		subs_required = dict([(key,kwargs.pop(key)) for key in self.required if key in kwargs])
+		#---template values are formatted while overrides are used verbatim
+		flags,formatted = collections.OrderedDict(self.flags),set()
+		if kwargs and strict: 
+			raise Exception('unprocessed kwargs with strictly no overrides: %s'%str(kwargs))
+		for key,val in kwargs.items(): 
+			flag = key if key in flags else '-'+key
+			flags[flag] = val
+			formatted.add(flag)
+		#---replace booleans with gromacs -flag vs -noflag syntax
+		#---! note that sending e.g. noflag=True is not allowed!
+		for key in list(flags.keys()):
+			if type(flags[key])==bool: 
+				if re.match('^no',key): 
+					raise Exception('refusing to accept a kwarg to a gmx flag that starts with "no": '%key)
+				if flags[key]: flags[key] = ''
+				else: 
+					flags[re.sub('^-(.+)$',r'-no\1',key)] = '' 
+					del flags[key]
+		for key,val in flags.items():
+			if key in formatted and not (type(val) in str_types and '%' in val): continue
+			try: flags[key] = val%subs_required
+			except: raise Exception('[ERROR] failed to construct the gromacs call. '+
+				'NOTE missing keywords: %s'%missing_kwargs+' NOTE spec: %s'%self.command+
+				' NOTE incoming kwargs: %s'%kwargs_copy)
+		call = gmxpath+' '+' '.join(['%s %s'%(key,val) for key,val in flags.items()])
+		recorded = {'call':self.command,'flags':dict(flags)}
+		return {'call':call,'argv':gmx_call_argv(call),'recorded':recorded}
+
+def gmx_call_argv(call):
+	"""
+	Split a call into an argv list or return None if it needs the shell.
+	"""
+	if gmx_shell_characters.search(call): return None
+	try: return shlex.split(call)
+	except: return None
+
+def gmx_template_compile(spec):
+	"""
+	Retrieve a compiled template for a gmxcalls specification.
+	"""
+	key = json.dumps([spec['command'],spec['flags'],sorted(spec['required'])])
+	if key not in gmx_templates_compiled: gmx_templates_compiled[key] = GMXCallTemplate(spec)
+	return gmx_templates_compiled[key]
 
 def gmx_convert_template_to_call(spec,kwargs,strict=False):
 	"""
 	Use GROMACS call instructions along with kwargs to make a new command.
 	"""
-	kwargs_copy = dict(kwargs)
-	#---check that we have the right incoming arguments
-	missing_kwargs = [key for key in spec['required'] if key not in kwargs]
-	#---remove required kwargs from the kwargs list
-	subs_required = {}
-	for key in spec['required']: 
-		if key in kwargs: subs_required[key] = kwargs.pop(key)
-	#---flags comes in as a list of tuples, but we require a dictionary
-	flags = dict(spec['flags'])
-	#---remaining kwargs are overrides
-	if kwargs and not strict: 
-		#---loop over overrides and apply them
-		for key,val in kwargs.items(): 
-			flags[key if key in flags else '-'+key] = val
-	elif kwargs and strict: raise Exception('unprocessed kwargs with strictly no overrides: %s'%str(kwargs))
-	#---replace booleans with gromacs -flag vs -noflag syntax
-	#---! note that sending e.g. noflag=True is not allowed!
-	for key in list(flags.keys()):
-		if type(flags[key])==bool: 
-			if re.match('^no',key): 
-				raise Exception('refusing to accept a kwarg to a gmx flag that starts with "no": '%key)
-			if flags[key]: flags[key] = ''
-			else: 
-				flags[re.sub('^-(.+)$',r'-no\1',key)] = '' 
-				del flags[key]
-	#---use the flags to construct the call
-	call = state.gmxpaths[spec['command']]+' '
-	try: call += (' '.join(['%s %s'%(key,val) for key,val in flags.items()]))%subs_required
-	except: raise Exception('[ERROR] failed to construct the gromacs call. '+
-		'NOTE missing keywords: %s'%missing_kwargs+' NOTE spec: %s'%spec+' NOTE incoming kwargs: %s'%kwargs_copy)
-	#---use the explicit specs to make a record of this call
-	recorded = {'call':spec['command'],'flags':dict([(flag,
-		value%subs_required if type(value)==str else value) for flag,value in flags.items()])}
-	return {'call':call,'recorded':recorded}
+	template = gmx_template_compile(spec)
+	return template.render(state.gmxpaths[spec['command']],kwargs,strict=strict)
 
 def gmx_get_last_call(name,this_state=None):
 	"""
-	The gmx call history is loaded by convert_gmx_template_to_call. We can retrieve the last call to a 
-	particular gromacs utility using this function.
+	Retrieve the last call to a particular gromacs utility from the gmx journal recorded by gmx.
+	Previous states only see the calls that were made before they were saved, and only calls from the steps in
+	their lineage since concurrent metarun branches share the journal.
 	"""
 	# sometimes we run this after "import amx" so the state is found there
 	if not this_state: this_state = state
-	if 'history_gmx' not in this_state: raise Exception('no gromacs history to get last call')
-	recents = [ii for ii,i in enumerate(this_state.history_gmx) if i['call']==name]
-	if not recents: raise Exception('no record of a gmx call to %s recently'%name)
-	return this_state.history_gmx[recents[-1]]
+	pointer = this_state.get('gmx_journal',None)
+	if not pointer and 'history_gmx' not in this_state: 
+		raise Exception('no gromacs history to get last call')
+	if pointer:
+		last = gmx_journal_open(pointer['path']).last(call=name,count=pointer['count'],
+			steps=this_state['steps'] if this_state.get('steps',None) else None)
+		if last: return last
+	#---states written before the journal keep the calls in a list
+	recents = [ii for ii,i in enumerate(this_state.get('history_gmx',[])) if i['call']==name]
+	if recents: return this_state['history_gmx'][recents[-1]]
+	raise Exception('no record of a gmx call to %s recently'%name)
 
 def gmx_register_call(command,flag,value):
 	"""
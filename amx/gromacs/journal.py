@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+Append-only journal of GROMACS calls.
+Each completed gmx call is written as one JSON line tagged with its sequence number, step, and folder. The
+state only holds a pointer to the journal and the number of calls it has seen, so state files do not grow with
+the number of calls. Lookups use an index of byte offsets by utility and step which is built lazily and extended
+when other processes append to the journal. Branches of a metarun share one journal so lookups are restricted to
+the steps in the lineage of a state. See gmx_get_last_call in gromacs_commands.py.
+"""
+
+import os,json,bisect
+
+gmx_journal_fn = 'gmx-journal.jsonl'
+
+class GMXJournal:
+	"""
+	A JSON-lines file of gmx calls with an offset index by utility and step.
+	"""
+	def __init__(self,path):
+		self.path = os.path.abspath(os.path.expanduser(path))
+		#---the index holds sorted sequence numbers and matching byte offsets for each utility and step
+		self.by_call,self.by_step = {},{}
+		self.offsets = []
+		self.scanned = 0
+		#---sets of sequence numbers in each lineage with the length of the index when they were last extended
+		self.lineages = {}
+	def scan(self):
+		"""Extend the index with any lines appended since the last scan."""
+		if not os.path.isfile(self.path): return
+		if os.path.getsize(self.path)<self.scanned: self.__init__(self.path)
+		with open(self.path,'rb') as fp:
+			fp.seek(self.scanned)
+			while True:
+				offset = fp.tell()
+				line = fp.readline()
+				#---a partial line is still being written so we pick it up on the next scan
+				if not line or not line.endswith(b'\n'): break
+				self.scanned = fp.tell()
+				try: entry = json.loads(line.decode())
+				except: continue
+				self.index(entry,offset)
+	def index(self,entry,offset):
+		"""Add an entry to the index."""
+		n = len(self.offsets)
+		self.offsets.append(offset)
+		for key,index in [(entry.get('call',None),self.by_call),(entry.get('step',None),self.by_step)]:
+			if key not in index: index[key] = []
+			index[key].append(n)
+	def __len__(self):
+		self.scan()
+		return len(self.offsets)
+	def read(self,n):
+		"""Read an entry by sequence number."""
+		with open(self.path,'rb') as fp:
+			fp.seek(self.offsets[n])
+			entry = json.loads(fp.readline().decode())
+		entry['n'] = n
+		return entry
+	def append(self,recorded,**tags):
+		"""Append a call to the journal and return its sequence number."""
+		self.scan()
+		entry = dict(recorded,**tags)
+		line = (json.dumps(entry)+'\n').encode()
+		#---a single write in append mode keeps lines intact when processes share a journal
+		fd = os.open(self.path,os.O_WRONLY|os.O_APPEND|os.O_CREAT,0o664)
+		try: 
+			os.write(fd,line)
+			#---other processes may append between our write and the scan so we find our line by its offset
+			offset = os.lseek(fd,0,os.SEEK_CUR)-len(line)
+		finally: os.close(fd)
+		self.scan()
+		n = bisect.bisect_left(self.offsets,offset)
+		if n==len(self.offsets) or self.offsets[n]!=offset: 
+			raise Exception('cannot find the call we appended to %s at byte %d'%(self.path,offset))
+		return n
+	def select(self,call=None,step=None,steps=None):
+		"""
+		Sorted sequence numbers for a utility and/or step. 
+		Use steps to restrict the result to the lineage of a state when branches share the journal.
+		"""
+		self.scan()
+		if call==None and step==None: ns = list(range(len(self.offsets)))
+		elif step==None: ns = self.by_call.get(call,[])
+		elif call==None: ns = self.by_step.get(step,[])
+		else:
+			in_step = set(self.by_step.get(step,[]))
+			ns = [i for i in self.by_call.get(call,[]) if i in in_step]
+		if steps==None: return ns
+		in_steps = self.lineage(steps)
+		return [i for i in ns if i in in_steps]
+	def lineage(self,steps):
+		"""
+		The set of sequence numbers in a lineage of steps. 
+		Sets are cached and only extended with the calls indexed since the last lookup.
+		"""
+		key = tuple(steps)
+		count,in_steps = self.lineages.get(key,(0,set()))
+		if count<len(self.offsets):
+			#---calls recorded outside of a step belong to every lineage
+			for step in set(key+(None,)):
+				ns = self.by_step.get(step,[])
+				in_steps.update(ns[bisect.bisect_left(ns,count):])
+			self.lineages[key] = (len(self.offsets),in_steps)
+		return in_steps
+	def last(self,call=None,step=None,count=None,steps=None):
+		"""
+		Get the most recent call to a utility and/or in a step, optionally among the first count entries.
+		Returns None if there is no match.
+		"""
+		ns = self.select(call=call,step=step,steps=steps)
+		ind = bisect.bisect_left(ns,count) if count!=None else len(ns)
+		return self.read(ns[ind-1]) if ind>0 else None
+	def calls(self,call=None,step=None):
+		"""Iterate over the entries for a utility and/or step in order."""
+		for n in list(self.select(call=call,step=step)): yield self.read(n)
+
+#---journals are shared by path so the index is only built once per process
+gmx_journals = {}
+
+def gmx_journal_open(path=gmx_journal_fn):
+	"""Get the journal at a path."""
+	path = os.path.abspath(os.path.expanduser(path))
+	if path not in gmx_journals: gmx_journals[path] = GMXJournal(path)
+	return gmx_journals[path]
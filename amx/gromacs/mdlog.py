@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Read the performance section at the end of an mdrun log (md.log).
+We collect the throughput, the cycle and time accounting table, PME load balance, and domain decomposition
+statistics so that gmx can record them with each mdrun call and `make perf` can report trends across parts.
+"""
+
+import os,re
+
+#---the performance section is at the end of the log so we only read the tail of large logs
+mdlog_tail_bytes = 2**18
+
+regex_mdlog = {
+	'accounting':re.compile(r'R E A L\s+C Y C L E\s+A N D\s+T I M E\s+A C C O U N T I N G'),
+	'table_row':re.compile(r'^\s*(\S.*?)\s{2,}((?:[\d.]+\s+)*[\d.]+)\s*$'),
+	'time':re.compile(r'^\s*Time:\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)',re.M),
+	'performance':re.compile(r'^Performance:\s+(.+?)\s*$',re.M),
+	'steps':re.compile(r'Statistics over (\d+) steps',re.M),
+	'pme_load':re.compile(r'Average PME mesh/force load:\s+([\d.]+)',re.M),
+	'pme_lost':re.compile(r'waiting due to PP/PME imbalance:\s+([\d.]+)\s*%',re.M),
+	'dd_imbalance':re.compile(r'Average load imbalance:\s+([\d.]+)\s*%',re.M),
+	'dd_lost':re.compile(r'waiting due to load imbalance:\s+([\d.]+)\s*%',re.M),
+	'dd_grid':re.compile(r'Domain decomposition grid (\d+) x (\d+) x (\d+), separate PME (?:ranks|nodes) (\d+)',
+		re.M),
+	'step_time':re.compile(r'^\s+Step\s+Time(?:\s+Lambda)?\s*\n\s+(\d+)\s+([\d.eE+-]+)',re.M),
+	'parallel':re.compile(r'^On (\d+) MPI (?:rank|process|node)s?(?:, each using (\d+) OpenMP threads)?',re.M),}
+
+def mdlog_read_tail(fn):
+	"""Read the end of a log, or the entire log if the performance section starts earlier."""
+	size = os.path.getsize(fn)
+	with open(fn,'rb') as fp:
+		if size>mdlog_tail_bytes: fp.seek(size-mdlog_tail_bytes)
+		text = fp.read().decode(errors='ignore')
+	if size>mdlog_tail_bytes and not regex_mdlog['accounting'].search(text):
+		with open(fn,'rb') as fp: text = fp.read().decode(errors='ignore')
+	return text
+
+def mdlog_accounting(text):
+	"""
+	Parse the cycle and time accounting table into a list of rows.
+	The last three columns are always the wall time, giga-cycles, and percentage. Full rows also report the
+	number of ranks, threads, and calls.
+	"""
+	match = regex_mdlog['accounting'].search(text)
+	if not match: return []
+	rows,rules = [],0
+	for line in text[match.end():].splitlines():
+		if re.match(r'^\s*-{10,}\s*$',line):
+			rules += 1
+			#---rules separate the header, the rows, and the total so the third rule ends the table
+			if rules==3: break
+			continue
+		if rules<1: continue
+		found = regex_mdlog['table_row'].match(line)
+		if not found: continue
+		values = [float(i) for i in found.group(2).split()]
+		if len(values)<3: continue
+		row = {'name':found.group(1).strip(),'wall':values[-3],'giga_cycles':values[-2],'percent':values[-1]}
+		if len(values)>=6: row.update(ranks=int(values[0]),threads=int(values[1]),calls=int(values[2]))
+		rows.append(row)
+	return rows
+
+def gmx_mdlog_parse(fn):
+	"""
+	Parse the performance section of an mdrun log. Returns None if the run did not write one (e.g. the run
+	was interrupted or it was a minimization).
+	"""
+	if not os.path.isfile(fn): return None
+	text = mdlog_read_tail(fn)
+	perf = {}
+	found = regex_mdlog['performance'].findall(text)
+	if not found: return None
+	#---the column names are in parentheses on the line above the values
+	lines = text.splitlines()
+	index = max([ii for ii,i in enumerate(lines) if re.match(r'^Performance:',i)])
+	names = re.findall(r'\((.*?)\)',lines[index-1]) if index>0 else []
+	values = found[-1].split()
+	if len(names)!=len(values): names = ['ns/day','hour/ns'][:len(values)]
+	for name,value in zip(names,values):
+		try: perf[name] = float(value)
+		except: pass
+	if 'hour/ns' in perf: perf['hours/ns'] = perf.pop('hour/ns')
+	if 'ns/day' not in perf: return None
+	time_found = regex_mdlog['time'].findall(text)
+	if time_found: perf['core_time'],perf['wall_time'],perf['core_percent'] = [float(i) for i in time_found[-1]]
+	for key in ['steps','pme_load','pme_lost','dd_imbalance','dd_lost']:
+		values = regex_mdlog[key].findall(text)
+		if values: perf[key] = float(values[-1]) if key!='steps' else int(values[-1])
+	#---the decomposition grid is reported near the top so we only find it when the log is shorter than the tail
+	grid = regex_mdlog['dd_grid'].findall(text)
+	if grid: perf['dd_grid'] = [int(i) for i in grid[-1]]
+	parallel = regex_mdlog['parallel'].findall(text)
+	if parallel:
+		perf['ranks'] = int(parallel[-1][0])
+		if parallel[-1][1]: perf['threads'] = int(parallel[-1][1])
+	perf['accounting'] = mdlog_accounting(text)
+	return perf
+
+def gmx_mdlog_time(fn):
+	"""
+	Get the step and simulation time (ps) of the last energy output in an mdrun log. Returns None if the log 
+	does not have any energy output yet.
+	"""
+	if not os.path.isfile(fn): return None
+	size = os.path.getsize(fn)
+	with open(fn,'rb') as fp:
+		if size>mdlog_tail_bytes: fp.seek(size-mdlog_tail_bytes)
+		text = fp.read().decode(errors='ignore')
+	found = regex_mdlog['step_time'].findall(text)
+	if not found: return None
+	return {'step':int(found[-1][0]),'time':float(found[-1][1])}
@@ -1,5 +1,13 @@
 #!/usr/bin/env python
 
+import os,re,glob,json
+from edr import EDRFile,edr_read
+from xtc import xtc_scan,xtc_concatenate
+from cpt import cpt_header,cpt_to_gro
+
+_not_reported = ['edr_read','xtc_scan','xtc_concatenate','cpt_header','cpt_to_gro',
+	'gmx_get_reference_gro']
+
 def gmx_get_last_frame(gro='system-previous',dest=None,source=None,tpr=False):
 	"""
 	Prepare or locate a snapshot of the last state of the system.
@@ -55,6 +63,15 @@ def gmx_get_last_frame(gro='system-previous',dest=None,source=None,tpr=False):
 			msg += 'this might have occured if your simulation ran for less than 15 minutes'
 			'and hence failed to write a cpt file for us to record the final frame'
 			raise Exception(msg)
+		#---write the last frame from the checkpoint directly if we can find the atom names
+		#---checkpoint layouts we cannot read fall back to trjconv below
+		try:
+			reference = gmx_get_reference_gro(source,cpt_header(cpt)['natoms'])
+			if reference:
+				state.last_frame = cpt_to_gro(cpt,reference,os.path.join(dest,gro+'.gro'))
+				return state.last_frame
+		except Exception as e:
+			print('[WARNING] cannot read the checkpoint %s so we use trjconv: %s'%(cpt,e))
 		#---use a custom command template here in case gmxcalls lacks it
 		custom_gmxcall = gmx_commands_interpret('trjconv -f CPT -o OUT -s TPR')['trjconv']
 		if dest:
@@ -72,10 +89,23 @@ def gmx_get_last_frame(gro='system-previous',dest=None,source=None,tpr=False):
 	#---! point to other functions
 	return state.last_frame
 
+def gmx_get_reference_gro(source,natoms):
+	"""
+	Find the newest GRO file in a folder with a particular number of atoms. Checkpoints lack atom and residue
+	names so we take them from this structure when we write the last frame from a checkpoint.
+	"""
+	for fn in sorted(glob.glob(os.path.join(source,'*.gro')),key=lambda x:os.path.getmtime(x),reverse=True):
+		with open(fn) as fp: 
+			fp.readline()
+			try: count = int(fp.readline().split()[0])
+			except: continue
+		if count==natoms: return fn
+	return None
+
 def gmx_get_trajectory(dest=None):
 	"""
 	Convert the trajectory to reassemble broken molecules.
-	Requires items from the history_gmx.
+	Requires the last mdrun call from the gmx journal.
 	Note that this is customized for vmdmake but it could be generalized and added to automacs.py.
 	"""
 	last_call = gmx_get_last_call('mdrun')
@@ -98,3 +128,100 @@ def gmx_get_trajectory(dest=None):
 	#---if the destination is remote we attach the full path to the tpr, which can remain in place
 	if dest: last_tpr = os.path.join(os.getcwd(),state.here,last_tpr)
 	return {'xtc':out+'.xtc','gro':out+'.gro','tpr':last_tpr}
+
+def gmx_consolidate_trajectory(source=None,out='md.consolidated',stride=1,pbc='mol',group='0',where='consolidate'):
+	"""
+	Consolidate the trajectories from all parts (md.part*.xtc) into a single trajectory with a frame index.
+	Each part is processed by trjconv (with -pbc mol by default) in parallel using gmx_async, then the frames are 
+	concatenated in order without duplicates at the part boundaries and we keep every stride-th frame. Use pbc=None 
+	to skip trjconv and concatenate the original parts. Processed parts are recorded in a manifest in the 
+	`where` folder so an interrupted call picks up where it left off. Returns the paths to the trajectory, the 
+	frame index, and the last run input.
+	"""
+	source = os.path.join(source if source else state.here,'')
+	stride = int(stride)
+	parts = sorted(glob.glob(source+'md.part[0-9][0-9][0-9][0-9].xtc'),
+		key=lambda x:int(re.search(r'md\.part(\d+)\.xtc$',x).group(1)))
+	if not parts: raise Exception('cannot find any trajectories (md.part*.xtc) in %s'%source)
+	work = os.path.join(source,where,'')
+	if not os.path.isdir(work): os.mkdir(work)
+	manifest_fn = work+'manifest.json'
+	manifest = {'parts':{},'outputs':{}}
+	if os.path.isfile(manifest_fn):
+		with open(manifest_fn) as fp: manifest = json.load(fp)
+	def write_manifest():
+		with open(manifest_fn+'.tmp','w') as fp: json.dump(manifest,fp)
+		os.rename(manifest_fn+'.tmp',manifest_fn)
+	#---parts are processed again if the source changed or we requested different options
+	processed,futures = [],[]
+	for fn in parts:
+		name = os.path.basename(fn)
+		tpr = re.sub(r'\.xtc$','.tpr',fn)
+		spec = {'size':os.path.getsize(fn),'mtime':os.path.getmtime(fn),'pbc':pbc,'group':group}
+		if not pbc: 
+			processed.append(fn)
+			continue
+		target = work+re.sub(r'\.xtc$','.%s.xtc'%pbc,name)
+		processed.append(target)
+		done = manifest['parts'].get(name,None)
+		if done and done['spec']==spec and os.path.isfile(target) and os.path.getsize(target)==done['output_size']:
+			continue
+		if not os.path.isfile(tpr): raise Exception('cannot find the run input %s for %s'%(tpr,fn))
+		custom = gmx_commands_interpret('trjconv -f XTC -o OUT.xtc -s TPR -pbc %s'%pbc)['trjconv']
+		futures.append((name,spec,target,gmx_async('trjconv',custom=custom,xtc=os.path.abspath(fn),
+			tpr=os.path.abspath(tpr),out=os.path.abspath(target[:-4]),inpipe='%s\n'%group,
+			log=os.path.abspath(work+'log-trjconv-%s'%name[:-4]),cwd=source)))
+	if futures: status('processing %d of %d parts with trjconv'%(len(futures),len(parts)),tag='status')
+	#---record each part as soon as it is done so that we can resume after an interruption
+	errors = []
+	for name,spec,target,future in futures:
+		try: gmx_wait(future)
+		except Exception as e: 
+			errors.append((name,e))
+			continue
+		manifest['parts'][name] = {'spec':spec,'output':os.path.basename(target),'output_size':os.path.getsize(target)}
+		write_manifest()
+	if errors: raise Exception('failed to process %s'%', '.join([i for i,j in errors]))
+	#---concatenate unless the output already holds these parts with the same options
+	out_fn,index_fn = source+out+'.xtc',source+out+'.index.json'
+	spec = {'parts':[[os.path.basename(i),os.path.getsize(i)] for i in processed],'stride':stride,'pbc':pbc}
+	if not (manifest['outputs'].get(out,None)==spec and os.path.isfile(out_fn) and os.path.isfile(index_fn)):
+		index = xtc_concatenate(processed,out_fn,stride=stride)
+		index['sources'] = [os.path.basename(i) for i in parts]
+		with open(index_fn,'w') as fp: json.dump(index,fp)
+		manifest['outputs'][out] = spec
+		write_manifest()
+		status('wrote %d frames from %d parts to %s'%(len(index['step']),len(parts),out_fn),tag='status')
+	return {'xtc':out_fn,'index':index_fn,'tpr':re.sub(r'\.xtc$','.tpr',parts[-1])}
+
+#---energy files are kept open by path so that repeated calls with tail only read new frames
+gmx_energy_files = {}
+
+def gmx_get_energy(terms=None,edr=None,source=None,tail=False):
+	"""
+	Read energy terms from the energy files of a simulation into arrays without calling `gmx energy`.
+	Returns a dictionary with time, step, and each requested term (all terms by default).
+	The energy files default to all parts (md.part*.edr) in the source folder (state.here by default) or the
+	energy file from the last mdrun. Use tail to get only the frames written since the last call, which is
+	useful for checking on a simulation which is still running.
+	"""
+	if edr: fns = [edr] if type(edr)==str else list(edr)
+	else:
+		source = os.path.join(source if source else state.here,'')
+		fns = sorted(glob.glob(source+'md.part*.edr'),
+			key=lambda x:int(re.search(r'md\.part(\d+)\.edr$',x).group(1)))
+		if not fns:
+			try: fns = [source+gmx_get_last_call('mdrun')['flags']['-e']]
+			except: raise Exception('cannot find energy files in %s'%source)
+	if not tail: return edr_read(fns,terms=terms)
+	#---tailing only follows the latest part
+	fn = os.path.abspath(fns[-1])
+	if fn not in gmx_energy_files: gmx_energy_files[fn] = EDRFile(fn)
+	return gmx_energy_files[fn].tail(terms=terms)
+
+def gmx_get_energy_terms(edr):
+	"""
+	List the energy terms and units in an energy file.
+	"""
+	reader = EDRFile(edr)
+	return list(zip(reader.names,reader.units))
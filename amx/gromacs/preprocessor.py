@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+Preprocess GROMACS topologies in the manner of the C preprocessor used by grompp.
+We handle nested #ifdef/#ifndef blocks with #else, #define and #undef with macro substitution, and recursive
+#include statements which we resolve relative to the including file and the force field directory.
+Files are read once per process and reused until they change on disk or we read too many lines to keep.
+"""
+
+import os,re,threading,collections
+
+#---lines of each file read by the preprocessor keyed by absolute path and checked against the modification time
+itp_file_cache = collections.OrderedDict()
+itp_file_cache_lock = threading.Lock()
+#---limit on the number of lines held in the cache, after which we drop the least-recently used files
+itp_file_cache_limit = 2000000
+#---limit on nested includes so that a file which includes itself fails quickly
+itp_include_max_depth = 32
+
+def itp_lines(fn):
+	"""
+	Read the lines of a topology file with continuation lines joined. Results are cached until the file changes.
+	"""
+	return itp_lines_stamped(fn)[1]
+
+def itp_lines_stamped(fn):
+	"""
+	Read the lines of a topology file (see itp_lines) and return them with the modification time we read.
+	"""
+	fn = os.path.abspath(fn)
+	mtime = os.path.getmtime(fn)
+	with itp_file_cache_lock:
+		cached = itp_file_cache.pop(fn,None)
+		if cached and cached[0]==mtime: 
+			itp_file_cache[fn] = cached
+			return cached
+	with open(fn) as fp: text = fp.read()
+	cached = (mtime,re.sub(r'\\[ \t]*\n',' ',text).split('\n'))
+	with itp_file_cache_lock:
+		itp_file_cache.pop(fn,None)
+		itp_file_cache[fn] = cached
+		total = sum([len(i[1]) for i in itp_file_cache.values()])
+		while len(itp_file_cache)>1 and total>itp_file_cache_limit:
+			oldest,(mtime_oldest,evicted) = itp_file_cache.popitem(last=False)
+			total -= len(evicted)
+	return cached
+
+def itp_force_field_dirs(fn):
+	"""
+	Find the force field folder (ending in .ff) that contains a file. Includes may be relative to this folder
+	or to its parent (e.g. charmm36.ff/ions.itp).
+	"""
+	dn = os.path.dirname(os.path.abspath(fn))
+	while dn!=os.path.dirname(dn):
+		if dn.endswith('.ff'): return [dn,os.path.dirname(dn)]
+		dn = os.path.dirname(dn)
+	return []
+
+def itp_headers(fn):
+	"""
+	Find the names of the molecules defined in a topology file and the files it includes without preprocessing
+	or parsing it. Molecules in conditional blocks are always listed.
+	"""
+	molecules,includes,waiting = [],[],False
+	with open(fn) as fp:
+		for line in fp:
+			line = line.split(';',1)[0].strip()
+			if not line: continue
+			elif line[0]=='#':
+				if line.startswith('#include'): includes.append(line[len('#include'):].strip().strip('"<>'))
+			elif line[0]=='[': waiting = line[1:].rstrip(']').strip()=='moleculetype'
+			elif waiting: molecules.append(line.split()[0]); waiting = False
+	return {'molecules':molecules,'includes':includes}
+
+class GMXPreprocessor:
+	"""
+	Preprocess a topology file and its includes.
+	The defs are names which the user defines (True or a value) or undefines (False) as with grompp's define flag.
+	The "compat" policy assumes that any name which is only tested by #ifdef is defined, which reproduces the
+	original behavior of GMXTopology (e.g. position restraints are kept). The "strict" policy follows grompp
+	and also raises an exception when it cannot find an include. Set expand to False to skip macro substitution.
+	"""
+	def __init__(self,defs=None,include_dirs=None,policy='compat',expand=True):
+		if policy not in ['compat','strict']: raise Exception('unknown preprocessor policy %s'%policy)
+		self.policy,self.expand = policy,expand
+		self.include_dirs = list(include_dirs or [])
+		defs = defs or {}
+		self.macros = dict([(k,'' if v is True else str(v)) for k,v in defs.items() if v is not False])
+		self.undefined = set([k for k,v in defs.items() if v is False])
+		#---names tested by #ifndef are never assumed to be defined under the compat policy
+		self.tested_ifndef = set()
+		#---every file read, with its modification time, and includes we could not find
+		self.files,self.missing = {},[]
+		#---paths we searched for the missing includes so that cached results can check for them later
+		self.absent = []
+		self._substitute = None
+
+	def defined(self,name):
+		if name in self.macros: return True
+		if name in self.undefined: return False
+		return self.policy=='compat' and name not in self.tested_ifndef
+
+	def define(self,name,value):
+		self.macros[name] = value
+		self.undefined.discard(name)
+		self._substitute = None
+
+	def undef(self,name):
+		self.macros.pop(name,None)
+		self.undefined.add(name)
+		self._substitute = None
+
+	def substitute(self,line):
+		"""Replace defined names with their values outside of comments."""
+		if self._substitute==None:
+			names = [k for k,v in self.macros.items() if v]
+			self._substitute = re.compile(r'\b(%s)\b'%'|'.join(
+				[re.escape(i) for i in sorted(names,key=len,reverse=True)])) if names else False
+		if not self._substitute: return line
+		code,sep,comment = line.partition(';')
+		return self._substitute.sub(lambda m:self.macros[m.group(1)],code)+sep+comment
+
+	def candidates(self,name,source):
+		"""Paths for an included file in the order that we search them."""
+		if os.path.isabs(name): return [name]
+		return [os.path.abspath(os.path.join(dn,name)) 
+			for dn in [os.path.dirname(source)]+self.include_dirs+itp_force_field_dirs(source)]
+
+	def resolve(self,name,source):
+		"""Find an included file relative to the including file and then the include folders."""
+		for fn in self.candidates(name,source):
+			if os.path.isfile(fn): return fn
+		return None
+
+	def process(self,fn,depth=0):
+		"""
+		Return the preprocessed lines of a file with the directives removed and includes expanded.
+		"""
+		return [line for source,raw,line in self.process_sources(fn,depth=depth)]
+
+	def process_sources(self,fn,depth=0):
+		"""
+		Preprocess a file and return the file, the original text, and the text after macro substitution for
+		each line that we keep. This lets the caller tell the lines of a file from the lines it includes.
+		"""
+		if depth>itp_include_max_depth: raise Exception('includes are nested too deeply at %s'%fn)
+		fn = os.path.abspath(fn)
+		self.files[fn],lines = itp_lines_stamped(fn)
+		if self.policy=='compat':
+			for line in lines:
+				if line.lstrip().startswith('#ifndef'): self.tested_ifndef.update(line.split()[1:2])
+		out = []
+		#---each open block records whether its parent is active and whether this branch is taken
+		stack = []
+		active = True
+		for lnum,line in enumerate(lines):
+			stripped = line.strip()
+			if stripped[:1]!='#':
+				if active: out.append((fn,line,self.substitute(line) if self.expand and self.macros else line))
+				continue
+			parts = stripped[1:].split(None,2)
+			directive = parts[0] if parts else ''
+			if directive in ['ifdef','ifndef']:
+				if len(parts)<2: raise Exception('missing name for #%s at %s:%d'%(directive,fn,lnum+1))
+				taken = self.defined(parts[1])==(directive=='ifdef')
+				stack.append((active,taken))
+				active = active and taken
+			elif directive=='else':
+				if not stack: raise Exception('unmatched #else at %s:%d'%(fn,lnum+1))
+				parent,taken = stack[-1]
+				active = parent and not taken
+			elif directive=='endif':
+				if not stack: raise Exception('unmatched #endif at %s:%d'%(fn,lnum+1))
+				active = stack.pop()[0]
+			elif not active: continue
+			elif directive=='define':
+				if len(parts)<2: raise Exception('missing name for #define at %s:%d'%(fn,lnum+1))
+				self.define(parts[1],parts[2].split(';')[0].strip() if len(parts)>2 else '')
+			elif directive=='undef': self.undef(parts[1])
+			elif directive=='include':
+				name = stripped[len('#include'):].split(';')[0].strip().strip('"<>')
+				found = self.resolve(name,fn)
+				if not found:
+					if self.policy=='strict': raise Exception('cannot find include %s from %s'%(name,fn))
+					self.missing.append(name)
+					self.absent.extend([i for i in self.candidates(name,fn) if i not in self.absent])
+				else: out.extend(self.process_sources(found,depth=depth+1))
+			#---the original preprocessor ignored other lines that start with a hash
+			elif self.policy=='strict': raise Exception('unsupported directive #%s at %s:%d'%(directive,fn,lnum+1))
+		if stack: raise Exception('missing #endif in %s'%fn)
+		return out
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""
+Batch scheduler backends and walltime-aware resubmission chains.
+A chain is a series of jobs in a step folder which each continue the simulation from the last checkpoint (see
+continuation.py) until it reaches a target time. Each job submits its successor when it starts so that the
+successor waits in the queue with a dependency on the running job, and it cancels the successor when the target
+is reached or a part fails. The chain is recorded in chain.json in the step folder. Jobs run this module from the
+step folder (`python ../amx/gromacs/schedulers.py start|finish`) so it does not import automacs.
+"""
+
+import os,sys,re,json,time,subprocess,signal,fcntl,threading
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from mdlog import gmx_mdlog_time
+from cpt import cpt_header
+
+chain_fn = 'chain.json'
+chain_script_fn = 'cluster-chain.sh'
+
+class Scheduler:
+	"""
+	Submit and cancel jobs. Backends set the submit command, the dependency flag, and the environment
+	variables that hold the job id and the submission folder inside a running job.
+	"""
+	name = None
+	submit_command = None
+	cancel_command = None
+	depend_flag = None
+	job_id_var = None
+	workdir_var = None
+	def __init__(self,submit_command=None):
+		if submit_command: self.submit_command = submit_command
+	def submit(self,script,cwd,after=None,log=None):
+		"""Submit a script and return the job id."""
+		cmd = self.submit_command+(' '+self.depend_flag%after if after else '')+' '+script
+		proc = subprocess.Popen(cmd,shell=True,cwd=cwd,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+		stdout,stderr = [i.decode() for i in proc.communicate()]
+		if proc.returncode!=0: raise Exception('failed to submit via "%s": %s'%(cmd,stderr.strip()))
+		return self.parse_id(stdout)
+	def parse_id(self,text): return text.strip().split()[-1]
+	def cancel(self,job):
+		"""Cancel a job that has not finished. Errors are ignored because the job may have already ended."""
+		subprocess.call('%s %s'%(self.cancel_command,job),shell=True,
+			stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+	def self_id(self): return os.environ.get(self.job_id_var,None)
+	def preamble(self):
+		"""Commands at the top of a job script, after the cluster header."""
+		return 'cd ${%s:-.}'%self.workdir_var
+
+class SLURM(Scheduler):
+	name = 'slurm'
+	submit_command = 'sbatch'
+	cancel_command = 'scancel'
+	#---successors also run after a job is killed at the walltime so that they pick up from the checkpoint
+	depend_flag = '--dependency=afterany:%s'
+	job_id_var = 'SLURM_JOB_ID'
+	workdir_var = 'SLURM_SUBMIT_DIR'
+	def parse_id(self,text):
+		found = re.search(r'Submitted batch job (\d+)',text)
+		return found.group(1) if found else text.strip().split(';')[0]
+
+class PBS(Scheduler):
+	name = 'pbs'
+	submit_command = 'qsub'
+	cancel_command = 'qdel'
+	depend_flag = '-W depend=afterany:%s'
+	job_id_var = 'PBS_JOBID'
+	workdir_var = 'PBS_O_WORKDIR'
+
+class Local(Scheduler):
+	"""
+	Run jobs in the background on this machine for testing chains. The job id is the process id and the
+	dependency is a loop which waits for the previous process to exit.
+	"""
+	name = 'local'
+	job_id_var = 'AMX_JOB_ID'
+	def submit(self,script,cwd,after=None,log=None):
+		wait = 'while kill -0 %s 2>/dev/null; do sleep 1; done; '%after if after else ''
+		with open(os.path.join(cwd,log if log else 'log-chain'),'w') as fp:
+			proc = subprocess.Popen(['bash','-c',wait+'exec bash %s'%script],cwd=cwd,
+				stdout=fp,stderr=subprocess.STDOUT,preexec_fn=os.setsid)
+		#---reap the job when it ends so its successor does not wait on a zombie while this process lives
+		reaper = threading.Thread(target=proc.wait)
+		reaper.daemon = True
+		reaper.start()
+		return str(proc.pid)
+	def cancel(self,job):
+		try: os.killpg(int(job),signal.SIGTERM)
+		except OSError: pass
+	def preamble(self): return 'export AMX_JOB_ID=$$'
+
+schedulers = dict([(i.name,i) for i in [SLURM,PBS,Local]])
+
+def scheduler_backend(name=None,submit_command=None):
+	"""
+	Get a backend by name or infer it from the submit command in the machine configuration.
+	"""
+	if not name:
+		if not submit_command: name = 'local'
+		elif re.search(r'\bsbatch\b',submit_command): name = 'slurm'
+		elif re.search(r'\bqsub\b',submit_command): name = 'pbs'
+		else: raise Exception('cannot infer the scheduler from the submit command "%s"'%submit_command)
+	if name not in schedulers: raise Exception('unknown scheduler %s. options: %s'%(name,list(schedulers)))
+	return schedulers[name](submit_command=submit_command)
+
+class ChainLock:
+	"""
+	Hold an exclusive lock on a chain while a job reads and updates it, since a successor can start before
+	the job that submitted it has written the chain.
+	"""
+	def __init__(self,here='.'): self.fn = os.path.join(here,chain_fn+'.lock')
+	def __enter__(self):
+		self.fp = open(self.fn,'a')
+		fcntl.flock(self.fp,fcntl.LOCK_EX)
+		return self
+	def __exit__(self,*args):
+		fcntl.flock(self.fp,fcntl.LOCK_UN)
+		self.fp.close()
+
+def chain_read(fn=chain_fn):
+	if not os.path.isfile(fn): raise Exception('cannot find %s in %s'%(fn,os.getcwd()))
+	with open(fn) as fp: return json.load(fp)
+
+def chain_write(chain,fn=chain_fn):
+	"""Replace the chain file in one step."""
+	with open(fn+'.tmp','w') as fp: json.dump(chain,fp)
+	os.rename(fn+'.tmp',fn)
+
+def chain_backend(chain): return scheduler_backend(chain['scheduler'],chain.get('submit_command',None))
+
+def chain_script(header,until,scheduler):
+	"""
+	Write the job script for a chain. The header comes from the cluster configuration.
+	"""
+	python = '${PYTHON:-python} -B ../amx/gromacs/schedulers.py'
+	return '\n'.join([header.rstrip('\n'),scheduler.preamble(),
+		'#---register this job and submit its successor',
+		'%s start || exit 0'%python,
+		'./script-continue.sh -m until -u %s'%until,
+		'%s finish $?'%python,''])
+
+def chain_submit(chain,after=None,cwd='.'):
+	"""Submit the next job in a chain."""
+	scheduler = chain_backend(chain)
+	log = 'log-chain-%02d'%(len(chain['jobs'])+1)
+	job = scheduler.submit(chain['script'],cwd=cwd,after=after,log=log)
+	chain['jobs'].append({'id':job,'status':'queued','submitted':time.time(),'after':after,'log':log})
+	print('[STATUS] submitted job %s%s'%(job,' after %s'%after if after else ''))
+	return job
+
+def chain_progress():
+	"""
+	Get the simulation time of the latest part from the part index written by continuation.py. We read the time
+	from the checkpoint and fall back to the mdrun log.
+	"""
+	from continuation import continuation_index_read,continuation_latest
+	latest = continuation_latest(continuation_index_read())
+	if not latest: return None
+	try: return cpt_header(latest['files']['-cpo'])['time']
+	except: pass
+	found = gmx_mdlog_time(latest['files']['-g'])
+	return found['time'] if found else None
+
+def chain_start():
+	"""
+	Register a running job and submit its successor. Exits with an error if the chain was stopped.
+	"""
+	with ChainLock(): chain_start_locked()
+
+def chain_start_locked():
+	chain = chain_read()
+	me = chain_backend(chain).self_id()
+	jobs = [i for i in chain['jobs'] if i['id']==me]
+	if jobs: job = jobs[0]
+	else:
+		job = {'id':me,'status':'queued','submitted':None}
+		chain['jobs'].append(job)
+	#---a job that never finished was killed by the scheduler (e.g. at the walltime)
+	for other in chain['jobs']:
+		if other['status']=='running': other['status'] = 'killed'
+	if chain['status']!='running':
+		job['status'] = 'cancelled'
+		chain_write(chain)
+		print('[STATUS] the chain is %s so this job will not run'%chain['status'])
+		sys.exit(1)
+	job.update(status='running',start=time.time())
+	if len(chain['jobs'])<chain['max_jobs']: chain_submit(chain,after=me)
+	chain_write(chain)
+
+def chain_finish(returncode):
+	"""
+	Record the end of a job and stop the chain if the target time is reached, a part failed, or the simulation
+	made no progress.
+	"""
+	with ChainLock(): chain_finish_locked(returncode)
+
+def chain_finish_locked(returncode):
+	chain = chain_read()
+	me = chain_backend(chain).self_id()
+	jobs = [i for i in chain['jobs'] if i['id']==me]
+	if not jobs: raise Exception('job %s is not in the chain'%me)
+	job = jobs[0]
+	sim_time = chain_progress()
+	job.update(end=time.time(),returncode=int(returncode),time=sim_time,
+		status='done' if int(returncode)==0 else 'failed')
+	previous = [i['time'] for i in chain['jobs'] if i is not job and i.get('time',None)!=None]
+	if job['status']=='failed': chain['status'] = 'failed'
+	elif sim_time!=None and sim_time>=float(chain['until'])-1e-6: chain['status'] = 'complete'
+	elif sim_time==None or (previous and sim_time<=max(previous)): chain['status'] = 'stalled'
+	elif len(chain['jobs'])>=chain['max_jobs'] and not [i for i in chain['jobs'] if i['status']=='queued']:
+		chain['status'] = 'exhausted'
+	if chain['status']!='running':
+		for other in chain['jobs']:
+			if other['status']=='queued':
+				chain_backend(chain).cancel(other['id'])
+				other['status'] = 'cancelled'
+	print('[STATUS] job %s %s at %s ps of %s ps and the chain is %s'%(
+		me,job['status'],sim_time,chain['until'],chain['status']))
+	chain_write(chain)
+
+def chain_begin(until,scheduler,header,here,max_jobs=20,submit_command=None):
+	"""
+	Write a job script and submit the first job of a chain in a step folder.
+	"""
+	with ChainLock(here): 
+		return chain_begin_locked(until,scheduler,header,here,max_jobs=max_jobs,submit_command=submit_command)
+
+def chain_begin_locked(until,scheduler,header,here,max_jobs=20,submit_command=None):
+	if os.path.isfile(os.path.join(here,chain_fn)):
+		chain = chain_read(os.path.join(here,chain_fn))
+		if chain['status']=='running' and [i for i in chain['jobs'] if i['status'] in ['queued','running']]:
+			raise Exception('a chain is already running in %s'%here)
+	backend = scheduler_backend(scheduler,submit_command)
+	with open(os.path.join(here,chain_script_fn),'w') as fp: fp.write(chain_script(header,until,backend))
+	os.chmod(os.path.join(here,chain_script_fn),0o744)
+	chain = {'scheduler':backend.name,'submit_command':backend.submit_command,'until':float(until),
+		'max_jobs':int(max_jobs),'script':chain_script_fn,'status':'running','jobs':[],'created':time.time()}
+	chain_submit(chain,cwd=here)
+	chain_write(chain,os.path.join(here,chain_fn))
+	return chain
+
+if __name__=='__main__':
+	if len(sys.argv)==2 and sys.argv[1]=='start': chain_start()
+	elif len(sys.argv)==3 and sys.argv[1]=='finish': chain_finish(sys.argv[2])
+	else: raise Exception('usage: schedulers.py start|finish <returncode>')
@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 
-import sys,os,re
+import sys,os,re,collections
 try: import numpy as np
 #---! automacs tries to load this even for e.g. make upload
 except: pass
 import json
 
-_not_reported = ['dotplace']
+_not_reported = ['dotplace','GMXSection']
 from common import dotplace,contiguous_encode
 from topology_tools import GMXTopology
+from topology_sections import GMXSection
 from force_field_tools import Landscape
 
 #---SELECTIONS
@@ -56,6 +57,60 @@ def parse(text,structure):
 		else: text = re.sub(regex_operator,Tokenize(),text)
 	return operator_abstract(*sentence[-1],sentence=sentence,structure=structure)
 
+###---SEQUENCE MATCHING
+
+def sequence_find(sequence,pattern):
+	"""
+	Find every start of a pattern in a sequence of integer codes with the Knuth-Morris-Pratt algorithm.
+	"""
+	sequence,pattern = list(sequence),list(pattern)
+	if not pattern: return []
+	#---length of the longest proper prefix of the pattern which is also a suffix at each position
+	prefix,k = [0]*len(pattern),0
+	for i in range(1,len(pattern)):
+		while k and pattern[i]!=pattern[k]: k = prefix[k-1]
+		if pattern[i]==pattern[k]: k += 1
+		prefix[i] = k
+	found,k = [],0
+	for i,code in enumerate(sequence):
+		while k and code!=pattern[k]: k = prefix[k-1]
+		if code==pattern[k]: k += 1
+		if k==len(pattern):
+			found.append(i-k+1)
+			k = prefix[k-1]
+	return found
+
+def residue_sequence(residue_names,residue_indices,atom_names=None):
+	"""
+	Split atoms into residues wherever the residue number or name changes. Returns the index of the first atom,
+	the name, and the number of atoms in each residue. Residues named ION take the name of their first atom
+	if the ions are distinguished by atom name.
+	"""
+	residue_names,residue_indices = np.array(residue_names),np.array(residue_indices)
+	if not len(residue_names): return np.zeros(0,dtype=int),np.array([]),np.zeros(0,dtype=int)
+	starts = np.concatenate(([0],np.where((residue_indices[1:]!=residue_indices[:-1])|
+		(residue_names[1:]!=residue_names[:-1]))[0]+1))
+	sizes = np.diff(np.concatenate((starts,[len(residue_names)])))
+	names = residue_names[starts].astype(object)
+	if atom_names is not None:
+		ions = np.where(names=='ION')[0]
+		if len(np.unique(np.array(atom_names)[starts[ions]]))>1: names[ions] = np.array(atom_names)[starts[ions]]
+	return starts,names.astype(str),sizes
+
+def itp_molecules(itps):
+	"""
+	Collect the molecules from a list of ITP files along with the residue names and numbers of their atoms.
+	"""
+	molecules = collections.OrderedDict()
+	for top in [GMXTopology(fn) for fn in itps]:
+		for name,mol in top.molecules.items():
+			if name in molecules: raise Exception('molecule %s is defined by more than one ITP'%name)
+			atoms = mol['atoms']
+			if isinstance(atoms,GMXSection): resnames,resnums = list(atoms['resname']),list(atoms['resnr'])
+			else: resnames,resnums = [i['resname'] for i in atoms],[i['resnr'] for i in atoms]
+			molecules[name] = {'resname':resnames,'resnr':resnums}
+	return molecules
+
 ###---CLASSES
 
 class GMXStructure:
@@ -355,15 +410,14 @@ class GMXStructure:
 			land = Landscape()
 			if text not in land.categories: 
 				raise Exception('selection %s is not a category in the landscape'%text)
-			names = land.objects_by_category(text)
 			#---we wish to check every residue-atom name pair to see if it's in the selection list
 			#---we cannot use a pure in1d because we have two dimensions
 			#---we cannot even use all on two separate in1d items because this will return a true value
 			#---...whenever the residue name and the atom name can be found anywhere in the list
 			#---for this reason we encode things and then use the in1d lookup
 			#---assemble all valid residue,atom name pairs for this selection
-			residue_atom_pairs = np.concatenate([np.array([[land.objects[n]['resname'],a] 
-				for a in land.objects[n]['atoms']]) for n in names])
+			#---the landscape indexes these pairs when it reads the category
+			residue_atom_pairs = np.array(land.residue_atom_pairs(text))
 
 			if False:
 				def encoder(x): return np.ascontiguousarray(x).view([('',x.dtype)]*x.shape[-1]).ravel()
@@ -433,7 +487,12 @@ class GMXStructure:
 	def detect_composition(self,composition_adjust=None):
 		"""
 		Infer the topology.
+		Systems with protein molecules in state.itp are matched by residue sequence instead.
 		"""
+		itps = [state.here+fn for fn in (state.itp or [])]
+		if itps and any([np.any(np.isin(mol['resname'],Landscape.protein_residues)) 
+			for mol in itp_molecules(itps).values()]):
+			return self.detect_composition_proteins(itps=itps,composition_adjust=composition_adjust)
 		#! removed when building multiply_general expt 
 		#! ...if not state.landscape_metadata:
 		#! ...	raise Exception('state/settings needs `landscape.yaml` for metadata')
@@ -470,33 +529,54 @@ class GMXStructure:
 			composition = get_comp_adjust['composition_adjust'](composition)
 		return composition
 
-	def detect_composition_NEWISH(self):
-		"""
-		Detect the composition of a system in order to write an accurate topology file.
-		pseudocode:
-			see if there are blocks with proteins
-			if PROTEINS
-				search for ITP files
-				if multiple ITP files throw an error
-				if itp then 
-					read in distinct protein objects
-					scan resnames for residues that correspond to them
-					if any gaps/etc throw an error
-					otherwise log the proteins in their position in the sequence
-					then recapitulate the original composition method
-
-		"""
-		#---! DITCHING THIS FOR NOW!!!
-		collected_protein_itps = [GMXTopology(state.here+fn) for fn in state.itp]
-		molecules = dict([j for k in [i.molecules.items() for i in collected_protein_itps] for j in k])
-
-		#---try to find one ///???
-		seq = np.array([i['resname'] for i in molecules['Protein']['atoms']])
-
-		#wheres = [ii for ii,i in enumerate(self.residue_names) if np.all(self.residue_names[ii:ii+len(seq)]==seq)]
+	def detect_composition_proteins(self,itps=None,composition_adjust=None):
+		"""
+		Detect the composition of a system with proteins in order to write an accurate topology file.
+		We read the molecules in the protein ITP files (state.itp by default) and encode the residues in the 
+		structure and in each molecule by name and number of atoms. Each molecule is found in the structure by 
+		searching these codes (see sequence_find). Longer molecules claim their residues first and any protein 
+		residues left over are an error. The composition is the ordered list of molecules and of runs of the
+		remaining residues (lipids, solvent, and ions) by name, with neighbors of the same name combined.
+		"""
+		if itps==None: itps = [state.here+fn for fn in (state.itp or [])]
+		molecules = itp_molecules(itps)
+		starts,names,sizes = residue_sequence(self.residue_names,self.residue_indices,self.atom_names)
+		#---encode residues as integers
+		codebook = {}
+		def encode(names,sizes): return [codebook.setdefault(i,len(codebook)) for i in zip(names,sizes)]
+		codes = encode(names,sizes)
+		claimed = np.full(len(names),-1,dtype=int)
+		order = sorted(molecules,key=lambda k:len(molecules[k]['resname']),reverse=True)
+		for mnum,name in enumerate(order):
+			if not molecules[name]['resname']: continue
+			mol_starts,mol_names,mol_sizes = residue_sequence(molecules[name]['resname'],molecules[name]['resnr'])
+			pattern = encode(mol_names,mol_sizes)
+			for first in sequence_find(codes,pattern):
+				span = slice(first,first+len(pattern))
+				if np.any(claimed[span]!=-1): continue
+				claimed[span] = mnum
+				#---mark the first residue so that adjacent copies of a molecule are counted separately
+				claimed[first] = len(order)+mnum
+		protein_residues = np.isin(names,Landscape.protein_residues)
+		missing = np.where(protein_residues&(claimed==-1))[0]
+		if len(missing):
+			raise Exception('cannot match %d protein residues to the molecules in %s. the first is %s at atom %d'%(
+				len(missing),itps,names[missing[0]],starts[missing[0]]+1))
+		composition = []
+		for rnum,name in enumerate(names):
+			#---each molecule is counted at its first residue
+			if 0<=claimed[rnum]<len(order): continue
+			elif claimed[rnum]>=len(order): name = order[claimed[rnum]-len(order)]
+			if composition and composition[-1][0]==name: composition[-1][1] += 1
+			else: composition.append([str(name),1])
+		if composition_adjust:
+			get_comp_adjust = {}
+			exec(composition_adjust,get_comp_adjust)
+			composition = get_comp_adjust['composition_adjust'](composition)
+		return composition
 
-		import ipdb;ipdb.set_trace()
-		#---wanted to do a whole subsequence searching thing with a big is-it-a-match? table
+	#---the original name for this method before it was finished
+	detect_composition_NEWISH = detect_composition_proteins
 
 	def renumber(self):
 
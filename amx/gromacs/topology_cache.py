@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""
+Cache parsed topologies in memory and on disk.
+Topologies are pickled once they are parsed. The pickles are kept in a least-recently used cache in memory, which
+returns a fresh copy on every hit, and in a store on disk which is shared by every step (and simulation) that
+reads the same force field. Entries on disk are keyed by the path and parser options and are valid while the
+contents of the topology and all of its includes match the hashes we recorded when we parsed it and none of the
+includes we could not find have appeared. Updates to the
+index are made under a lock file since concurrent simulations share the store.
+"""
+
+import os,json,hashlib,pickle,time,threading,collections,fcntl
+
+#---change this when the parsed topology changes so that we ignore older entries
+topology_cache_version = 3
+#---limit on the pickles held in memory in megabytes
+topology_memory_limit = 64
+
+topology_memory = collections.OrderedDict()
+topology_memory_lock = threading.Lock()
+
+def topology_memory_get(key):
+	"""
+	Get a pickle from memory if none of the files it was parsed from have changed. Files recorded without a
+	modification time are includes that we could not find and the pickle is stale once any of them exist.
+	"""
+	with topology_memory_lock:
+		if key not in topology_memory: return None
+		files,data = topology_memory[key]
+		if not all([os.path.isfile(fn) and os.path.getmtime(fn)==mtime if mtime!=None else not os.path.exists(fn)
+			for fn,mtime in files.items()]):
+			del topology_memory[key]
+			return None
+		topology_memory[key] = topology_memory.pop(key)
+		return data
+
+def topology_memory_put(key,files,data):
+	"""Add a pickle to memory and evict the least-recently used pickles beyond the limit."""
+	with topology_memory_lock:
+		topology_memory.pop(key,None)
+		topology_memory[key] = (dict(files),data)
+		total = sum([len(i[1]) for i in topology_memory.values()])
+		while len(topology_memory)>1 and total>topology_memory_limit*1024.**2:
+			oldest,(files,evicted) = topology_memory.popitem(last=False)
+			total -= len(evicted)
+
+class GMXTopologyCacheLock:
+	"""
+	Hold the thread lock and an exclusive lock on the store while we read and update an index, since other 
+	processes may be updating it at the same time.
+	"""
+	def __init__(self,cache): self.cache = cache
+	def __enter__(self):
+		self.cache.lock.acquire()
+		try:
+			self.fp = open(self.cache.lock_fn,'a')
+			fcntl.flock(self.fp,fcntl.LOCK_EX)
+		except:
+			self.cache.lock.release()
+			raise
+		return self
+	def __exit__(self,*args):
+		fcntl.flock(self.fp,fcntl.LOCK_UN)
+		self.fp.close()
+		self.cache.lock.release()
+
+class GMXTopologyCache:
+	"""
+	A store of pickled topologies on disk with an index and LRU eviction.
+	"""
+	def __init__(self,root,size_limit=256):
+		self.root = os.path.abspath(os.path.expanduser(root))
+		self.objects = os.path.join(self.root,'objects')
+		self.index_fn = os.path.join(self.root,'index.json')
+		self.lock_fn = os.path.join(self.root,'index.lock')
+		#---size limit is in megabytes
+		self.size_limit = float(size_limit)
+		#---other simulations may make the store at the same time
+		try: os.makedirs(self.objects)
+		except OSError:
+			if not os.path.isdir(self.objects): raise
+		self.lock = threading.Lock()
+		#---file hashes are memoized by path, size, and modification time
+		self.hashes = {}
+	def locked(self): return GMXTopologyCacheLock(self)
+	def index(self):
+		"""Read the index."""
+		if not os.path.isfile(self.index_fn): return {}
+		try:
+			with open(self.index_fn) as fp: return json.load(fp)
+		except: return {}
+	def index_write(self,index):
+		"""Write the index atomically because other simulations may share the store."""
+		fn_temp = self.index_fn+'.%d.%d'%(os.getpid(),threading.current_thread().ident)
+		with open(fn_temp,'w') as fp: json.dump(index,fp)
+		os.rename(fn_temp,self.index_fn)
+	def hash_file(self,fn):
+		"""Hash the contents of a file."""
+		stat = os.stat(fn)
+		signature = (fn,stat.st_size,stat.st_mtime)
+		if signature not in self.hashes:
+			hasher = hashlib.sha1()
+			with open(fn,'rb') as fp:
+				for chunk in iter(lambda:fp.read(2**20),b''): hasher.update(chunk)
+			self.hashes[signature] = hasher.hexdigest()
+		return self.hashes[signature]
+	def object_path(self,sha): return os.path.join(self.objects,sha[:2],sha[2:])
+	def load(self,key):
+		"""
+		Get a pickle for a key (the path and parser options) if the files it came from are unchanged.
+		"""
+		#---we check the files outside of the lock so that readers do not wait on each other to hash them
+		entry = self.index().get(key,None)
+		if not entry: return None
+		for fn,sha in entry['files'].items():
+			if not os.path.isfile(fn) or self.hash_file(fn)!=sha: return None
+		if any([os.path.exists(fn) for fn in entry.get('absent',[])]): return None
+		try:
+			with open(self.object_path(entry['object']),'rb') as fp: data = fp.read()
+		except (IOError,OSError): return None
+		with self.locked():
+			index = self.index()
+			if key in index and index[key]['object']==entry['object']:
+				index[key]['used'],index[key]['hits'] = time.time(),index[key].get('hits',0)+1
+				self.index_write(index)
+		return data
+	def store(self,key,files,data,absent=None):
+		"""
+		Store a pickle along with the hashes of the files it came from and the paths of any includes we could
+		not find, since the pickle is stale once they exist.
+		"""
+		absent = sorted(absent or [])
+		with self.locked():
+			hashes = dict([(fn,self.hash_file(fn)) for fn in files])
+			sha = hashlib.sha1(json.dumps([key,hashes,absent,topology_cache_version],
+				sort_keys=True).encode()).hexdigest()
+			dest = self.object_path(sha)
+			if not os.path.isdir(os.path.dirname(dest)): os.makedirs(os.path.dirname(dest))
+			fn_temp = dest+'.%d'%os.getpid()
+			with open(fn_temp,'wb') as fp: fp.write(data)
+			os.rename(fn_temp,dest)
+			index = self.index()
+			previous = index.get(key,None)
+			index[key] = {'files':hashes,'absent':absent,'object':sha,'size':len(data),'created':time.time(),
+				'used':time.time(),'hits':0}
+			#---remove the entry for older contents of the same file
+			if previous and previous['object']!=sha and previous['object'] not in [
+				i['object'] for i in index.values()]:
+				try: os.remove(self.object_path(previous['object']))
+				except OSError: pass
+			self.index_write(index)
+		if self.size()>self.size_limit: self.prune()
+	def size(self):
+		"""Total size of the store in megabytes."""
+		return sum([i.get('size',0) for i in self.index().values()])/1024.**2
+	def prune(self,size_limit=None):
+		"""Evict the least-recently used topologies until the store is under the size limit."""
+		limit = self.size_limit if size_limit==None else float(size_limit)
+		with self.locked():
+			index = self.index()
+			order = sorted(index,key=lambda k:index[k].get('used',0))
+			evicted = []
+			while order and sum([i.get('size',0) for i in index.values()])/1024.**2>limit:
+				key = order.pop(0)
+				evicted.append(key)
+				index.pop(key)
+			self.index_write(index)
+			#---remove objects which are not in the index including any left behind by interrupted writes
+			keep = set([i['object'] for i in index.values()])
+			for root,dns,fns in os.walk(self.objects):
+				for fn in fns:
+					if os.path.basename(root)+fn not in keep:
+						try: os.remove(os.path.join(root,fn))
+						except OSError: pass
+		return evicted
+	def headers(self,fns,scan):
+		"""
+		Get the molecules and includes in topology files (see itp_headers) from an index which we keep alongside
+		the store. Files are scanned again when their size or modification time changes.
+		"""
+		fn_headers = os.path.join(self.root,'headers.json')
+		found,changed = {},False
+		with self.locked():
+			try:
+				with open(fn_headers) as fp: known = json.load(fp)
+			except: known = {}
+			for fn in fns:
+				fn = os.path.abspath(fn)
+				stat = os.stat(fn)
+				entry = known.get(fn,None)
+				if not entry or entry['size']!=stat.st_size or entry['mtime']!=stat.st_mtime:
+					entry = dict(scan(fn),size=stat.st_size,mtime=stat.st_mtime)
+					known[fn],changed = entry,True
+				found[fn] = entry
+			if changed:
+				fn_temp = fn_headers+'.%d.%d'%(os.getpid(),threading.current_thread().ident)
+				with open(fn_temp,'w') as fp: json.dump(known,fp)
+				os.rename(fn_temp,fn_headers)
+		return found
+	def stats(self):
+		"""Summarize the store."""
+		index = self.index()
+		return {'root':self.root,'topologies':len(index),'size (MB)':'%.1f'%self.size(),
+			'limit (MB)':'%.1f'%self.size_limit,'hits':sum([i.get('hits',0) for i in index.values()])}
+
+def topology_cache_key(source,**options):
+	"""Key for a topology from its path and the options which change how we parse it."""
+	return json.dumps([os.path.abspath(source),sorted(options.items()),topology_cache_version],sort_keys=True)
+
+def topology_dumps(payload): return pickle.dumps(payload,protocol=pickle.HIGHEST_PROTOCOL)
+def topology_loads(data): return pickle.loads(data)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""
+Columnar storage for the sections of a molecule topology (atoms, bonds, etc).
+Each section is a numpy structured array with one field per column. Integer columns (e.g. atom indices) are
+stored as 32-bit integers, columns of numbers (e.g. charges and masses) are stored as floats alongside codes for their
+original text, and all other columns (e.g. atom names) are categorical codes into a list of unique values.
+Indexing a section by number returns a row view which behaves like the dict we used to store for each record,
+so the text of every entry is preserved, while indexing by column name returns a typed array.
+"""
+
+import numpy as np
+try: from collections.abc import Mapping
+except ImportError: from collections import Mapping
+
+#---codes for missing entries in rows with fewer columns
+section_missing = -1
+
+def section_column_kind(values):
+	"""
+	Infer the storage for a column of strings. Integers must survive a round trip to text.
+	"""
+	if not len(values): return 'str'
+	text = np.array(values)
+	try:
+		ints = text.astype(np.int64)
+		if np.all(ints.astype(text.dtype)==text) and np.all(np.abs(ints)<2**31): return 'int'
+	except (ValueError,OverflowError): pass
+	try: text.astype(float)
+	except ValueError: return 'str'
+	return 'float'
+
+class GMXRecord(Mapping):
+	"""
+	A row in a topology section which behaves like a dict of strings. Changes are written to the section.
+	"""
+	__slots__ = ('section','index')
+	def __init__(self,section,index): self.section,self.index = section,index
+	def __getitem__(self,key): return self.section.cell(self.index,key)
+	def __setitem__(self,key,value): self.section.set(key,self.index,value)
+	def __iter__(self): return iter(self.section.columns[:self.section.ncols[self.index]])
+	def __len__(self): return int(self.section.ncols[self.index])
+	def __repr__(self): return repr(dict(self))
+
+class GMXSection:
+	"""
+	A topology section stored in a structured array. Rows come from the split lines of a section and may have
+	fewer entries than there are columns.
+	"""
+	def __init__(self,columns,rows=None):
+		self.columns = list(columns)
+		self.column_index = dict([(c,i) for i,c in enumerate(self.columns)])
+		rows = rows or []
+		self.ncols = np.array([len(r) for r in rows],dtype=np.uint8)
+		if len(rows) and self.ncols.max()>len(self.columns):
+			raise Exception('found a row with more than %d columns: %s'%(len(self.columns),self.columns))
+		self.kinds,self.levels,self.level_codes = {},{},{}
+		present = {}
+		for cnum,col in enumerate(self.columns):
+			present[col] = [r[cnum] for r in rows if len(r)>cnum]
+			self.kinds[col] = section_column_kind(present[col])
+		self.data = np.zeros(len(rows),dtype=self.dtype())
+		for cnum,col in enumerate(self.columns):
+			mask = self.ncols>cnum
+			self.fill(col,mask,present[col])
+
+	def dtype(self):
+		"""Fields for each column. Float and string columns have codes for the text of each entry."""
+		fields = []
+		for col in self.columns:
+			kind = self.kinds[col]
+			if kind=='int': fields.append((col,np.int32))
+			elif kind=='float': fields.extend([(col,np.float64),(col+':text',np.int32)])
+			else: fields.append((col+':text',np.int32))
+		return fields
+
+	def fill(self,col,mask,values):
+		"""Store a list of strings in the rows of a column given by a mask."""
+		kind = self.kinds[col]
+		if kind=='int':
+			self.data[col][mask] = np.array(values,dtype=np.int32) if len(values) else 0
+			return
+		if kind=='float': self.data[col][mask] = np.array(values,dtype=float) if len(values) else 0
+		codes = np.full(len(self.data),section_missing,dtype=np.int32)
+		if len(values):
+			levels,inverse = np.unique(np.array(values),return_inverse=True)
+			self.levels[col] = [str(i) for i in levels]
+			codes[mask] = inverse
+		else: self.levels[col] = []
+		self.level_codes[col] = None
+		self.data[col+':text'] = codes
+
+	def __len__(self): return len(self.data)
+	def __iter__(self): return (GMXRecord(self,i) for i in range(len(self.data)))
+	def __getitem__(self,key):
+		"""Get a row view by index, a list of row views by slice, or a typed array by column name."""
+		if isinstance(key,slice): return [GMXRecord(self,i) for i in range(len(self.data))[key]]
+		elif key in self.column_index: return self.column(key)
+		index = int(key)
+		if index<0: index += len(self.data)
+		if not 0<=index<len(self.data): raise IndexError('row %s is out of range'%key)
+		return GMXRecord(self,index)
+	def __eq__(self,other):
+		if not isinstance(other,(list,GMXSection)) or len(other)!=len(self): return False
+		return all([dict(a)==dict(b) for a,b in zip(self,other)])
+	def __ne__(self,other): return not self==other
+	def __repr__(self): return 'GMXSection(%d rows: %s)'%(len(self),' '.join(self.columns))
+
+	def column(self,col):
+		"""
+		Get a column as an array of integers, floats, or strings. Missing entries are zero or empty strings.
+		"""
+		kind = self.kinds[col]
+		if kind in ['int','float']: return self.data[col]
+		levels = np.array(self.levels[col]+[''])
+		return levels[self.data[col+':text']]
+
+	def text(self,col):
+		"""Get the text of every entry in a column as a list of strings. Missing entries are empty strings."""
+		if self.kinds[col]=='int': 
+			values = np.where(self.ncols>self.column_index[col],self.data[col].astype(str),'')
+		else: values = np.array(self.levels[col]+[''])[self.data[col+':text']]
+		return values.tolist()
+
+	def cell(self,index,col):
+		"""Get the text of an entry."""
+		cnum = self.column_index.get(col,None)
+		if cnum==None or cnum>=self.ncols[index]: raise KeyError(col)
+		if self.kinds[col]=='int': return str(self.data[col][index])
+		return self.levels[col][self.data[col+':text'][index]]
+
+	def code(self,col,text):
+		"""Get the code for a string in a column, adding it to the levels if necessary."""
+		if self.level_codes[col]==None:
+			self.level_codes[col] = dict([(v,i) for i,v in enumerate(self.levels[col])])
+		if text not in self.level_codes[col]:
+			self.level_codes[col][text] = len(self.levels[col])
+			self.levels[col].append(text)
+		return self.level_codes[col][text]
+
+	def restructure(self,col,kind):
+		"""Change the storage of a column (e.g. when an integer column receives text)."""
+		values = [self.cell(i,col) if self.ncols[i]>self.column_index[col] else '' for i in range(len(self))]
+		mask = self.ncols>self.column_index[col]
+		old = self.data
+		self.kinds[col] = kind
+		self.data = np.zeros(len(old),dtype=self.dtype())
+		for name in old.dtype.names:
+			if name in self.data.dtype.names: self.data[name] = old[name]
+		self.fill(col,mask,[v for v,m in zip(values,mask) if m])
+
+	def set(self,col,rows,value):
+		"""
+		Set a column in one or more rows to a value. Rows which lacked the column gain it, as long as they have
+		every column before it.
+		"""
+		if col not in self.column_index: raise KeyError('%s is not a column in %s'%(col,self.columns))
+		cnum = self.column_index[col]
+		rows = np.atleast_1d(np.arange(len(self))[rows])
+		if np.any(self.ncols[rows]<cnum):
+			raise Exception('cannot set %s in a row that lacks the columns before it'%col)
+		text = str(value)
+		kind,incoming = self.kinds[col],section_column_kind([text])
+		#---columns only move toward more general storage (int to float to str)
+		if kind!='str' and incoming=='str': self.restructure(col,'str')
+		elif kind=='int' and incoming=='float': self.restructure(col,'float')
+		kind = self.kinds[col]
+		if kind=='int': self.data[col][rows] = int(text)
+		else:
+			if kind=='float': self.data[col][rows] = float(text)
+			self.data[col+':text'][rows] = self.code(col,text)
+		self.ncols[rows] = np.maximum(self.ncols[rows],cnum+1)
+
+	def append(self,record):
+		"""Add a row from a dict."""
+		self.extend([record])
+
+	def extend(self,records):
+		"""Add rows from a list of dicts or row views."""
+		rows = []
+		for record in records:
+			extra = [k for k in record.keys() if k not in self.column_index]
+			if extra: raise Exception('keys %s are not columns in %s'%(extra,self.columns))
+			row = []
+			for col in self.columns:
+				if col not in record: break
+				row.append(str(record[col]))
+			if len(row)!=len(record): raise Exception('record %s lacks a column before its last'%dict(record))
+			rows.append(row)
+		combined = GMXSection(self.columns,[[r[c] for c in r] for r in self]+rows)
+		self.__dict__.update(combined.__dict__)
+
+	def __add__(self,other):
+		combined = self.copy()
+		combined.extend(other)
+		return combined
+
+	def copy(self):
+		"""Copy the section."""
+		other = GMXSection.__new__(GMXSection)
+		other.columns,other.column_index = list(self.columns),dict(self.column_index)
+		other.ncols,other.data = self.ncols.copy(),self.data.copy()
+		other.kinds = dict(self.kinds)
+		other.levels = dict([(k,list(v)) for k,v in self.levels.items()])
+		other.level_codes = dict([(k,None) for k in self.level_codes])
+		return other
+
+	def where(self,col,value):
+		"""Get the indices of rows where a column has a value."""
+		if self.kinds[col]=='str':
+			if value not in self.levels[col]: return np.array([],dtype=int)
+			return np.where(self.data[col+':text']==self.levels[col].index(value))[0]
+		return np.where((self.column(col)==float(value))&(self.ncols>self.column_index[col]))[0]
@@ -1,30 +1,87 @@
 #!/usr/bin/env python
 
-import sys,re,os,glob,json,shutil
+import sys,re,os,glob,json,shutil,collections
 import numpy as np
 #---amx is already in the path when importing amx/gromacs
 from utils import str_types
+from preprocessor import GMXPreprocessor,itp_headers
+from topology_sections import GMXSection
+from topology_cache import GMXTopologyCache,topology_cache_key,topology_memory_get,topology_memory_put,\
+	topology_dumps,topology_loads
+
+_not_reported = ['GMXPreprocessor','itp_headers','GMXSection','GMXTopologyCache','topology_cache_key','topology_memory_get',
+	'topology_memory_put','topology_dumps','topology_loads']
+
+#---stores of parsed topologies on disk by location
+topology_cache_stores = {}
+
+def topology_cache_open():
+	"""
+	Open the store of parsed topologies on disk. The store is available when we import amx and it can be
+	disabled with the topology_cache setting.
+	"""
+	if 'state' not in globals() or 'cache_dir' not in globals(): return None
+	if not state.get('topology_cache',settings.get('topology_cache',True)): return None
+	root = state.get('topology_cache_dir',settings.get('topology_cache_dir',None))
+	if not root: root = cache_dir('topology_cache')
+	if root not in topology_cache_stores: topology_cache_stores[root] = GMXTopologyCache(root,
+		size_limit=state.get('topology_cache_size',settings.get('topology_cache_size',256)))
+	return topology_cache_stores[root]
 
 class GMXForceField:
 	"""
 	A collection of GMXTopology files
+	We index the molecules in each ITP by scanning for moleculetype headers and only parse an ITP when we ask
+	for one of its molecules. Keyword arguments are passed to GMXTopology.
 	"""
-	def __init__(self,dirname):
+	def __init__(self,dirname,**kwargs):
 		if not os.path.isdir(dirname): raise Exception('cannot find force field directory %s'%dirname)
 		self.dirname = dirname
+		self.kwargs = dict(kwargs,include_dirs=[self.dirname])
+		#---parsed topologies by ITP file name
 		self.itps = {}
-		for fn in glob.glob(os.path.join(self.dirname,'*.itp')):
-			self.itps[os.path.basename(fn)] = GMXTopology(fn)
+		self.index = self.scan()
+	def scan(self):
+		"""
+		Map each ITP file name to the molecules it defines directly or through its includes.
+		"""
+		fns = sorted(glob.glob(os.path.join(self.dirname,'*.itp')))
+		store = topology_cache_open()
+		def headers(fns): 
+			if store: return store.headers(fns,itp_headers)
+			else: return dict([(os.path.abspath(fn),itp_headers(fn)) for fn in fns])
+		found = headers(fns)
+		resolver = GMXPreprocessor(include_dirs=[self.dirname])
+		def molecules(fn,seen):
+			names = list(found[fn]['molecules'])
+			for name in found[fn]['includes']:
+				included = resolver.resolve(name,fn)
+				if not included or included in seen: continue
+				if included not in found: found.update(headers([included]))
+				names.extend(molecules(included,seen|set([included])))
+			return names
+		return collections.OrderedDict([(os.path.basename(fn),
+			molecules(os.path.abspath(fn),set([os.path.abspath(fn)]))) for fn in fns])
+	def topology(self,fn):
+		"""Parse an ITP file in the force field."""
+		if fn not in self.itps: 
+			self.itps[fn] = GMXTopology(os.path.join(self.dirname,fn),**self.kwargs)
+		return self.itps[fn]
 	def molecules_list(self):
 		#---we don not protect against repeated molecules, but gromacs does
-		return [i for j in [v.molecules for v in self.itps.values()] for i in j]
+		return [i for j in self.index.values() for i in j]
 	def molecule(self,name):
-		which_itp = [fn for fn,itp in self.itps.items() if name in itp.molecules]
+		which_itp = [fn for fn,names in self.index.items() if name in names]
+		#---headers inside conditional blocks are indexed so we check the parsed topology
+		def found(top): 
+			if name in top.molecules: return top.molecules[name]
+			elif 'moleculetype' in top.included.get(name,{}): return top.included[name]
+		which_itp = [fn for fn in which_itp if found(self.topology(fn))]
 		if len(which_itp)==0: raise Exception('cannot find molecule %s in force field %s'%(name,self.dirname))
 		elif len(which_itp)>1:
 			print('[WARNING] molecule %s is repeated in %s: %s. '
 				'using the first.'%(name,self.dirname,which_itp))
-		return self.itps[which_itp[0]].molecules[name]
+		return found(self.itps[which_itp[0]])
 
 class GMXTopology:
 	"""
@@ -69,6 +126,10 @@ class GMXTopology:
 	_entry_defns = dict([(name,{'lines':details.get('lines','many'),'regex':
 		["(?P<"+kw+">.*?)\s" for dd,kw in enumerate(details['records'].split())],
 		}) for name,details in _entry_abstracted.items()])
+	#---column names for each entry type for the line parser
+	_entry_columns = dict([(name,details['records'].split()) for name,details in _entry_abstracted.items()])
+	#---methods which parse molecules from the ITP
+	_parsers = {'lines':'parse_lines','regex':'parse_regex'}
 		#---drop any lines that only have comments
 	_lam_strip_commented_lines = lambda self,x:[i.strip() for i in x.split('\n') 
 		if not re.match(self._regex_commented_line,i)]
@@ -84,28 +145,64 @@ class GMXTopology:
 		"""
 
 		self.molecules = {}
+		#---records from included files by molecule (see parse_lines)
+		self.included = {}
 		self.itp_source = itp
+		self.itp_lines = None
 		self.defs = kwargs.pop('defs',{})
 		self.constraints_to_bonds = kwargs.pop('constraints_to_bonds',False)
+		#---the line parser is the default and the regex parser is retained for comparison
+		self.parser = kwargs.pop('parser','lines')
+		#---preprocessor settings (see GMXPreprocessor)
+		self.policy = kwargs.pop('policy','compat')
+		self.include_dirs = kwargs.pop('include_dirs',[])
+		#---parsed topologies are cached in memory and on disk (see topology_cache.py)
+		self.cache = kwargs.pop('cache',True)
 		if kwargs: raise Exception('unprocessed kwargs: %s'%kwargs)
+		if self.parser not in self._parsers: 
+			raise Exception('unknown parser %s. options: %s'%(self.parser,list(self._parsers)))
 
 		if self.itp_source:
-			with open(self.itp_source) as fp: self.itp_raw = fp.read()
-			#---extract definition lines
-			defines = re.findall(r"^\s*(\#define.+)$",self.itp_raw,re.M)
-			#---! dropping the ifdefs above and the deprecated entry_pre_proc flag
-			self.preproc()
-			self.defines = list(set(defines))
-			#---extract includes lines
-			self.includes = re.findall(r"^\s*\#include\s*\"(.+)\"\s*$",self.itp_raw,re.M)
-			#---! need to add a check in case the defines are sequential and they override each other
-			#---extract raw molecule types and process them
-			for match in re.findall(self._regex_molecule,self.itp_raw,re.M+re.DOTALL):
-				#---note that comment-only lines are stripped elsewhere, but here we remove comment tails
-				match_no_comment_tails = re.sub('[^\n;];.*?(\n|\Z)','\n',match,flags=re.M)
-				match_proc = self.entry_pre_proc(match_no_comment_tails)	
-				moldef = self.process_moleculetype(match_proc)
-				self.molecules[moldef['moleculetype']['molname']] = moldef
+			key = topology_cache_key(self.itp_source,parser=self.parser,policy=self.policy,
+				include_dirs=[os.path.abspath(i) for i in self.include_dirs],
+				defs=sorted([(k,repr(v)) for k,v in self.defs.items()]))
+			#---reuse a parsed topology from memory or disk if none of the files that we read have changed
+			payload,store = None,self.cache_open() if self.cache else None
+			if self.cache:
+				data,from_disk = topology_memory_get(key),False
+				if data==None and store:
+					data = store.load(key)
+					from_disk = data!=None
+				if data!=None:
+					payload = topology_loads(data)
+					if from_disk:
+						payload['files'] = dict([(fn,os.path.getmtime(fn)) for fn in payload['files']])
+						topology_memory_put(key,dict(payload['files'],**dict.fromkeys(payload['absent'])),data)
+			if payload:
+				self.__dict__.update(**payload)
+				#---the raw text is only available when we parse the file
+				self.itp_raw,self.itp_lines = None,None
+			else:
+				with open(self.itp_source) as fp: self.itp_raw = fp.read()
+				#---extract definition lines
+				defines = re.findall(r"^\s*(\#define.+)$",self.itp_raw,re.M)
+				#---extract includes lines
+				self.includes = re.findall(r"^\s*\#include\s*\"(.+)\"\s*$",self.itp_raw,re.M)
+				self.files = {os.path.abspath(self.itp_source):os.path.getmtime(self.itp_source)}
+				self.missing,self.absent = [],[]
+				#---the regex parser uses the original preprocessor for comparison
+				if self.parser=='regex': self.preproc_regex()
+				else: self.preproc()
+				self.defines = list(set(defines))
+				#---! need to add a check in case the defines are sequential and they override each other
+				#---extract raw molecule types and process them
+				getattr(self,self._parsers[self.parser])()
+				if self.cache:
+					data = topology_dumps(dict([(attr,self.__dict__[attr]) 
+						for attr in ['defines','includes','files','missing','absent','molecules','included']]))
+					#---includes we could not find are recorded without a modification time
+					topology_memory_put(key,dict(self.files,**dict.fromkeys(self.absent)),data)
+					if store: store.store(key,list(self.files.keys()),data,absent=self.absent)
 			if self.constraints_to_bonds:
 				for molname in self.molecules:
 					if 'constraints' in self.molecules[molname]:
@@ -114,8 +211,84 @@ class GMXTopology:
 		#---if no source we create a blank topology
 		else: self.defines = []
 
+	def cache_open(self): return topology_cache_open()
+
+	def parse_regex(self):
+		"""
+		Parse molecules from the ITP with regular expressions over the whole file.
+		This is the original parser which we retain to check the line parser (see `make topology_benchmark`).
+		"""
+		for match in re.findall(self._regex_molecule,self.itp_raw,re.M+re.DOTALL):
+			#---note that comment-only lines are stripped elsewhere, but here we remove comment tails
+			match_no_comment_tails = re.sub('[^\n;];.*?(\n|\Z)','\n',match,flags=re.M)
+			match_proc = self.entry_pre_proc(match_no_comment_tails)	
+			moldef = self.process_moleculetype(match_proc)
+			self.molecules[moldef['moleculetype']['molname']] = moldef
+
+	def parse_lines(self):
+		"""
+		Parse molecules from the ITP in a single pass over its lines.
+		We track the current section and split each record into the columns named in _entry_abstracted. 
+		Extra columns are kept with the last name, as in the regex parser. Sections are stored in columns 
+		(see GMXSection) and a single-line section (moleculetype) is stored as a dict.
+		Only the records written in the ITP itself are stored in molecules, with their original text (macros are 
+		not expanded), so that write reproduces the file. Records from included files (e.g. position restraints 
+		from posre.itp) are stored in included after macro substitution.
+		"""
+		top = os.path.abspath(self.itp_source)
+		lines = self.itp_lines if self.itp_lines!=None else [(top,i,i) for i in self.itp_raw.split('\n')]
+		def section(name,records):
+			nlines = self._entry_defns[name]['lines']
+			if nlines!='many':
+				if len(records)!=nlines: raise Exception('too many lines in %s'%name)
+				if nlines==1: return dict(zip(self._entry_columns[name],records[0]))
+				return records
+			return GMXSection(self._entry_columns[name],records)
+		def close(molecule):
+			"""Split the sections of a molecule into records from the ITP and from its includes."""
+			if molecule==None: return
+			own,other = {},{}
+			for name,(header_own,records) in molecule.items():
+				if header_own or records[True]: own[name] = section(name,records[True])
+				if not header_own or records[False]: other[name] = section(name,records[False])
+			if 'moleculetype' in own: self.molecules[own['moleculetype']['molname']] = own
+			molname = (own.get('moleculetype') or other.get('moleculetype') or {}).get('molname',None)
+			if other and molname!=None: self.included[molname] = other
+		molecule,name = None,None
+		for source,raw,expanded in lines:
+			is_own = source==top
+			line = (raw if is_own else expanded).split(';',1)[0].strip()
+			if not line or line[0]=='#': continue
+			if line[0]=='[' and line[-1]==']':
+				name = line[1:-1].strip()
+				if name=='moleculetype':
+					close(molecule)
+					molecule = {}
+				#---sections before the first molecule (e.g. atomtypes) are ignored
+				elif molecule==None: 
+					name = None
+					continue
+				if name not in self._entry_columns:
+					raise Exception('developing GMXTopology. missing entry for "%s"'%name)
+				#---repeated sections replace earlier ones as in the regex parser
+				molecule[name] = (is_own,{True:[],False:[]})
+			elif molecule!=None and name!=None:
+				molecule[name][1][is_own].append(line.split(None,len(self._entry_columns[name])-1))
+		close(molecule)
+
 	def preproc(self):
 		"""
+		Run the preprocessor over the ITP and its includes. We keep the source of each line (see parse_lines).
+		"""
+		preprocessor = GMXPreprocessor(defs=self.defs,include_dirs=self.include_dirs,policy=self.policy)
+		self.itp_lines = preprocessor.process_sources(self.itp_source)
+		top = os.path.abspath(self.itp_source)
+		self.itp_raw = '\n'.join([raw for source,raw,line in self.itp_lines if source==top])
+		self.files,self.missing,self.absent = preprocessor.files,preprocessor.missing,preprocessor.absent
+
+	def preproc_regex(self):
+		"""
+		Keep or drop flat ifdef/ifndef blocks. This is the original preprocessor used by the regex parser.
 		"""
 		#---first we detect any ifdef/ifndef statements
 		ifdefs = re.findall(self._regex_ifdef_block%'',self.itp_raw,flags=re.DOTALL+re.M)
@@ -218,7 +391,65 @@ class GMXTopology:
 
 	def write(self,fn,overwrite=False):
 		"""
-		Write an ITP file.
+		Write an ITP file. Sections are formatted by write_entry and written to the file one at a time.
+		"""
+		if os.path.isfile(fn) and not overwrite: raise Exception('refusing to overwrite %s'%fn)
+		with open(fn,'w') as fp:
+			#---the defines and molecules are separated by newlines without one at the end of the file
+			first = True
+			for lines in self.write_sections():
+				if not first: fp.write('\n')
+				fp.write('\n'.join(lines))
+				first = False
+
+	def write_sections(self):
+		"""
+		Generate lists of lines for the defines and for each section of each molecule.
+		"""
+		if self.defines: yield list(self.defines)
+		for mol,molspec in self.molecules.items():
+			entries = [i for i in self._entry_order if i in molspec]
+			#---a molecule without any entries is written as a blank line
+			if not entries: yield ['']
+			for entry in entries:
+				yield (['[%s]\n;%s'%(entry,self._entry_abstracted[entry]['records'])]+
+					self.write_entry(mol,entry,molspec[entry]))
+
+	def write_entry(self,mol,entry,over):
+		"""
+		Format the records in a section. Each distinct set of keys is checked against a starting subsequence of the 
+		header once and then we reuse a template which writes the values in the order of the header.
+		"""
+		header_keys = self._entry_abstracted[entry]['records'].split()
+		templates = {}
+		def template(keys):
+			if keys not in templates:
+				if not set(header_keys[:len(keys)])==set(keys):
+					raise Exception(
+						'processing molecule %s entry %s. '%(mol,entry)+
+						'the set of keys in this entry %s does not match a starting subsequence '%entry+
+						'from the header. the available keys are %s and the header is %s'%(list(keys),header_keys))
+				order = [keys.index(k) for k in header_keys[:len(keys)]]
+				templates[keys] = ('%s '*len(keys),None if order==list(range(len(keys))) else order)
+			return templates[keys]
+		lines = []
+		if isinstance(over,GMXSection):
+			for row,n in zip(zip(*[over.text(col) for col in over.columns]),over.ncols.tolist()):
+				fmt,order = template(tuple(over.columns[:n]))
+				lines.append(fmt%(row[:n] if order==None else tuple([row[i] for i in order])))
+		else:
+			for o in ([over] if type(over)==dict else over):
+				if not hasattr(o,'keys'): 
+					raise Exception('entry %s in molecule %s is not a dict: %s'%(entry,mol,o))
+				keys = tuple(o.keys())
+				fmt,order = template(keys)
+				lines.append(fmt%tuple([str(o[k]) for k in header_keys[:len(keys)]]))
+		return lines
+
+	def write_legacy(self,fn,overwrite=False):
+		"""
+		Write an ITP file by joining every line into one string.
+		This is the original writer which we retain to check the streaming writer (see `make topology_benchmark`).
 		"""
 		if os.path.isfile(fn) and not overwrite: raise Exception('refusing to overwrite %s'%fn)
 		mol_entries = []
@@ -228,14 +459,14 @@ class GMXTopology:
 			text = []
 			for entry in [i for i in self._entry_order if i in molspec]:
 				text.append('[%s]\n;%s'%(entry,self._entry_abstracted[entry]['records']))
-				over = [molspec[entry]] if type(molspec[entry])!=list else molspec[entry]
+				over = [molspec[entry]] if type(molspec[entry])==dict else molspec[entry]
 				for o in over:
 					line = ''
 					#---changed _entry_abstracted to handle a flexible stopping point in that list
 					#---...here we check that the items on the list are present
 					header_keys = self._entry_abstracted[entry]['records'].split()
-					if type(o)!=dict: 
-						raise Exception
+					if not hasattr(o,'keys'): 
+						raise Exception('entry %s in molecule %s is not a dict: %s'%(entry,mol,o))
 					if not set(header_keys[:len(o.keys())])==set(o.keys()):
 						raise Exception(
 							'processing molecule %s entry %s. '%(mol,entry)+
@@ -272,17 +503,23 @@ class GMXTopology:
 		if not mol or mol not in self.molecules: raise Exception('cannot find molecule %s'%mol)
 		#---generate blank restraints if they do not exist otherwise we overwrite what is already there
 		#---! note that this might be dangerous
-		if 'position_restraints' not in self.molecules[mol]:
-			posres_custom = {'funct':'1','fcy':'0','ai':'1','fcx':'0','fcz':'0'}
-			posres_all = [dict(posres_custom,ai=str(ii+1)) 
-				for ii,i in enumerate(self.molecules[mol]['atoms'])]
-			self.molecules[mol]['position_restraints'] = posres_all	
-		atoms = [i['atom'] for i in self.molecules[mol]['atoms']]
-		#---loop over target atom names
+		molecule = self.molecules[mol]
+		if 'position_restraints' not in molecule:
+			molecule['position_restraints'] = GMXSection(self._entry_columns['position_restraints'],
+				[[str(ii+1),'1','0','0','0'] for ii in range(len(molecule['atoms']))])
+		atoms = molecule['atoms']
+		atoms = atoms['atom'] if isinstance(atoms,GMXSection) else np.array([i['atom'] for i in atoms])
+		indices = []
 		for atom_name in names:
-			#---loop over directions to apply the forces
-			for k,v in forces.items(): 
-				self.molecules[mol]['position_restraints'][atoms.index(atom_name)][k] = v
+			found = np.where(atoms==atom_name)[0]
+			if not len(found): raise Exception('cannot find atom %s in molecule %s'%(atom_name,mol))
+			indices.append(found[0])
+		#---loop over directions to apply the forces
+		posres = molecule['position_restraints']
+		for k,v in forces.items(): 
+			if isinstance(posres,GMXSection): posres.set(k,np.array(indices,dtype=int),v)
+			else: 
+				for index in indices: posres[index][k] = v
 
 	#---DEVELOPING MORE CAREFUL BOND PARSINGS
 		
@@ -292,20 +529,19 @@ class GMXTopology:
 		"""
 
 		mol = GMXTopologyMolecule(self.molecules[molname])
-		bonds = mol.get_bonds()
-		names = mol.get_atom_spec_by_bond(*bonds)
-		if type(patterns) in str_types: patterns = []
+		bonds = mol.get_pairs('bonds')
+		if type(patterns) in str_types: patterns = [patterns]
 		if not len(patterns) in [1,2]: raise Exception('patterns must be length 1 or 2: %s'%patterns) 
-		matching_bonds = np.array([ii for ii,i in enumerate(names) 
-			if sum([np.any([(1 if re.match(regex,n) else 0) 
-				for regex in patterns]) for n in i])==len(patterns)])
+		#---match each unique atom name once and count the endpoints of each bond that match any pattern
+		hits = np.any([mol.match(regex) for regex in patterns],axis=0)
+		matching_bonds = np.where(hits[bonds].sum(axis=1)==len(patterns))[0]
 		#---! this function returns only a list of name pairs for hydrogen bond donors
 		if len(matching_bonds)==0: return []
 		bond_pairs_by_name = [tuple(j) 
-			for j in mol.get_atom_spec_by_bond(*np.array(bonds)[matching_bonds],key='atom')]
+			for j in mol.get_atom_spec_by_bond(*bonds[matching_bonds],key='atom')]
 		if include_resname:
 			bond_pairs_by_resname = [tuple(j) 
-				for j in mol.get_atom_spec_by_bond(*np.array(bonds)[matching_bonds],key='resname')]
+				for j in mol.get_atom_spec_by_bond(*bonds[matching_bonds],key='resname')]
 			return zip(bond_pairs_by_resname,bond_pairs_by_name)
 		return bond_pairs_by_name
 
@@ -313,29 +549,164 @@ class GMXTopologyMolecule:
 
 	"""
 	PROTOYPING a molecule class. Wraps ITP molecules in some helpful functions.
+	The bond graph is built once from the bonds and constraints and stored in compressed sparse rows, so that
+	the neighbors of atom i (by index in the atoms section) are indices[indptr[i]:indptr[i+1]].
 	"""
 
-	def __init__(self,molecule): self.mol = molecule
+	def __init__(self,molecule): 
+		self.mol = molecule
+		self._ids,self._graph = None,None
+
+	def atom_ids(self):
+		"""
+		Map atom ids to their indices in the atoms section. Repeated ids map to None.
+		"""
+		if self._ids==None:
+			self._ids = {}
+			for ii,i in enumerate(self.mol['atoms']['id'] if isinstance(self.mol['atoms'],GMXSection) 
+				else [i['id'] for i in self.mol['atoms']]):
+				key = str(i)
+				self._ids[key] = None if key in self._ids else ii
+		return self._ids
 
 	def get_atom(self,atom):
 		"""
-		HACK. Get an atom from a molecule by index number.
+		Get an atom from a molecule by index number.
 		"""
-		matches = [ii for ii,i in enumerate(self.mol['atoms']) if i['id']==str(atom)]
-		if len(matches)>1: raise Exception('found too many atoms with id %s in this molecule'%atom)
-		elif len(matches)==0: raise Exception('no atom with id %s in this molecule'%atom)
-		else: return matches[0]
+		ids = self.atom_ids()
+		if str(atom) not in ids: raise Exception('no atom with id %s in this molecule'%atom)
+		elif ids[str(atom)]==None: raise Exception('found too many atoms with id %s in this molecule'%atom)
+		else: return ids[str(atom)]
+
+	def get_pairs(self,entry='bonds'):
+		"""
+		Return atom indices for the first two columns of a section (e.g. bonds or constraints) as an array.
+		"""
+		atoms,bonds = self.mol['atoms'],self.mol.get(entry,[])
+		if not len(bonds): return np.zeros((0,2),dtype=int)
+		if not (isinstance(atoms,GMXSection) and isinstance(bonds,GMXSection) and 
+			atoms.kinds['id']=='int' and bonds.kinds['i']=='int' and bonds.kinds['j']=='int'):
+			return np.array([[self.get_atom(atom=bond[l]) for l in 'ij'] for bond in bonds],dtype=int)
+		#---look up the atom for each bond by sorting the atom ids
+		ids = atoms['id']
+		order = np.argsort(ids,kind='mergesort')
+		ids_sorted = ids[order]
+		pairs = []
+		for l in 'ij':
+			targets = bonds[l]
+			pos = np.searchsorted(ids_sorted,targets)
+			valid = pos<len(ids_sorted)
+			valid[valid] = ids_sorted[pos[valid]]==targets[valid]
+			if not np.all(valid): raise Exception('no atom with id %s in this molecule'%targets[~valid][0])
+			repeated = (pos+1<len(ids_sorted))
+			repeated[repeated] = ids_sorted[(pos+1)[repeated]]==targets[repeated]
+			if np.any(repeated): 
+				raise Exception('found too many atoms with id %s in this molecule'%targets[repeated][0])
+			pairs.append(order[pos])
+		return np.transpose(pairs).astype(int)
 
 	def get_bonds(self):
 		"""
 		Return indices for the bond list.
 		"""
-		return [[self.get_atom(atom=bond[l]) for l in 'ij'] for bond in self.mol['bonds']]
+		return self.get_pairs('bonds').tolist()
+
+	def graph(self):
+		"""
+		Build the bond graph from the bonds and constraints. Returns the row pointers and the neighbor indices.
+		"""
+		if self._graph==None:
+			natoms = len(self.mol['atoms'])
+			pairs = np.concatenate([self.get_pairs(entry) for entry in ['bonds','constraints']])
+			pairs = pairs[pairs[:,0]!=pairs[:,1]]
+			#---store each edge in both directions once
+			edges = np.unique(np.concatenate((pairs[:,0]*natoms+pairs[:,1],pairs[:,1]*natoms+pairs[:,0])))
+			src,dst = edges//natoms,edges%natoms
+			indptr = np.concatenate(([0],np.cumsum(np.bincount(src,minlength=natoms)))).astype(int)
+			self._graph = (indptr,dst.astype(int))
+		return self._graph
+
+	def neighbors(self,index):
+		"""Indices of the atoms bonded to an atom (by index)."""
+		indptr,indices = self.graph()
+		return indices[indptr[index]:indptr[index+1]]
+
+	def edges(self):
+		"""Both directions of every edge in the bond graph as arrays of sources and destinations."""
+		indptr,indices = self.graph()
+		return np.repeat(np.arange(len(indptr)-1),np.diff(indptr)),indices
+
+	def fragments(self):
+		"""
+		Label the connected fragments of the molecule. Returns a fragment number for each atom.
+		"""
+		src,dst = self.edges()
+		labels = np.arange(len(self.mol['atoms']))
+		#---hook the larger label onto the smaller one along each edge and then compress the label trees
+		while True:
+			lo,hi = np.minimum(labels[src],labels[dst]),np.maximum(labels[src],labels[dst])
+			changed = lo!=hi
+			if not np.any(changed): break
+			np.minimum.at(labels,hi[changed],lo[changed])
+			while True:
+				compressed = labels[labels]
+				if np.all(compressed==labels): break
+				labels = compressed
+		return np.unique(labels,return_inverse=True)[1]
+
+	def match(self,pattern,key='atom'):
+		"""
+		Check a column (atom names by default) against a regex. Each unique name is only matched once.
+		"""
+		atoms = self.mol['atoms']
+		names = atoms[key] if isinstance(atoms,GMXSection) else np.array([i[key] for i in atoms])
+		unique,inverse = np.unique(names,return_inverse=True)
+		hits = np.array([re.match(pattern,str(i))!=None for i in unique],dtype=bool)
+		return hits[inverse] if len(names) else np.zeros(0,dtype=bool)
+
+	def hydrogens(self,pattern='^H'):
+		"""
+		Count the hydrogens bonded to each heavy atom. Hydrogens are atoms whose names match the pattern.
+		"""
+		is_h = self.match(pattern)
+		src,dst = self.edges()
+		counts = np.bincount(src[is_h[dst]&~is_h[src]],minlength=len(is_h))
+		counts[is_h] = 0
+		return counts
+
+	def exclusions(self,nrexcl=None):
+		"""
+		Return pairs of atom indices (i<j) that are separated by at most nrexcl bonds. The default is the 
+		nrexcl value in the moleculetype.
+		"""
+		if nrexcl==None: nrexcl = int(self.mol['moleculetype']['nrexcl'])
+		indptr,indices = self.graph()
+		natoms = len(indptr)-1
+		src,dst = self.edges()
+		found = [src*natoms+dst]
+		paths = (src,dst)
+		for hop in range(1,nrexcl):
+			#---extend every path by one bond from its last atom
+			start,last = paths
+			degree = np.diff(indptr)[last]
+			offsets = np.arange(degree.sum())-np.repeat(np.cumsum(degree)-degree,degree)
+			start,last = np.repeat(start,degree),indices[np.repeat(indptr[last],degree)+offsets]
+			keep = start!=last
+			codes = np.unique(start[keep]*natoms+last[keep])
+			found.append(codes)
+			paths = (codes//natoms,codes%natoms)
+		codes = np.unique(np.concatenate(found)) if nrexcl>0 else np.zeros(0,dtype=int)
+		pairs = np.transpose((codes//natoms,codes%natoms))
+		return pairs[pairs[:,0]<pairs[:,1]]
 
 	def get_atom_spec_by_bond(self,*args,**kwargs):
 		"""Return atom names."""
 		key = kwargs.pop('key','atom')
 		if kwargs: raise Exception('unprocessed kwargs %s'%kwargs)
+		atoms = self.mol['atoms']
+		if isinstance(atoms,GMXSection): 
+			if not args: return np.array([])
+			return atoms[key][np.array(args,dtype=int)]
 		#---filter all bonds for those involving an atom with a name starting with the letter "H"
 		names = np.array([[self.mol['atoms'][i][key],self.mol['atoms'][j][key]] for i,j in args])
 		return names
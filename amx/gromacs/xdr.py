@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Minimal XDR decoding for GROMACS binary files.
+XDR stores big-endian 4-byte integers and floats, 8-byte doubles and 64-bit integers, and strings which are
+padded to four bytes. GROMACS writes its own strings with an extra length in front of the XDR string.
+"""
+
+import struct
+import numpy as np
+
+class XDRShort(Exception):
+	"""Raised when a buffer ends before the requested item, e.g. while GROMACS is still writing a file."""
+	pass
+
+#---XDR type codes used by GROMACS for energy file blocks (xdr_datatype in the GROMACS source)
+xdr_datatypes = {0:'int',1:'float',2:'double',3:'int64',4:'char',5:'string'}
+xdr_dtypes = {'int':np.dtype('>i4'),'float':np.dtype('>f4'),'double':np.dtype('>f8'),
+	'int64':np.dtype('>i8'),'char':np.dtype('>u4')}
+
+class XDRCursor:
+	"""
+	Read XDR items from a bytes buffer starting at an offset.
+	The precision of GROMACS reals is set with double so that real() and reals() read the right size.
+	"""
+	def __init__(self,buf,offset=0,double=False):
+		self.buf,self.offset,self.double_precision = buf,offset,double
+	def take(self,nbytes):
+		"""Advance the cursor and return the bytes."""
+		if self.offset+nbytes>len(self.buf): raise XDRShort('need %d bytes at %d'%(nbytes,self.offset))
+		chunk = self.buf[self.offset:self.offset+nbytes]
+		self.offset += nbytes
+		return chunk
+	def int(self): return struct.unpack('>i',self.take(4))[0]
+	def int64(self): return struct.unpack('>q',self.take(8))[0]
+	def float(self): return struct.unpack('>f',self.take(4))[0]
+	def double(self): return struct.unpack('>d',self.take(8))[0]
+	def real(self): return self.double() if self.double_precision else self.float()
+	def array(self,kind,n):
+		"""Read n items of an XDR type into a numpy array (native byte order)."""
+		dtype = xdr_dtypes[kind]
+		return np.frombuffer(self.take(dtype.itemsize*n),dtype=dtype).astype(dtype.newbyteorder('='))
+	def reals(self,n): return self.array('double' if self.double_precision else 'float',n)
+	def string(self):
+		"""Read a GROMACS string (an integer size followed by an XDR string)."""
+		self.int()
+		size = self.int()
+		text = self.take(size+(-size)%4)[:size]
+		return text.decode(errors='ignore').rstrip('\x00')
+	def strings(self,n): return [self.string() for i in range(n)]
+	def xdr_string(self):
+		"""Read a plain XDR string (as in checkpoint headers)."""
+		size = self.int()
+		return self.take(size+(-size)%4)[:size].decode(errors='ignore').rstrip('\x00')
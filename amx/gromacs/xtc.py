@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""
+Scan and concatenate compressed GROMACS trajectories (.xtc) without decompressing the coordinates.
+Each XTC frame has a short header (magic number, atoms, step, time, and box) followed by the compressed
+coordinates, whose size is stored in the header. We read the headers to index the frames and copy whole frames
+from one file to another, which lets us concatenate parts and remove duplicate frames at part boundaries.
+"""
+
+import os
+import numpy as np
+from xdr import XDRCursor,XDRShort
+
+xtc_magic = 1995
+#---frames with this many atoms or fewer store uncompressed coordinates
+xtc_min_compressed = 9
+#---the header is 56 bytes and compressed frames have 36 more bytes before the coordinates
+xtc_header_bytes = 92
+
+def xtc_frame_header(buf,offset=0):
+	"""
+	Read a frame header from a buffer. Returns the step, time, atoms, and the size of the frame in bytes.
+	"""
+	cursor = XDRCursor(buf,offset)
+	if cursor.int()!=xtc_magic: raise Exception('bad XTC frame magic at byte %d'%offset)
+	natoms,step,time = cursor.int(),cursor.int(),cursor.float()
+	cursor.take(36+4)
+	if natoms<=xtc_min_compressed: size = 56+natoms*3*4
+	else:
+		cursor.take(4+12+12+4)
+		nbytes = cursor.int()
+		size = xtc_header_bytes+nbytes+(-nbytes)%4
+	return {'step':step,'time':time,'natoms':natoms,'size':size}
+
+def xtc_scan(fn):
+	"""
+	Index the frames in a trajectory. Returns arrays of byte offsets, sizes, steps, and times. A frame that
+	is still being written is left out.
+	"""
+	offsets,sizes,steps,times = [],[],[],[]
+	total = os.path.getsize(fn)
+	with open(fn,'rb') as fp:
+		offset = 0
+		while offset<total:
+			fp.seek(offset)
+			try: frame = xtc_frame_header(fp.read(xtc_header_bytes))
+			except XDRShort: break
+			if offset+frame['size']>total: break
+			offsets.append(offset)
+			sizes.append(frame['size'])
+			steps.append(frame['step'])
+			times.append(frame['time'])
+			offset += frame['size']
+	return {'offset':np.array(offsets,dtype=np.int64),'size':np.array(sizes,dtype=np.int64),
+		'step':np.array(steps,dtype=np.int64),'time':np.array(times)}
+
+def xtc_concatenate(fns,out,stride=1,chunk=2**24):
+	"""
+	Concatenate trajectories in order by copying frames. Frames with a step at or before the last frame that we
+	kept (e.g. the first frame of a continuation) are dropped, and then we keep every stride-th frame.
+	The output is written to a temporary file and moved into place so an interrupted call leaves no output.
+	Returns a frame index with the offset, step, time, and source (index in fns) of each frame in the output.
+	"""
+	index = {'offset':[],'step':[],'time':[],'part':[]}
+	last_step,count,position = None,0,0
+	with open(out+'.tmp','wb') as fp_out:
+		for pnum,fn in enumerate(fns):
+			frames = xtc_scan(fn)
+			keep = np.ones(len(frames['step']),dtype=bool)
+			if last_step!=None: keep &= frames['step']>last_step
+			#---steps must increase within a part
+			if len(frames['step'])>1 and np.any(np.diff(frames['step'])<=0):
+				raise Exception('steps are out of order in %s'%fn)
+			kept = np.where(keep)[0]
+			kept = kept[(count+np.arange(len(kept)))%stride==0] if stride>1 else kept
+			count += int(keep.sum())
+			if len(frames['step']): last_step = max(last_step,int(frames['step'].max())) \
+				if last_step!=None else int(frames['step'].max())
+			with open(fn,'rb') as fp:
+				#---copy runs of contiguous frames in chunks
+				runs = np.split(kept,np.where(np.diff(kept)!=1)[0]+1) if len(kept) else []
+				for run in runs:
+					start = int(frames['offset'][run[0]])
+					remaining = int(frames['offset'][run[-1]]+frames['size'][run[-1]])-start
+					fp.seek(start)
+					while remaining>0:
+						data = fp.read(min(chunk,remaining))
+						if not data: raise Exception('%s ended while copying frames'%fn)
+						fp_out.write(data)
+						remaining -= len(data)
+			for i in kept:
+				index['offset'].append(position)
+				index['step'].append(int(frames['step'][i]))
+				index['time'].append(float(frames['time'][i]))
+				index['part'].append(pnum)
+				position += int(frames['size'][i])
+	os.rename(out+'.tmp',out)
+	return index
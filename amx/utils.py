@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 
-import sys,subprocess
+import os,sys,subprocess
 
-_not_reported = ['status']
+_not_reported = ['status','cache_dir']
 
 #---you can use six.string_types or a try to locate basestring (but this fails on python 3 before 3.5)
 #---...however the simplest solution is to check if the type is in a list that depends on the system version
 str_types = [str,unicode] if sys.version_info<(3,0) else [str]
 
+def cache_dir(*parts):
+	"""
+	Return a folder in the automacs user directory (~/.automacs or $AMX_CACHE) for persistent caches.
+	"""
+	base = os.path.expanduser(os.environ.get('AMX_CACHE','~/.automacs'))
+	dn = os.path.join(base,*parts)
+	if not os.path.isdir(dn): os.makedirs(dn)
+	return dn
+
 def status(string,i=0,looplen=None,bar_character=None,width=25,tag='',start=None):
 	"""
 	Show a status bar and counter for a fixed-length operation.
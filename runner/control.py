@@ -302,7 +302,10 @@ def prep_metarun(inputlib):
 	if 'prelude' in inputlib:
 		os.system(inputlib['prelude'])
 	steplist = inputlib.pop('metarun')
+	afters = metarun_after(steplist)
 	for stepno,item in enumerate(steplist):
+		#---dependencies are recorded in the experiments after they are written
+		item = dict([(key,val) for key,val in item.items() if key!='after'])
 		scriptname,exptname = 'script_%d'%(stepno+1),'expt_%d'%(stepno+1)
 		#---pass along extras if available
 		extras = dict([(key,item[key]) for key in ['jupyter_coda'] if key in item])
@@ -328,6 +331,43 @@ def prep_metarun(inputlib):
 		#---write the quick script with no additional settings
 		#---! elif _keysets('quick',*item.keys())=='simple': quick(item['quick'],stepno=stepno+1)
 		else: raise Exception('no formula for metarun item: %r'%item)
+	if afters:
+		for stepno,after in enumerate(afters):
+			fn = 'expt_%d.json'%(stepno+1)
+			with open(fn) as fp: ins = json.load(fp)
+			ins['metarun_after'] = after
+			write_expt(ins,fn=fn)
+
+def metarun_after(steplist):
+	"""
+	Read the optional after keys in a metarun as a dependency graph.
+	Each step can depend on a list of earlier steps given by number (counting from one) or by the step or do 
+	name of an earlier step. Steps without an after key depend on the previous step, hence a metarun without 
+	any after keys runs in order. Returns None when there are no after keys.
+	"""
+	if not any(['after' in item for item in steplist]): return None
+	afters = []
+	for stepno,item in enumerate(steplist):
+		after = item.get('after',[stepno] if stepno>0 else [])
+		if type(after) not in [list,tuple]: after = [after]
+		names = {}
+		for num,prev in enumerate(steplist[:stepno]):
+			for key in ['step','do']:
+				if key in prev and num+1 not in names.get(prev[key],[]): 
+					names[prev[key]] = names.get(prev[key],[])+[num+1]
+		parents = []
+		for name in after:
+			if type(name)==int or (type(name) in str_types and name.isdigit()): num = int(name)
+			elif len(names.get(name,[]))==1: num = names[name][0]
+			elif name in names: 
+				raise Exception('metarun step %d is after "%s" which names steps %s. use a number instead'%(
+					stepno+1,name,names[name]))
+			else: raise Exception('metarun step %d is after an unknown step "%s"'%(stepno+1,name))
+			if not 0<num<stepno+1: 
+				raise Exception('metarun step %d can only be after earlier steps but got %s'%(stepno+1,name))
+			parents.append(num)
+		afters.append(sorted(set(parents)))
+	return afters
 
 def prep(procname=None,noscript=False,v=True):
 	"""
@@ -394,9 +434,11 @@ def run(procname=None,over='expt.json',script='script.py',PYTHON_DEBUG=None,look
 	print('[STATUS] acme run lasted %.1f minutes'%((time.time()-start_time)/60.0))
 	return True
 
-def metarun():
+def metarun(cores=None,threads=None,poll=5):
 	"""
 	Run a series of simulation steps.
+	If the steps have after keys then we run them as a graph (see metarun_graph) with a budget of cores
+	(all by default) and threads for each step.
 	"""
 	if os.path.isfile('script.py') or os.path.isfile('expt.json'):
 		raise Exception('refusing to run if script.py or expt.json are present. '
@@ -409,6 +451,11 @@ def metarun():
 		list(range(1,len(expt_fns)+1))]
 	if not [ranges[0]==j for j in ranges[1:]]: raise Exception('problem with script/expt names')
 	elif len(expt_fns)!=len(script_fns): raise Exception('different number of script and expt files')
+	graph = {}
+	for num in ranges[0]:
+		with open('expt_%d.json'%num) as fp: graph[num] = json.load(fp).get('metarun_after',None)
+	if any([i!=None for i in graph.values()]): 
+		return metarun_graph(graph,cores=cores,threads=threads,poll=poll)
 	for num in ranges[0]:
 		#---expt needs to be global and it is imported at the end of acme.py so we place it
 		shutil.copyfile('expt_%d.json'%num,'expt.json')
@@ -429,6 +476,143 @@ def metarun():
 		elif os.path.isfile('state.json') and not os.path.isfile('state_%d.json'%num): 
 			shutil.copyfile('state.json','state_%d.json'%num)
 
+#---files written by steps which are shared by all metarun workspaces
+#---...the automacs gmx journal is written one line at a time so concurrent steps can share it and each record
+#---...is tagged with its step so that lookups only see the calls from the lineage of a state
+#---...and the profiles written by call_reporter are appended in the same way
+metarun_shared_files = ['gmx-journal.jsonl','profile.jsonl']
+
+def schedule(jobs,cores,kill_script,poll=5,update=None):
+	"""
+	Run jobs as subprocesses under a budget of cores.
+	Each job is a dictionary with a name, a shell command, a folder (dn), a log file, its threads, and the names of
+	the jobs that it is after. Jobs start in order whenever the jobs they are after are done and their threads fit
+	in the budget, and jobs after a failed job are skipped. Optional prepare and collect functions run before a job
+	starts and after it succeeds. Each job sets AMX_NPROCS so that mdrun uses only its own threads. The kill script
+	stops the scheduler and the running jobs. The update function runs on every pass.
+	"""
+	by_name = dict([(job['name'],job) for job in jobs])
+	for job in jobs: job.setdefault('status','pending')
+	while any([i['status'] in ['pending','running'] for i in jobs]):
+		for job in [i for i in jobs if i['status']=='running']:
+			if job['proc'].poll()==None: continue
+			job.update(returncode=job['proc'].returncode,end=time.time(),elapsed=time.time()-job['start'])
+			if job['returncode']==0 and job.get('collect',None): job['collect'](job)
+			job['status'] = 'done' if job['returncode']==0 else 'failed'
+			print('[STATUS] %s %s after %.1f minutes'%(job.get('label',job['name']),job['status'],job['elapsed']/60.))
+		#---jobs after a failure are skipped
+		for job in [i for i in jobs if i['status']=='pending']:
+			if any([by_name[i]['status'] in ['failed','skipped'] for i in job.get('after',[])]): 
+				job['status'] = 'skipped'
+		busy = sum([i['threads'] for i in jobs if i['status']=='running'])
+		for job in [i for i in jobs if i['status']=='pending']:
+			if any([by_name[i]['status']!='done' for i in job.get('after',[])]): continue
+			if busy+job['threads']>cores: break
+			if job.get('prepare',None): job['prepare'](job)
+			#---drop variables from the calling make so the arguments do not reach the jobs
+			env = dict([(k,v) for k,v in os.environ.items() if k not in ['MAKEFLAGS','MFLAGS','MAKELEVEL']])
+			env.update(AMX_NPROCS=str(job['threads']),OMP_NUM_THREADS=str(job['threads']))
+			#---the job holds its own copy of the log so we close ours
+			with open(job['log'],'w') as log:
+				job['proc'] = subprocess.Popen(job['command'],shell=True,cwd=job['dn'],env=env,
+					stdout=log,stderr=subprocess.STDOUT,preexec_fn=os.setsid)
+			job.update(status='running',pgid=os.getpgid(job['proc'].pid),start=time.time())
+			busy += job['threads']
+			print(fab('[ACME] starting %s'%job.get('label',job['name']),'white_black')+
+				(' after %s'%', '.join(job['after']) if job.get('after',None) else ''))
+		with open(kill_script,'w') as fp:
+			fp.write('kill -TERM %d\n'%os.getpid())
+			for job in jobs:
+				if job['status']=='running': fp.write('pkill -TERM -g %d\n'%job['pgid'])
+		os.chmod(kill_script,0o744)
+		if update: update()
+		if any([i['status']=='running' for i in jobs]): time.sleep(float(poll))
+	os.remove(kill_script)
+	return jobs
+
+def metarun_lineage(states):
+	"""
+	Merge the steps from several states in order. A step after more than one branch of a metarun graph follows
+	the lineage of all of them.
+	"""
+	steps = []
+	for state in states: steps.extend([i for i in state.get('steps',[]) if i not in steps])
+	return steps
+
+def metarun_graph(graph,cores=None,threads=None,poll=5,where='metarun-nodes'):
+	"""
+	Run the steps of a metarun as a graph in which each step waits for the steps that it is after.
+	Each step runs in its own workspace in `where` which links to the shared code and the step folders of its 
+	ancestors, and holds copies of their states so that state.before follows the lineage of the step. 
+	Step folders are numbered by their position in the metarun so that branches cannot collide, and they are
+	moved back here when each step completes. Steps start in order whenever their dependencies are complete
+	and their threads fit in the budget (see schedule). By default we divide the cores between the steps in the
+	widest level of the graph. Run `./script-stop-metarun.sh` to stop the scheduler and the running steps.
+	"""
+	import multiprocessing
+	cores = int(cores) if cores else multiprocessing.cpu_count()
+	nums = sorted(graph.keys())
+	ancestors,levels = {},{}
+	for num in nums:
+		ancestors[num] = sorted(set(graph[num]+[j for i in graph[num] for j in ancestors[i]]))
+		levels[num] = max([levels[i]+1 for i in graph[num]]+[0])
+	width = max([list(levels.values()).count(i) for i in set(levels.values())])
+	threads = int(threads) if threads else max(1,cores//width)
+	if threads>cores: raise Exception('each step uses %d threads but the budget is %d cores'%(threads,cores))
+	if os.path.isdir(where): 
+		raise Exception('found workspaces from a previous metarun in %s. use `make clean` first'%where)
+	config = read_config()
+	products = [fn for pat in config.get('cleanup',[]) for fn in glob.glob(pat)]
+	shared = [fn for fn in glob.glob('*') if fn not in products+[where] and not fn.startswith('script-stop-')]
+	for fn in metarun_shared_files:
+		if not os.path.isfile(fn): open(fn,'a').close()
+	os.mkdir(where)
+	nodes = dict([(num,{'name':str(num),'label':'metarun step %d'%num,'after':[str(i) for i in graph[num]],
+		'threads':threads,'command':'make run','dn':os.path.join(where,'%02d'%num),'steps':[]}) for num in nums])
+	def launch(node):
+		"""Prepare a workspace for a step."""
+		num,dn = int(node['name']),node['dn']
+		os.mkdir(dn)
+		links = shared+metarun_shared_files+[step for i in ancestors[num] for step in nodes[i]['steps']]
+		for fn in links: os.symlink(os.path.relpath(os.path.abspath(fn),dn),os.path.join(dn,fn))
+		shutil.copyfile('script_%d.py'%num,os.path.join(dn,'script_%d.py'%num))
+		shutil.copyfile('expt_%d.json'%num,os.path.join(dn,'expt.json'))
+		for i in ancestors[num]:
+			if os.path.isfile('state_%d.json'%i): shutil.copyfile('state_%d.json'%i,os.path.join(dn,'state_%d.json'%i))
+		#---the step starts from the state of its latest ancestor and make_step increments the step number
+		#---...and the lineage includes the steps from every ancestor (make_step merges them in the same way)
+		stateful = [i for i in ancestors[num] if os.path.isfile('state_%d.json'%i)]
+		states = []
+		for i in stateful:
+			with open('state_%d.json'%i) as fp: states.append(json.load(fp))
+		state = dict(states[-1]) if states else {'steps':[]}
+		state['steps'] = metarun_lineage(states)
+		if num>1 or stateful:
+			state['stepno'] = num-1
+			with open(os.path.join(dn,'state.json'),'w') as fp: json.dump(state,fp)
+	def collect(node):
+		"""Move the step folders and the state from a completed workspace."""
+		num = int(node['name'])
+		for fn in sorted(os.listdir(node['dn'])):
+			path = os.path.join(node['dn'],fn)
+			if re.match(r'^s\d+-',fn) and os.path.isdir(path) and not os.path.islink(path):
+				if os.path.exists(fn): raise Exception('metarun step %d made %s which already exists'%(num,fn))
+				shutil.move(path,fn)
+				node['steps'].append(fn)
+		with open('expt_%d.json'%num) as fp: stateless = json.load(fp).get('stateless',False)
+		if not stateless and os.path.isfile(os.path.join(node['dn'],'state.json')):
+			shutil.copyfile(os.path.join(node['dn'],'state.json'),'state_%d.json'%num)
+	for node in nodes.values(): node.update(prepare=launch,collect=collect,log=os.path.join(node['dn'],'log-metarun'))
+	print('[STATUS] running %d metarun steps with %d threads each on %d cores'%(len(nums),threads,cores))
+	schedule([nodes[num] for num in nums],cores,'script-stop-metarun.sh',poll=poll)
+	#---the latest state is left in place as it is after a metarun in order
+	stateful = [num for num in nums if nodes[num]['status']=='done' and os.path.isfile('state_%d.json'%num)]
+	if stateful: shutil.copyfile('state_%d.json'%stateful[-1],'state.json')
+	failed = [num for num in nums if nodes[num]['status'] in ['failed','skipped']]
+	if failed: 
+		raise Exception('metarun steps %s failed or were skipped. see log-metarun in each workspace in %s'%(
+			', '.join(['%d (%s)'%(num,nodes[num]['status']) for num in failed]),where))
+
 def cleanup(sure=False):
 	"""
 	Clean files from the current directory.
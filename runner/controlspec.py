@@ -36,7 +36,7 @@ controlspec = {
 			('metarun','cwd','tags','prelude'):True,
 			('metarun','cwd','prelude'):True},
 		'metarun_steps':{
-			('do'):'simple',
+			('do',):'simple',
 			('step','do'):'simple',
 			('quick','settings'):'quick',
 			('quick','settings','jupyter_coda'):'quick',
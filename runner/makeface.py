@@ -20,7 +20,8 @@ to the interface. You can set ``__all__`` in these files to hide extraneous func
 
 default_config = {
 	'acme':'./runner',
-	'cleanup':['exec.py','s*-*','state*.json','expt*.json','script*.py','log-*','*.log','v*-*','*.ipynb'],
+	'cleanup':['exec.py','s*-*','state*.json','expt*.json','script*.py','log-*','*.log','v*-*','*.ipynb',
+		'gmx-journal.jsonl','profile.jsonl','metarun-nodes'],
 	'commands':['runner/control.py','runner/datapack.py','amx/cli.py'],
 	'commands_aliases':[('prep?','preplist'),('set','set_config')],
 	'inputs':'@regex^.*?_expts\\.py$',
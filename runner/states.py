@@ -7,9 +7,11 @@ Functions which save the ``state`` on completion or error, along with a function
 logs every function call.
 """
 
-import json,re,shutil,os
+import json,re,shutil,os,time,threading,itertools
 from loadstate import expt,settings
 from makeface import fab
+try: import resource
+except: resource = None
 
 __all__ = []
 
@@ -81,6 +83,48 @@ def stopper(state,exc,show_trace=True,last_lineno=None,script_fn='script.py'):
 	print(fab('[ERROR]','red_black')+' '+fab('%s'%exc,'cyan_black'))
 	statesave(state)
 
+#---reported calls that are in progress on each thread, used to nest the profiles
+profile_stacks = {}
+profile_lock = threading.Lock()
+profile_ids = itertools.count()
+#---profiles are appended to this file next to state.json instead of the state so that states stay small
+profile_fn = 'profile.jsonl'
+
+def resource_usage():
+	"""
+	Snapshot the wall time and resource usage for this process and its children.
+	"""
+	usage = {'time':time.time()}
+	if resource:
+		for key,who in [('self',resource.RUSAGE_SELF),('children',resource.RUSAGE_CHILDREN)]:
+			ru = resource.getrusage(who)
+			usage[key] = {'utime':ru.ru_utime,'stime':ru.ru_stime,
+				'maxrss':ru.ru_maxrss,'oublock':ru.ru_oublock}
+	return usage
+
+def resource_delta(start,stop,children=True):
+	"""
+	Compute the cost of a call from two snapshots made by resource_usage.
+	Peak RSS (kB on Linux) is a high-water mark so we report the value at the end of the call.
+	Bytes written are estimated from block output operations (512 bytes each).
+	Usage by children is left out when other threads ran reported calls at the same time since we cannot tell
+	whose children were counted.
+	"""
+	delta = {'wall':stop['time']-start['time']}
+	if 'self' in start:
+		keys = ['self','children'] if children else ['self']
+		for key in keys:
+			delta['cpu_%s'%key] = sum([stop[key][i]-start[key][i] for i in ['utime','stime']])
+			delta['maxrss_%s'%key] = stop[key]['maxrss']
+		delta['bytes_written'] = 512*sum([stop[key]['oublock']-start[key]['oublock'] for key in keys])
+	return delta
+
+def profile_write(record):
+	"""Append a finished profile record to the profile file."""
+	try:
+		with open(profile_fn,'a') as fp: fp.write(json.dumps(record)+'\n')
+	except (IOError,OSError,TypeError,ValueError) as e: print('[WARNING] failed to write a profile: %s'%e)
+
 def call_reporter(func,state={}):
 	"""Every function reports itself. Send this to __init__.py so exposed functions are loud."""
 	def loud(*args,**kwargs):
@@ -94,7 +138,7 @@ def call_reporter(func,state={}):
 			#---! note that `make quick vmd_protein` needs to use the state without q in many functions
 			no_log_needed = ['init','make_sidestep','gmx_get_last_frame',
 				'gmx_get_trajectory','gmx_run','call_reporter','gmx_get_last_call','write_continue_script',
-				'get_last_mdps','gmx']
+				'get_last_mdps','gmx','gmx_async','gmx_wait']
 			if 'q' not in state and func.__name__ not in no_log_needed: 
 				raise Exception('dev error: %s called the reporter '%func.__name__+
 					'before the "q" function was registered. if this is okay, add the function '+
@@ -104,7 +148,31 @@ def call_reporter(func,state={}):
 		print('[RUN] %s'%noted)
 		if 'history' not in state: state.history = []
 		state.history.append(noted)
-		return func(*args,**kwargs)
+		#---profile the call and write it to the profile file when it finishes
+		thread = threading.current_thread().ident
+		with profile_lock:
+			stack = profile_stacks.setdefault(thread,[])
+			record = {'name':func.__name__,'call':len(state.history)-1,'id':'%d.%d'%(os.getpid(),next(profile_ids)),
+				'parent':stack[-1]['id'] if stack else None,'step':state.get('step',None),
+				'stack':';'.join([i['name'] for i in stack]+[func.__name__])}
+			#---callers can label the record for the next call on this thread (see gmx_run_cached)
+			record.update(**getattr(loud.profile,'labels',{}))
+			loud.profile.labels = {}
+			#---calls on other threads overlap with this one
+			others = [i for key,val in profile_stacks.items() if key!=thread for i in val]
+			if others: record['overlap'] = True
+			for other in others: other['overlap'] = True
+			stack.append(record)
+		usage_start = resource_usage()
+		try: return func(*args,**kwargs)
+		finally:
+			with profile_lock:
+				stack.pop()
+				if not stack: del profile_stacks[thread]
+			record.update(**resource_delta(usage_start,resource_usage(),children=not record.get('overlap',False)))
+			profile_write(record)
+	#---labels for the next record made by this function on each thread
+	loud.profile = threading.local()
 	#---rename the function
 	loud.__name__ = func.__name__
 	return loud
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+"""
+Regression checks for the standalone readers in amx/gromacs.
+These modules use bare sibling imports (they are normally imported by amx) so we add their folder to the path
+along with the runner, which is imported in the same way.
+Sample files in tests/samples were written by GROMACS (see tests/samples/README).
+"""
+
+import os,sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+for dn in [os.path.join(here,'..','runner'),os.path.join(here,'..','amx','gromacs'),os.path.join(here,'..','amx')]:
+	if os.path.abspath(dn) not in sys.path: sys.path.insert(0,os.path.abspath(dn))
+
+def sample(name): return os.path.join(here,'samples',name)
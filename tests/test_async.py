@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import time,threading
+import pytest
+import conftest
+import calls
+from datapack import DotDict
+from journal import GMXJournal
+
+@pytest.fixture
+def pool(tmpdir,monkeypatch):
+	"""Run asynchronous calls with a stub runner that sleeps and records when each call starts and ends."""
+	events,lock = [],threading.Lock()
+	def prepare(program,**kwargs):
+		log = kwargs.pop('log')
+		recorded = {'call':program,'flags':dict([('-'+k,v) for k,v in kwargs.items()])}
+		protected = {'log':log,'cwd':None,'inpipe':None,'nonessential':None,'custom':None}
+		return program,None,recorded,protected
+	def run_cached(program,cmd,argv,recorded,protected):
+		with lock: events.append(('start',protected['log']))
+		time.sleep(float(recorded['flags'].get('-sleep',0)))
+		with lock: events.append(('end',protected['log']))
+		if recorded['flags'].get('-fail',False): raise Exception('failed %s'%protected['log'])
+	state = DotDict(here=str(tmpdir)+'/',step='s01-test',gmx_journal={'path':str(tmpdir.join('gmx-journal.jsonl'))})
+	monkeypatch.setattr(calls,'state',state,raising=False)
+	monkeypatch.setattr(calls,'gmx_prepare',prepare)
+	monkeypatch.setattr(calls,'gmx_run_cached',run_cached)
+	monkeypatch.setattr(calls,'gmx_pool_cores',lambda:2)
+	monkeypatch.setattr(calls,'gmx_pool',{'executor':None,'cores':None,'pending':[],'count':0})
+	return events,GMXJournal(str(tmpdir.join('gmx-journal.jsonl')))
+
+def test_async_order(pool):
+	"""The journal follows the submission order and calls start after the calls they are after."""
+	events,journal = pool
+	first = calls.gmx_async('grompp',log='a',sleep=0.3)
+	calls.gmx_async('editconf',log='b')
+	calls.gmx_async('mdrun',log='c',after=first)
+	calls.gmx_wait()
+	assert events.index(('end','b'))<events.index(('end','a'))<events.index(('start','c'))
+	assert [i['call'] for i in journal.calls()]==['grompp','editconf','mdrun']
+	assert calls.gmx_pool['pending']==[]
+
+def test_async_errors(pool,capsys):
+	"""Errors are raised after every call has finished and successful calls are still recorded."""
+	events,journal = pool
+	calls.gmx_async('grompp',log='a',fail=True)
+	calls.gmx_async('editconf',log='b',sleep=0.2)
+	with pytest.raises(Exception) as error: calls.gmx_wait()
+	assert 'failed a' in str(error.value) and ('end','b') in events
+	assert [i['call'] for i in journal.calls()]==['editconf']
+	assert 'gmx_async call with log a failed' in capsys.readouterr().out
+
+def test_async_log(pool):
+	"""Pending calls cannot share a log."""
+	calls.gmx_async('grompp',log='a',sleep=0.3)
+	with pytest.raises(Exception): calls.gmx_async('grompp',log='a')
+	calls.gmx_wait()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import numpy as np
+import conftest
+from topology_tools import GMXTopology,GMXTopologyMolecule
+
+#---ethanol with the hydroxyl as a constraint and a separate water molecule in the same moleculetype
+ethanol_itp = """[ moleculetype ]
+ETH 3
+[ atoms ]
+1 CT 1 ETH C1 1 -0.18 12.011
+2 HC 1 ETH H11 1 0.06 1.008
+3 HC 1 ETH H12 1 0.06 1.008
+4 HC 1 ETH H13 1 0.06 1.008
+5 CT 1 ETH C2 2 0.145 12.011
+6 H1 1 ETH H21 2 0.06 1.008
+7 H1 1 ETH H22 2 0.06 1.008
+8 OH 1 ETH O 2 -0.683 15.999
+9 HO 1 ETH HO 2 0.418 1.008
+10 OW 2 SOL OW 3 -0.834 15.999
+11 HW 2 SOL HW1 3 0.417 1.008
+[ bonds ]
+1 2 1
+1 3 1
+1 4 1
+1 5 1
+5 6 1
+5 7 1
+5 8 1
+10 11 1
+[ constraints ]
+8 9 1 0.0945
+"""
+
+def molecule(tmpdir):
+	tmpdir.join('ethanol.itp').write(ethanol_itp)
+	return GMXTopologyMolecule(GMXTopology(str(tmpdir.join('ethanol.itp')),cache=False).molecules['ETH'])
+
+def test_bond_graph(tmpdir):
+	"""The graph includes bonds and constraints in both directions."""
+	mol = molecule(tmpdir)
+	assert sorted(mol.neighbors(0).tolist())==[1,2,3,4]
+	assert sorted(mol.neighbors(7).tolist())==[4,8]
+	assert mol.get_bonds()[:2]==[[0,1],[0,2]]
+	assert mol.fragments().tolist()==[0]*9+[1]*2
+	assert mol.hydrogens().tolist()==[3,0,0,0,2,0,0,1,0,1,0]
+
+def test_bond_graph_exclusions(tmpdir):
+	"""Exclusions match a breadth-first search out to nrexcl bonds."""
+	mol = molecule(tmpdir)
+	natoms = len(mol.mol['atoms'])
+	for nrexcl in [0,1,2,3]:
+		expected = set()
+		for start in range(natoms):
+			seen,frontier = set([start]),[start]
+			for hop in range(nrexcl):
+				frontier = [j for i in frontier for j in mol.neighbors(i) if j not in seen]
+				seen.update(frontier)
+			expected.update([(start,j) for j in seen if j>start])
+		assert set(map(tuple,mol.exclusions(nrexcl).tolist()))==expected
+	assert len(mol.exclusions())==len(mol.exclusions(3))
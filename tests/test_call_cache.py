@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import os
+import conftest
+from call_cache import GMXCallCache
+
+def run(cache,program,recorded,cwd,writes,log_fn):
+	"""Pretend to run a call that writes some files and store it."""
+	key = cache.key(program,'cmd',recorded,cwd)
+	before = cache.snapshot(program,recorded,cwd)
+	for fn,text in writes.items():
+		with open(os.path.join(cwd,fn),'w') as fp: fp.write(text)
+	with open(log_fn,'w') as fp: fp.write('log')
+	cache.store(key,program,recorded,cwd,before,log_fn)
+	return key
+
+def test_call_cache_outputs(tmpdir):
+	"""Outputs come from the output flags so absolute paths are restored and other files are ignored."""
+	cwd,dest = tmpdir.mkdir('here'),tmpdir.mkdir('dest')
+	cwd.join('in.gro').write('structure')
+	cache = GMXCallCache(str(tmpdir.join('store')))
+	out = str(dest.join('out'))
+	recorded = {'call':'trjconv','flags':{'-f':'in.gro','-o':out}}
+	#---a concurrent call writes other.gro in the same folder while this one runs
+	key = run(cache,'trjconv',recorded,str(cwd),
+		{out+'.xtc':'frames','other.gro':'not ours'},str(cwd.join('log-trjconv')))
+	assert cache.manifest()[key]['outputs'].keys()==set([out+'.xtc'])
+	os.remove(out+'.xtc')
+	assert cache.restore(key,str(cwd),str(cwd.join('log-trjconv')))
+	assert dest.join('out.xtc').read()=='frames'
+
+def test_call_cache_pdb2gmx(tmpdir):
+	"""Per-chain topologies from pdb2gmx are stored along with the default outputs."""
+	cwd = tmpdir.mkdir('here')
+	cwd.join('protein.pdb').write('protein')
+	cache = GMXCallCache(str(tmpdir.join('store')))
+	recorded = {'call':'pdb2gmx','flags':{'-f':'protein.pdb','-p':'system.top'}}
+	key = run(cache,'pdb2gmx',recorded,str(cwd),{'conf.gro':'gro','system.top':'top',
+		'system_Protein_chain_A.itp':'itp','posre.itp':'posre'},str(cwd.join('log-pdb2gmx')))
+	assert sorted(cache.manifest()[key]['outputs'].keys())==sorted(
+		['conf.gro','system.top','system_Protein_chain_A.itp','posre.itp'])
+
+def test_call_cache_forcefield(tmpdir):
+	"""Changes to a local force field or to files included with angle brackets change the key."""
+	cwd = tmpdir.mkdir('here')
+	cwd.join('protein.pdb').write('protein')
+	cwd.mkdir('charmm36.ff').join('aminoacids.rtp').write('rtp')
+	cache = GMXCallCache(str(tmpdir.join('store')))
+	recorded = {'call':'pdb2gmx','flags':{'-f':'protein.pdb','-ff':'charmm36'}}
+	key = cache.key('pdb2gmx','cmd',recorded,str(cwd))
+	cwd.join('charmm36.ff','aminoacids.rtp').write('edited rtp')
+	assert cache.key('pdb2gmx','cmd',recorded,str(cwd))!=key
+	cwd.join('system.top').write('#include <charmm36.ff/forcefield.itp>\n')
+	cwd.join('charmm36.ff','forcefield.itp').write('[ defaults ]\n')
+	cwd.join('system.gro').write('gro')
+	cwd.join('md.mdp').write('mdp')
+	recorded = {'call':'grompp','flags':{'-f':'md.mdp','-c':'system.gro','-p':'system.top'}}
+	key = cache.key('grompp','cmd',recorded,str(cwd))
+	cwd.join('charmm36.ff','forcefield.itp').write('[ defaults ]\n1 2 yes 0.5 0.5\n')
+	assert cache.key('grompp','cmd',recorded,str(cwd))!=key
+
+def store_many(root,cwd,worker,count=10):
+	cache = GMXCallCache(root)
+	for i in range(count):
+		fn = 'out-%d-%d.gro'%(worker,i)
+		recorded = {'call':'editconf','flags':{'-f':'in.gro','-o':fn}}
+		before = cache.snapshot('editconf',recorded,cwd)
+		with open(os.path.join(cwd,fn),'w') as fp: fp.write('%d %d'%(worker,i))
+		with open(os.path.join(cwd,'log-%d'%worker),'w') as fp: fp.write('log')
+		cache.store('key-%d-%d'%(worker,i),'editconf',recorded,cwd,before,os.path.join(cwd,'log-%d'%worker))
+
+def test_call_cache_processes(tmpdir):
+	"""Processes that share a store do not lose each other's manifest entries."""
+	import multiprocessing
+	cwd = tmpdir.mkdir('here')
+	root = str(tmpdir.join('store'))
+	procs = [multiprocessing.Process(target=store_many,args=(root,str(cwd),i)) for i in range(4)]
+	for proc in procs: proc.start()
+	for proc in procs: proc.join()
+	assert len(GMXCallCache(root).manifest())==40
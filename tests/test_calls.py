@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import os
+import pytest
+import conftest
+import calls
+from datapack import DotDict
+from gromacs_commands import gmx_commands_interpret
+
+def test_gmx_run_missing(tmpdir,monkeypatch):
+	"""Commands that cannot start are logged and raise whether they run directly or in bash."""
+	monkeypatch.setattr(calls,'state',DotDict(here=str(tmpdir)+'/'),raising=False)
+	monkeypatch.setattr(calls,'status',lambda *args,**kwargs:None,raising=False)
+	with pytest.raises(Exception) as error: 
+		calls.gmx_run('gmx-missing -h',log='missing',argv=['gmx-missing','-h'])
+	assert 'command not found' in str(error.value)
+	assert tmpdir.join('log-missing').read()=='gmx-missing: command not found\n'
+	#---a missing folder is not reported as a missing command for either path
+	log = str(tmpdir.join('log-cwd'))
+	for argv in [['true'],None]:
+		with pytest.raises(Exception) as error: 
+			calls.gmx_run('true',log=log,argv=argv,cwd=str(tmpdir.join('nowhere')))
+		assert 'cannot run true' in str(error.value)
+		assert 'command not found' not in open(log).read() and 'nowhere' in open(log).read()
+	assert calls.gmx_run('true',log=log,argv=None,cwd=str(tmpdir.join('nowhere')),nonessential=True)['wall']>=0
+
+def test_gmx_commands_copy():
+	"""Changes to interpreted commands do not reach the cached templates."""
+	templates = 'grompp -f INPUT.mdp -c STRUCTURE.gro -o OUTPUT.tpr\n'
+	first = gmx_commands_interpret(templates)
+	first['grompp']['flags'].append(('-maxwarn','1'))
+	first['grompp']['required'].append('maxwarn')
+	assert gmx_commands_interpret(templates)['grompp']['flags']==[
+		('-f','%(input)s.mdp'),('-c','%(structure)s.gro'),('-o','%(output)s.tpr')]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import sys
+import pytest
+import conftest
+from conftest import sample
+from continuation import continuation,continuation_latest,continuation_index_read
+from journal import GMXJournal
+
+#---stand-ins for GROMACS that write the files that each part expects
+fake_tpbconv = """import sys,shutil
+args = sys.argv[1:]
+shutil.copyfile(args[args.index('-s')+1],args[args.index('-o')+1])
+"""
+fake_mdrun = """import sys,shutil
+args = sys.argv[1:]
+if args[args.index('-cpi')+1]=='md.part0002.cpt': sys.exit(3)
+for flag in ['-cpo','-x','-e']: open(args[args.index(flag)+1],'w').close()
+shutil.copyfile(%r,args[args.index('-g')+1])
+"""
+
+@pytest.fixture
+def step(tmpdir,monkeypatch):
+	"""A step folder with the first part of a simulation."""
+	tmpdir.join('tpbconv.py').write(fake_tpbconv)
+	tmpdir.join('mdrun.py').write(fake_mdrun%sample('md.log'))
+	here = tmpdir.mkdir('s01-md')
+	for suffix in ['tpr','cpt']: here.join('md.part0001.%s'%suffix).write('')
+	monkeypatch.chdir(str(here))
+	return tmpdir
+
+def test_continuation_part(step):
+	"""Each part extends the run input and continues from the latest checkpoint."""
+	commands = dict([(i,'%s %s'%(sys.executable,step.join('%s.py'%i))) for i in ['tpbconv','mdrun']])
+	continuation(tpbconv=commands['tpbconv'],mdrun=commands['mdrun'],journal=str(step.join('gmx-journal.jsonl')))
+	index = continuation_index_read()
+	assert [i['part'] for i in index['parts']]==[2] and index['parts'][0]['ns/day']==77.404
+	assert continuation_latest(index)['files']['-cpo']=='md.part0002.cpt'
+	journal = GMXJournal(str(step.join('gmx-journal.jsonl')))
+	mdrun = journal.last(call='mdrun',steps=['s01-md'])
+	assert mdrun['flags']['-cpi']=='md.part0001.cpt' and mdrun['flags']['-s']=='md.part0002.tpr'
+	#---the fake mdrun fails on the next part and the exit code is reported
+	with pytest.raises(Exception) as error:
+		continuation(tpbconv=commands['tpbconv'],mdrun=commands['mdrun'],journal=False)
+	assert 'mdrun failed in part 3' in str(error.value)
+	assert continuation_index_read()['parts'][-1]['returncode']==3
+
+def test_continuation_append(step):
+	"""Append mode only replaces the run input of the latest part after mdrun succeeds."""
+	step.join('extend.py').write('import sys\nargs = sys.argv[1:]\n'
+		'open(args[args.index("-o")+1],"w").write(open(args[args.index("-s")+1]).read()+"extended\\n")\n')
+	step.join('fail.py').write('import sys\nsys.exit(3)\n')
+	commands = dict([(i,'%s %s'%(sys.executable,step.join('%s.py'%i))) for i in ['extend','mdrun','fail']])
+	with pytest.raises(Exception):
+		continuation(tpbconv=commands['extend'],mdrun=commands['fail'],append=True,journal=False)
+	assert open('md.part0001.tpr').read()=='' and not step.join('s01-md','md.part0001.next.tpr').check()
+	continuation(tpbconv=commands['extend'],mdrun=commands['mdrun'],append=True,journal=False)
+	assert open('md.part0001.tpr').read()=='extended\n' and not step.join('s01-md','md.part0001.next.tpr').check()
+	assert [i['part'] for i in continuation_index_read()['parts']]==[1,1]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+We could not find a small checkpoint written by mdrun to ship with the tests so these checks write one with
+the layout of do_cpt_header and do_cpt_state in the GROMACS source (checkpoint version 17, from GROMACS 2018).
+"""
+
+import struct
+import numpy as np
+import pytest
+import conftest
+from cpt import cpt_header,cpt_read,cpt_progress,cpt_to_gro
+
+reference_gro = """water t= 0.00000 step= 0
+    3
+    1SOL     OW    1   0.126   1.624   1.679  0.1227 -0.0580  0.0434
+    1SOL    HW1    2   0.190   1.661   1.747  0.8085  0.3191 -0.7791
+    1SOL    HW2    3   0.177   1.568   1.613 -0.9045 -0.9480  0.7000
+   1.86206   1.86206   1.86206
+"""
+
+def xdr_string(text):
+	"""Write a plain XDR string padded to four bytes."""
+	data = text.encode()
+	return struct.pack('>i',len(data))+data+b'\x00'*((-len(data))%4)
+
+def cpt_write(fn,x,box,v=None,step=5000,time=10.0,part=2):
+	"""Write a single precision checkpoint with a box, coordinates, and (optionally) velocities."""
+	natoms = len(x)
+	flags = (1<<1)|(1<<7)|((1<<8) if v is not None else 0)
+	buf = struct.pack('>i',171817)
+	for text in ['VERSION 2018.8','','','','gmx mdrun','Sat Oct 17 12:00:00 2026']: buf += xdr_string(text)
+	#---file version, double precision, host
+	buf += struct.pack('>ii',17,0)+xdr_string('node01')
+	#---atoms, temperature groups, thermostat and barostat chains, lambda states, integrator, part
+	buf += struct.pack('>iiiiiii',natoms,1,10,10,0,0,part)
+	buf += struct.pack('>qd',step,time)
+	#---ranks, domain decomposition, PME ranks, state flags
+	buf += struct.pack('>iiiiii',1,1,1,1,-1,flags)
+	#---kinetic energy, energy history, free energy history, essential dynamics, swap, and AWH flags
+	buf += struct.pack('>iiiiii',0,0,0,0,0,0)
+	for values in [box,x,v]:
+		if values is None: continue
+		values = np.array(values,dtype='>f4').reshape(-1)
+		buf += struct.pack('>ii',len(values),1)+values.tobytes()
+	#---the footer (energy history, file list, checksums) is not read
+	buf += struct.pack('>iii',0,0,0)
+	with open(fn,'wb') as fp: fp.write(buf)
+	return fn
+
+frame_x = [[0.130,1.620,1.680],[0.195,1.660,1.750],[0.175,1.570,1.610]]
+frame_v = [[0.1,-0.2,0.3],[0.4,0.5,-0.6],[-0.7,0.8,0.9]]
+frame_box = [[1.9,0.,0.],[0.,1.9,0.],[0.,0.,1.9]]
+
+def test_cpt_header(tmpdir):
+	"""The header reports the progress of the run."""
+	fn = cpt_write(str(tmpdir.join('md.part0002.cpt')),frame_x,frame_box,v=frame_v)
+	header = cpt_header(fn)
+	assert header['file_version']==17 and header['double']==False and header['host']=='node01'
+	assert (header['natoms'],header['flags_state'])==(3,(1<<1)|(1<<7)|(1<<8))
+	assert cpt_progress(fn)=={'step':5000,'time':10.0,'part':2,'natoms':3,'version':'VERSION 2018.8'}
+
+def test_cpt_read(tmpdir):
+	"""The box, coordinates, and velocities are read and missing velocities are None."""
+	fn = cpt_write(str(tmpdir.join('md.cpt')),frame_x,frame_box,v=frame_v)
+	frame = cpt_read(fn)
+	assert np.allclose(frame['box'],frame_box)
+	assert np.allclose(frame['x'],frame_x) and np.allclose(frame['v'],frame_v)
+	frame = cpt_read(cpt_write(str(tmpdir.join('em.cpt')),frame_x,frame_box))
+	assert frame['v'] is None and frame['x'].shape==(3,3)
+
+def test_cpt_truncated(tmpdir):
+	"""A checkpoint which ends early raises instead of returning a partial frame."""
+	fn = cpt_write(str(tmpdir.join('md.cpt')),frame_x,frame_box,v=frame_v)
+	with open(fn,'rb') as fp: data = fp.read()
+	for size,where in [(40,'header'),(len(data)-30,'v entry')]:
+		with open(fn,'wb') as fp: fp.write(data[:size])
+		with pytest.raises(Exception) as error: cpt_read(fn)
+		assert where in str(error.value)
+
+def test_cpt_to_gro(tmpdir):
+	"""The last frame takes its names from a reference structure."""
+	reference = tmpdir.join('system.gro')
+	reference.write(reference_gro)
+	fn = cpt_write(str(tmpdir.join('md.cpt')),frame_x,frame_box,v=frame_v)
+	lines = open(cpt_to_gro(fn,str(reference),str(tmpdir.join('last.gro')))).read().splitlines()
+	assert lines[0]=='water t= 10.00000 step= 5000' and lines[1].strip()=='3'
+	assert lines[3]=='    1SOL    HW1    2   0.195   1.660   1.750  0.4000  0.5000 -0.6000'
+	assert lines[-1]=='   1.90000   1.90000   1.90000'
+	with pytest.raises(Exception):
+		cpt_to_gro(cpt_write(str(tmpdir.join('big.cpt')),frame_x*2,frame_box),
+			str(reference),str(tmpdir.join('bad.gro')))
+
+def test_last_frame_fallback(tmpdir,monkeypatch,capsys):
+	"""Checkpoints we cannot read fall back to trjconv with a warning."""
+	import postprocess
+	here = str(tmpdir)+'/'
+	tmpdir.join('md.cpt').write('not a checkpoint')
+	last_mdrun = {'flags':{'-c':'md.gro','-cpo':'md.cpt','-s':'md.tpr'}}
+	calls = []
+	class State(object): pass
+	state = State()
+	state.before,state.here = [],here
+	monkeypatch.setattr(postprocess,'state',state,raising=False)
+	monkeypatch.setattr(postprocess,'gmx_get_last_call',lambda *args,**kwargs:last_mdrun,raising=False)
+	monkeypatch.setattr(postprocess,'gmx_commands_interpret',lambda x:{'trjconv':x},raising=False)
+	monkeypatch.setattr(postprocess,'gmx',lambda *args,**kwargs:calls.append((args,kwargs)),raising=False)
+	postprocess.gmx_get_last_frame()
+	assert calls[0][0]==('trjconv',) and calls[0][1]['cpt']=='md.cpt'
+	assert '[WARNING] cannot read the checkpoint' in capsys.readouterr().out
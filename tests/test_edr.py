@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import shutil
+import numpy as np
+from conftest import sample
+from edr import EDRFile,edr_read
+
+def edr_reference():
+	"""Read the values and units which gmx energy reports for aux.edr (52 lines per frame)."""
+	with open(sample('aux.edr.txt')) as fp: rows = [i.strip().split(',') for i in fp if i.strip()]
+	frames = [rows[i:i+52] for i in range(0,len(rows),52)]
+	return [dict([(name,(float(value),unit)) for name,value,unit in frame]) for frame in frames]
+
+def test_edr_header():
+	edr = EDRFile(sample('aux.edr'))
+	reference = edr_reference()[0]
+	assert edr.names==[i for i in reference if i!='Time']
+	assert edr.units==[reference[i][1] for i in edr.names]
+
+def test_edr_values():
+	reference = edr_reference()
+	edr = EDRFile(sample('aux.edr'))
+	data = edr.read()
+	assert edr.double==False
+	assert len(data['time'])==len(reference)==4
+	assert data['step'].tolist()==[0,10,20,30]
+	for fnum,frame in enumerate(reference):
+		assert np.isclose(data['time'][fnum],frame['Time'][0])
+		for name in edr.names: assert np.isclose(data[name][fnum],frame[name][0],rtol=1e-6)
+
+def test_edr_single_frame():
+	data = EDRFile(sample('single_frame.edr')).read(terms=['Bond','Potential'])
+	assert len(data['time'])==1 and sorted(data)==['Bond','Potential','step','time']
+
+def test_edr_tail(tmpdir):
+	"""Frames that are still being written are left for the next call to tail."""
+	with open(sample('aux.edr'),'rb') as fp: raw = fp.read()
+	fn = str(tmpdir.join('growing.edr'))
+	with open(fn,'wb') as fp: fp.write(raw[:len(raw)-100])
+	edr = EDRFile(fn)
+	assert edr.tail(terms=['Bond'])['step'].tolist()==[0,10,20]
+	with open(fn,'ab') as fp: fp.write(raw[len(raw)-100:])
+	assert edr.tail(terms=['Bond'])['step'].tolist()==[30]
+
+def test_edr_read_parts(tmpdir):
+	"""Frames repeated by a continuation are dropped when we join parts."""
+	fn = str(tmpdir.join('part.edr'))
+	shutil.copy(sample('aux.edr'),fn)
+	data = edr_read([sample('aux.edr'),fn],terms=['Potential'])
+	assert data['step'].tolist()==[0,10,20,30]
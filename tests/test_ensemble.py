@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+import json
+import pytest
+import conftest
+from cli import ensemble_points,ensemble_override
+
+def test_ensemble_points(tmpdir):
+	"""Sweeps come from a single key on the command line or from a JSON file."""
+	assert ensemble_points()==[{}]
+	assert ensemble_points('ion_concentration:0.1 0.15')==[{'ion_concentration':'0.1'},{'ion_concentration':'0.15'}]
+	grid = tmpdir.join('sweep.json')
+	grid.write(json.dumps({'temperature':[300,310],'ion':['NA','K']}))
+	assert ensemble_points(str(grid))==[{'ion':'NA','temperature':300},{'ion':'NA','temperature':310},
+		{'ion':'K','temperature':300},{'ion':'K','temperature':310}]
+	points = tmpdir.join('points.json')
+	points.write(json.dumps([{'temperature':300},{'temperature':350,'ion':'K'}]))
+	assert ensemble_points(str(points))==[{'temperature':300},{'temperature':350,'ion':'K'}]
+	with pytest.raises(Exception): ensemble_points('not a sweep')
+
+def test_ensemble_override():
+	"""Overrides replace lines with the same key and keep the others."""
+	text = 'temperature: 300\nsolvent: spc216\n'
+	assert ensemble_override(text,{'temperature':310})=='solvent: spc216\ntemperature: 310\n'
+	assert ensemble_override(None,{'b':2,'a':1})=='a: 1\nb: 2\n'
+	#---keys which only share a prefix are kept
+	assert ensemble_override('temperature_coupling: v-rescale',{'temperature':310})==\
+		'temperature_coupling: v-rescale\ntemperature: 310\n'
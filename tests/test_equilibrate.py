@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+import numpy as np
+import conftest
+from common import equilibrate_converged
+
+tolerances = {'Temperature':{'mean':1.0,'drift':2.0},'Pressure':{'mean':10.0,'drift':20.0}}
+
+def energies(slope=0.0,duration=100.0):
+	"""Energy terms sampled every picosecond with a linear drift in temperature and some noise in pressure."""
+	time = np.arange(0.,duration+1.,1.)
+	noise = np.random.RandomState(0).normal(0.,1.,len(time))
+	return {'time':time,'Temperature':300.+slope*time,'Pressure':1.+noise}
+
+def test_converged_flat():
+	"""Terms without drift converge and the report has the achieved values."""
+	converged,report = equilibrate_converged(energies(),20.0,tolerances)
+	assert converged and sorted(report.keys())==['Pressure','Temperature']
+	assert abs(report['Temperature']['mean']-300.)<1e-9 and abs(report['Temperature']['drift'])<1e-9
+	#---terms which are not in the energy file are skipped
+	assert equilibrate_converged(energies(),20.0,dict(tolerances,Volume={'mean':0.1,'drift':0.1}))[0]
+
+def test_converged_drift():
+	"""A drift above the tolerance fails and the same drift below it passes."""
+	#---the temperature changes by 4 K over the window so only the drift is above the tolerance
+	loose = dict(tolerances,Temperature={'mean':10.0,'drift':2.0})
+	converged,report = equilibrate_converged(energies(slope=0.2),20.0,loose)
+	assert not converged and np.isclose(report['Temperature']['drift'],4.0)
+	assert not report['Temperature']['converged'] and report['Pressure']['converged']
+	converged,report = equilibrate_converged(energies(slope=0.04),20.0,tolerances)
+	assert converged and np.isclose(report['Temperature']['drift'],0.8)
+
+def test_converged_short():
+	"""Data shorter than two windows is never converged."""
+	assert equilibrate_converged(energies(duration=30.0),20.0,tolerances)==(False,{})
+	assert equilibrate_converged({'time':np.array([])},20.0,tolerances)==(False,{})
+	assert equilibrate_converged(energies(duration=40.0),20.0,tolerances)[0]
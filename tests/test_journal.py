@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import conftest
+from journal import GMXJournal
+
+def test_journal_lineage(tmpdir):
+	"""Branches that share a journal only see the calls from their own steps."""
+	journal = GMXJournal(str(tmpdir.join('gmx-journal.jsonl')))
+	journal.append({'call':'mdrun','flags':{'-s':'em.tpr'}},step='s01-em',here='s01-em/')
+	mine = journal.append({'call':'mdrun','flags':{'-s':'md.a.tpr'}},step='s02-a',here='s02-a/')
+	journal.append({'call':'mdrun','flags':{'-s':'md.b.tpr'}},step='s03-b',here='s03-b/')
+	assert journal.last(call='mdrun')['flags']['-s']=='md.b.tpr'
+	assert journal.last(call='mdrun',steps=['s01-em','s02-a'])['n']==mine
+	assert journal.last(call='mdrun',steps=['s01-em','s03-b'],count=mine+1)['flags']['-s']=='em.tpr'
+	assert journal.last(call='grompp',steps=['s02-a'])==None
+
+def test_journal_partial_line(tmpdir):
+	"""A line which is still being written by another process is picked up on the next scan."""
+	fn = str(tmpdir.join('gmx-journal.jsonl'))
+	journal = GMXJournal(fn)
+	journal.append({'call':'grompp','flags':{}},step='s01-em')
+	with open(fn,'a') as fp: fp.write('{"call": "mdrun", "fl')
+	assert len(journal)==1
+	with open(fn,'a') as fp: fp.write('ags": {}, "step": "s01-em"}\n')
+	assert len(journal)==2 and journal.last(step='s01-em')['call']=='mdrun'
+
+def test_journal_count(tmpdir):
+	"""States only see the calls that were recorded before they were saved."""
+	fn = str(tmpdir.join('gmx-journal.jsonl'))
+	journal = GMXJournal(fn)
+	for call in ['grompp','mdrun','grompp','mdrun']: journal.append({'call':call,'flags':{}},step='s01-md')
+	assert journal.last(call='mdrun')['n']==3
+	assert journal.last(call='mdrun',count=3)['n']==1
+	assert journal.last(call='mdrun',count=1)==None
+	assert [i['n'] for i in journal.calls(call='grompp')]==[0,2]
+	#---another process that opens the journal builds the same index
+	assert GMXJournal(fn).select(call='mdrun',step='s01-md')==[1,3]
+
+def test_journal_append_offset(tmpdir):
+	"""Appends return the sequence number of their own line when another process appends first."""
+	fn = str(tmpdir.join('gmx-journal.jsonl'))
+	journal,other = GMXJournal(fn),GMXJournal(fn)
+	journal.append({'call':'grompp','flags':{}},step='s01-em')
+	#---another process appends after our write so the scan after our append sees both lines
+	original,scans = journal.scan,[]
+	def scan():
+		scans.append(len(scans))
+		if len(scans)==2: other.append({'call':'editconf','flags':{}},step='s02-b')
+		original()
+	journal.scan = scan
+	n = journal.append({'call':'mdrun','flags':{}},step='s01-em')
+	assert len(journal)==3 and n==1 and journal.read(n)['call']=='mdrun'
+
+def test_journal_lineage_cache(tmpdir):
+	"""Cached lineages pick up calls appended after the last lookup."""
+	journal = GMXJournal(str(tmpdir.join('gmx-journal.jsonl')))
+	journal.append({'call':'mdrun','flags':{}},step='s01-em')
+	assert journal.select(call='mdrun',steps=['s01-em','s02-a'])==[0]
+	journal.append({'call':'mdrun','flags':{}},step='s03-b')
+	journal.append({'call':'mdrun','flags':{}},step='s02-a')
+	journal.append({'call':'mdrun','flags':{}})
+	assert journal.select(call='mdrun',steps=['s01-em','s02-a'])==[0,2,3]
+	assert list(journal.lineages.values())[0][0]==4
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+import conftest
+from conftest import sample
+from mdlog import gmx_mdlog_parse,gmx_mdlog_time
+
+def test_mdlog_performance():
+	"""Read the performance section at the end of a log written by mdrun."""
+	perf = gmx_mdlog_parse(sample('md.log'))
+	assert perf['ns/day']==77.404 and perf['hours/ns']==0.31
+	assert (perf['core_time'],perf['wall_time'],perf['core_percent'])==(0.043,0.006,764.3)
+	assert (perf['steps'],perf['ranks'],perf['threads'])==(5,1,8)
+	rows = dict([(i['name'],i) for i in perf['accounting']])
+	assert rows['Write traj.']=={'name':'Write traj.','wall':0.002,'giga_cycles':0.038,'percent':36.6,
+		'ranks':1,'threads':8,'calls':2}
+	assert rows['Total']['percent']==100.0 and 'calls' not in rows['Rest']
+
+def test_mdlog_interrupted(tmpdir):
+	"""A log without a performance section belongs to a run that is still going or was interrupted."""
+	with open(sample('md.log')) as fp: text = fp.read()
+	fn = tmpdir.join('md.log')
+	fn.write(text[:text.index('Writing checkpoint, step 4')])
+	assert gmx_mdlog_parse(str(fn))==None
+
+def test_mdlog_time(tmpdir):
+	"""The last energy output in a log gives the progress of a running job."""
+	assert gmx_mdlog_time(sample('md.log'))=={'step':4,'time':0.004}
+	with open(sample('md.log')) as fp: text = fp.read()
+	fn = tmpdir.join('md.log')
+	fn.write(text[:text.index('Step           Time\n              4')])
+	assert gmx_mdlog_time(str(fn))=={'step':0,'time':0.0}
+	fn.write(text[:text.index('Started mdrun')])
+	assert gmx_mdlog_time(str(fn))==None
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import os
+import pytest
+import conftest
+from control import metarun_after,metarun_lineage,schedule
+
+def test_metarun_after():
+	"""After keys name earlier steps by number, step, or do and steps without one follow the previous step."""
+	steps = [{'step':'protein'},{'step':'large','after':'protein'},{'do':'small','after':1},
+		{'step':'merge','after':['large','small']},{'step':'extra'}]
+	assert metarun_after(steps)==[[],[1],[1],[2,3],[4]]
+	assert metarun_after([{'step':'a'},{'step':'b'}])==None
+	with pytest.raises(Exception) as error: metarun_after([{'step':'a','after':'b'},{'step':'b'}])
+	assert 'unknown step' in str(error.value)
+	with pytest.raises(Exception) as error: metarun_after([{'step':'a'},{'step':'b','after':2}])
+	assert 'earlier steps' in str(error.value)
+	with pytest.raises(Exception) as error: metarun_after([{'step':'a'},{'step':'a'},{'step':'c','after':'a'}])
+	assert 'use a number' in str(error.value)
+
+def test_metarun_lineage():
+	"""A step after both branches of a diamond follows the lineage of both of them."""
+	states = [{'steps':['s01-protein']},{'steps':['s01-protein','s02-large']},
+		{'steps':['s01-protein','s03-small']}]
+	assert metarun_lineage(states)==['s01-protein','s02-large','s03-small']
+
+def jobs_diamond(tmpdir,fail=None):
+	"""Jobs that record when they start and end in a shared file."""
+	afters = {'1':[],'2':['1'],'3':['1'],'4':['2','3']}
+	jobs = []
+	for name in sorted(afters):
+		command = 'echo start %s >> order && sleep 0.3 && echo end %s >> order'%(name,name)
+		if name==fail: command += ' && exit 1'
+		jobs.append({'name':name,'after':afters[name],'threads':1,'command':command,
+			'dn':str(tmpdir),'log':str(tmpdir.join('log-%s'%name))})
+	return jobs
+
+def test_schedule_diamond(tmpdir,monkeypatch):
+	"""Branches run at the same time and a step waits for all of the steps that it is after."""
+	monkeypatch.chdir(tmpdir)
+	jobs = schedule(jobs_diamond(tmpdir),2,'script-stop-test.sh',poll=0.05)
+	assert [i['status'] for i in jobs]==['done']*4
+	order = tmpdir.join('order').read().split('\n')
+	assert order[:2]==['start 1','end 1']
+	assert sorted(order[2:4])==['start 2','start 3'] and order[6:8]==['start 4','end 4']
+	assert not os.path.isfile('script-stop-test.sh')
+
+def test_schedule_budget_and_failure(tmpdir,monkeypatch):
+	"""Jobs wait for cores and jobs after a failure are skipped."""
+	monkeypatch.chdir(tmpdir)
+	jobs = schedule(jobs_diamond(tmpdir,fail='2'),1,'script-stop-test.sh',poll=0.05)
+	assert [i['status'] for i in jobs]==['done','failed','done','skipped']
+	assert tmpdir.join('order').read().split('\n')[:6]==['start 1','end 1','start 2','end 2','start 3','end 3']
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import conftest
+import preprocessor
+from preprocessor import itp_lines
+
+def test_itp_file_cache_limit(tmpdir,monkeypatch):
+	"""The file cache drops the least-recently used files when it holds too many lines."""
+	monkeypatch.setattr(preprocessor,'itp_file_cache',preprocessor.collections.OrderedDict())
+	monkeypatch.setattr(preprocessor,'itp_file_cache_limit',25)
+	fns = []
+	for name in 'abc':
+		tmpdir.join('%s.itp'%name).write('; %s\n'%name*10)
+		fns.append(str(tmpdir.join('%s.itp'%name)))
+	assert itp_lines(fns[0])[0]=='; a' and itp_lines(fns[1])[0]=='; b'
+	#---reading the first file again makes the second file the oldest
+	itp_lines(fns[0])
+	itp_lines(fns[2])
+	assert list(preprocessor.itp_file_cache.keys())==[fns[0],fns[2]]
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+import json,threading,time
+import conftest
+from datapack import DotDict
+from states import call_reporter
+
+def test_profile_threads(tmpdir,monkeypatch):
+	"""Reported calls on concurrent threads are nested on their own stacks and written to the profile file."""
+	monkeypatch.chdir(tmpdir)
+	state = DotDict(step='s01-test')
+	#---both inner calls are running before either one finishes
+	barrier = threading.Barrier(2)
+	def inner(name):
+		barrier.wait()
+		time.sleep(0.05)
+	inner_reported = call_reporter(inner,state)
+	def outer(name):
+		inner_reported.profile.labels = {'tool':name}
+		inner_reported(name)
+	outer_reported = call_reporter(outer,state)
+	threads = [threading.Thread(target=outer_reported,args=(name,)) for name in ['a','b']]
+	for thread in threads: thread.start()
+	for thread in threads: thread.join()
+	with open('profile.jsonl') as fp: records = [json.loads(line) for line in fp]
+	assert 'history_profile' not in state
+	outers = dict([(i['id'],i) for i in records if i['name']=='outer'])
+	inners = [i for i in records if i['name']=='inner']
+	assert len(outers)==2 and len(inners)==2
+	assert sorted([i['tool'] for i in inners])==['a','b']
+	for record in inners:
+		assert record['stack']=='outer;inner' and record['parent'] in outers
+		#---usage by children cannot be attributed when the calls overlap
+		assert record['overlap'] and 'cpu_children' not in record and record['wall']>=0.05
+	assert len(set([i['parent'] for i in inners]))==2
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import os,sys,time
+import pytest
+import conftest
+from schedulers import chain_begin,chain_read
+
+#---stand-in for script-continue.sh which writes the next part with a checkpoint 10 ps later
+fake_part = """import os,sys,glob
+sys.path.insert(0,%r)
+from test_cpt import cpt_write
+part = len(glob.glob('md.part*.cpt'))+1
+if os.path.isfile('fail'): sys.exit(2)
+open('md.part%%04d.tpr'%%part,'w').close()
+cpt_write('md.part%%04d.cpt'%%part,[[0.,0.,0.]],[[1.,0.,0.],[0.,1.,0.],[0.,0.,1.]],step=part,time=10.*(part-1))
+"""
+
+@pytest.fixture
+def step(tmpdir,monkeypatch):
+	"""A step folder with a first part at 0 ps and a continuation script that runs 10 ps per job."""
+	tmpdir.join('amx').mksymlinkto(os.path.join(os.path.dirname(conftest.here),'amx'))
+	here = tmpdir.mkdir('s01-md')
+	here.join('fake_part.py').write(fake_part%conftest.here)
+	here.join('script-continue.sh').write('#!/bin/bash\n"$PYTHON" fake_part.py\n')
+	os.chmod(str(here.join('script-continue.sh')),0o744)
+	monkeypatch.chdir(str(here))
+	monkeypatch.setenv('PYTHON',sys.executable)
+	#---the first part comes from the fake continuation script as well
+	exec(fake_part%conftest.here,{})
+	return here
+
+def chain_wait(timeout=60):
+	"""Wait for a local chain to stop and for its jobs to end."""
+	start = time.time()
+	while time.time()-start<timeout:
+		chain = chain_read()
+		if chain['status']!='running' and not [i for i in chain['jobs'] if i['status'] in ['queued','running']]:
+			return chain
+		time.sleep(0.2)
+	raise Exception('the chain did not stop after %d seconds'%timeout)
+
+def test_chain_until(step):
+	"""Jobs resubmit themselves until the target time and the last successor is cancelled."""
+	chain_begin(20,'local','#!/bin/bash',str(step),max_jobs=10)
+	chain = chain_wait()
+	assert chain['status']=='complete'
+	assert [i['status'] for i in chain['jobs']]==['done','done','cancelled']
+	assert [i['time'] for i in chain['jobs'][:2]]==[10.,20.]
+	#---each job waits for the one that submitted it
+	assert [i['after'] for i in chain['jobs']]==[None]+[i['id'] for i in chain['jobs'][:2]]
+
+def test_chain_max_jobs(step):
+	"""The chain stops when it runs out of jobs before reaching the target time."""
+	chain_begin(100,'local','#!/bin/bash',str(step),max_jobs=2)
+	chain = chain_wait()
+	assert chain['status']=='exhausted'
+	assert [i['status'] for i in chain['jobs']]==['done','done']
+
+def test_chain_failed(step):
+	"""A failed part stops the chain and cancels the successor."""
+	step.join('fail').write('')
+	chain_begin(100,'local','#!/bin/bash',str(step),max_jobs=10)
+	chain = chain_wait()
+	assert chain['status']=='failed'
+	assert [i['status'] for i in chain['jobs']]==['failed','cancelled']
+	assert chain['jobs'][0]['returncode']==2
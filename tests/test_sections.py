@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+import numpy as np
+import conftest
+from topology_sections import GMXSection
+
+atoms_columns = ['id','type','resnr','resname','atom','cgnr','charge','mass']
+atoms_rows = [
+	['1','OW','1','SOL','OW','1','-0.8340','15.99940'],
+	['2','HW','1','SOL','HW1','1','0.4170','1.00800'],
+	['3','HW','1','SOL','HW2','1','0.4170']]
+
+def test_section_columns():
+	"""Columns are stored by kind and rows keep the text of every entry."""
+	atoms = GMXSection(atoms_columns,atoms_rows)
+	assert (atoms.kinds['id'],atoms.kinds['charge'],atoms.kinds['atom'])==('int','float','str')
+	assert atoms['id'].tolist()==[1,2,3] and atoms['atom'].tolist()==['OW','HW1','HW2']
+	assert np.allclose(atoms['charge'],[-0.834,0.417,0.417])
+	assert dict(atoms[0])==dict(zip(atoms_columns,atoms_rows[0]))
+	#---the last row lacks a mass
+	assert 'mass' not in atoms[2] and atoms.text('mass')==['15.99940','1.00800','']
+	assert atoms.where('resname','SOL').tolist()==[0,1,2] and atoms.where('cgnr','1').tolist()==[0,1,2]
+
+def test_section_edit():
+	"""Edits move columns toward more general storage and appended rows are checked against the columns."""
+	atoms = GMXSection(atoms_columns,atoms_rows)
+	atoms[0]['resnr'] = 'X'
+	assert atoms.kinds['resnr']=='str' and atoms.text('resnr')==['X','1','1']
+	atoms.set('mass',2,'1.008')
+	assert atoms[2]['mass']=='1.008' and np.isclose(atoms['mass'][2],1.008)
+	atoms.append({'id':4,'type':'MW','resnr':1,'resname':'SOL','atom':'MW','cgnr':1,'charge':'0.0'})
+	assert len(atoms)==4 and atoms[3]['atom']=='MW' and atoms[0]['resnr']=='X'
+	copied = atoms.copy()
+	copied[3]['atom'] = 'EP'
+	assert atoms[3]['atom']=='MW' and copied!=atoms and atoms==[dict(i) for i in atoms]
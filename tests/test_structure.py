@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import os
+import conftest
+import structure_tools
+from structure_tools import GMXStructure,sequence_find
+
+protein_itp = """[ moleculetype ]
+Protein 3
+[ atoms ]
+1 C 1 ALA CA 1 0.0 12.0
+2 C 1 ALA CB 1 0.0 12.0
+3 C 2 GLY CA 2 0.0 12.0
+"""
+
+class State(object):
+	def __init__(self,**kwargs): self.__dict__.update(kwargs)
+
+def structure(residues):
+	"""Make a structure from a list of residue names and atom names."""
+	atoms = [(rnum+1,resname,name) for rnum,(resname,names) in enumerate(residues) for name in names]
+	return GMXStructure(pts=[[0.,0.,0.] for i in atoms],residue_indices=[i[0] for i in atoms],
+		residue_names=[i[1] for i in atoms],atom_names=[i[2] for i in atoms],box=[3.,3.,3.])
+
+def test_sequence_find():
+	assert sequence_find([1,2,1,2,1,3],[1,2,1])==[0,2]
+	assert sequence_find([1,2,3],[])==[]
+
+def test_detect_composition_proteins(tmpdir,monkeypatch):
+	"""Systems with proteins in state.itp are matched by residue sequence with a JSON-safe result."""
+	tmpdir.join('protein.itp').write(protein_itp)
+	monkeypatch.setattr(structure_tools,'state',State(here=str(tmpdir)+os.sep,itp=['protein.itp']),raising=False)
+	protein = [('ALA',['CA','CB']),('GLY',['CA'])]
+	struct = structure(protein+protein+[('SOL',['OW','HW1','HW2'])]*3+[('ION',['NA']),('ION',['CL'])])
+	composition = struct.detect_composition()
+	assert composition==[['Protein',2],['SOL',3],['NA',1],['CL',1]]
+	assert all([type(name)==str and type(count)==int for name,count in composition])
+	adjust = 'def composition_adjust(composition): return composition[:1]'
+	assert struct.detect_composition(composition_adjust=adjust)==[['Protein',2]]
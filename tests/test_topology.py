@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import conftest
+from topology_tools import GMXTopology
+
+protein_itp = """#define gb_1 0.1 1000.0
+[ moleculetype ]
+; name nrexcl
+Protein 3
+[ atoms ]
+1 C 1 ALA C1 1 0.0 12.0
+2 C 1 ALA C2 1 0.0 12.0
+[ bonds ]
+1 2 2 gb_1
+#ifdef POSRES
+#include "posre.itp"
+#endif
+"""
+
+posre_itp = """[ position_restraints ]
+1 1 1000 1000 1000
+2 1 1000 1000 1000
+"""
+
+def test_topology_includes(tmpdir):
+	"""Records from included files are kept apart and are not written back into the molecule."""
+	tmpdir.join('protein.itp').write(protein_itp)
+	tmpdir.join('posre.itp').write(posre_itp)
+	top = GMXTopology(str(tmpdir.join('protein.itp')),cache=False)
+	assert 'position_restraints' not in top.molecules['Protein']
+	assert len(top.included['Protein']['position_restraints'])==2
+	#---macros are not expanded in the records of the ITP itself
+	assert top.molecules['Protein']['bonds'][0]['length']=='gb_1'
+	top.write(str(tmpdir.join('out.itp')))
+	written = tmpdir.join('out.itp').read()
+	assert 'position_restraints' not in written and '1 2 2 gb_1 ' in written
+	assert GMXTopology(str(tmpdir.join('protein.itp')),parser='regex',cache=False).molecules==top.molecules
+
+ragged_itp = """#define gb_1 0.1 1000.0
+#define ga_1 109.5 500.0
+[ moleculetype ]
+; name nrexcl
+Lipid 1
+[ atoms ]
+1 C 1 POP C1 1 0.0 12.0
+2 C 1 POP C2 2 0.5 12.0 C 0.0 12.0
+3 C 1 POP C3 3 -0.5
+[ bonds ]
+1 2 1
+2 3 1 0.47 1250
+[ angles ]
+1 2 3 2 ga_1
+"""
+
+def test_topology_writers(tmpdir):
+	"""The streaming writer reproduces the original writer byte for byte."""
+	tmpdir.join('lipid.itp').write(ragged_itp)
+	top = GMXTopology(str(tmpdir.join('lipid.itp')),cache=False)
+	assert type(top.molecules['Lipid']['moleculetype'])==dict and top.defines
+	#---an empty molecule and a molecule built from dictionaries
+	top.add_molecule(Empty={})
+	top.add_molecule(Ion={'moleculetype':{'molname':'NA','nrexcl':'1'},
+		'atoms':[{'id':'1','type':'Na','resnr':'1','resname':'NA','atom':'NA','cgnr':'1','charge':'1.0'}],
+		'bonds':[{'i':'1','j':'1','funct':'1'},{'j':'1','i':'1','funct':'1','length':'0.1'}]})
+	written = []
+	for method in ['write','write_legacy']:
+		fn = str(tmpdir.join(method+'.itp'))
+		getattr(top,method)(fn)
+		with open(fn,'rb') as fp: written.append(fp.read())
+	assert written[0]==written[1]
+	assert b'2 C 1 POP C2 2 0.5 12.0 C 0.0 12.0 ' in written[0] and b'\n1 2 1 \n' in written[0]
+
+def test_topology_missing_include(tmpdir):
+	"""Cached topologies are parsed again once an include that we could not find appears."""
+	tmpdir.join('protein.itp').write(protein_itp)
+	top = GMXTopology(str(tmpdir.join('protein.itp')))
+	assert top.missing==['posre.itp'] and str(tmpdir.join('posre.itp')) in top.absent
+	assert GMXTopology(str(tmpdir.join('protein.itp'))).included=={}
+	tmpdir.join('posre.itp').write(posre_itp)
+	top = GMXTopology(str(tmpdir.join('protein.itp')))
+	assert top.missing==[] and len(top.included['Protein']['position_restraints'])==2
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import os,multiprocessing
+import conftest
+from topology_cache import GMXTopologyCache
+
+def store_many(root,source,worker,count=20):
+	cache = GMXTopologyCache(root)
+	for i in range(count): cache.store('key-%d-%d'%(worker,i),[source],b'x'*(worker+1))
+
+def test_topology_cache_processes(tmpdir):
+	"""Processes that share a store do not lose each other's entries."""
+	source = tmpdir.join('protein.itp')
+	source.write('[ moleculetype ]\n')
+	root = str(tmpdir.join('store'))
+	procs = [multiprocessing.Process(target=store_many,args=(root,str(source),i)) for i in range(4)]
+	for proc in procs: proc.start()
+	for proc in procs: proc.join()
+	cache = GMXTopologyCache(root)
+	assert len(cache.index())==80
+	assert cache.load('key-3-0')==b'xxxx'
+
+def test_topology_cache_prune(tmpdir):
+	"""Pruning removes evicted and orphaned objects."""
+	source = tmpdir.join('protein.itp')
+	source.write('[ moleculetype ]\n')
+	cache = GMXTopologyCache(str(tmpdir.join('store')))
+	cache.store('first',[str(source)],b'first')
+	cache.store('second',[str(source)],b'second')
+	orphan = os.path.join(cache.objects,'ab','cdef')
+	os.makedirs(os.path.dirname(orphan))
+	open(orphan,'w').close()
+	assert cache.prune(size_limit=0)==['first','second']
+	assert not any([fns for root,dns,fns in os.walk(cache.objects)])
+
+def test_topology_cache_absent(tmpdir):
+	"""Entries are stale once an include that was missing when we parsed the topology exists."""
+	source,posre = tmpdir.join('protein.itp'),tmpdir.join('posre.itp')
+	source.write('[ moleculetype ]\n#include "posre.itp"\n')
+	cache = GMXTopologyCache(str(tmpdir.join('store')))
+	cache.store('protein',[str(source)],b'protein',absent=[str(posre)])
+	assert cache.load('protein')==b'protein'
+	posre.write('[ position_restraints ]\n')
+	assert cache.load('protein')==None
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import conftest
+from calls import gmx_mdrun_launch,gmx_mdrun_tune_grid,gmx_set_machine_config,gmx_get_machine_config
+
+def test_tune_grid():
+	"""The default grid splits the cores into ranks and threads with PME ranks for multiple ranks."""
+	assert gmx_mdrun_tune_grid(4)==[
+		'-nt 4 -ntmpi 1 -ntomp 4 -pin on',
+		'-nt 4 -ntmpi 2 -ntomp 2 -npme -1 -pin on','-nt 4 -ntmpi 2 -ntomp 2 -npme 0 -pin on',
+		'-nt 4 -ntmpi 4 -ntomp 1 -npme -1 -pin on','-nt 4 -ntmpi 4 -ntomp 1 -npme 0 -pin on',
+		'-nt 4 -ntmpi 4 -ntomp 1 -npme 1 -pin on']
+	assert gmx_mdrun_tune_grid(8,ntmpi='2',npme='0 1 2',pin='on auto')==[
+		'-nt 8 -ntmpi 2 -ntomp 4 -npme 0 -pin on','-nt 8 -ntmpi 2 -ntomp 4 -npme 0 -pin auto',
+		'-nt 8 -ntmpi 2 -ntomp 4 -npme 1 -pin on','-nt 8 -ntmpi 2 -ntomp 4 -npme 1 -pin auto']
+
+def test_mdrun_launch():
+	"""Tuned flags replace the processor count but never reach a custom mdrun_command."""
+	assert gmx_mdrun_launch({'nprocs':4},'gmx mdrun')=='gmx mdrun -nt 4'
+	assert gmx_mdrun_launch({'nprocs':4,'mdrun_tuned':'-nt 4 -ntmpi 2'},'gmx mdrun')=='gmx mdrun -nt 4 -ntmpi 2'
+	assert gmx_mdrun_launch({'mdrun_tuned':'-nt 4 -ntmpi 2','mdrun_command':'mpirun -np 4 gmx_mpi mdrun'},
+		'gmx mdrun')=='mpirun -np 4 gmx_mpi mdrun'
+	assert gmx_mdrun_launch({'nprocs':None},'gmx mdrun')=='gmx mdrun'
+
+def test_set_machine_config(tmpdir,monkeypatch):
+	"""Saving the tuned flags replaces the previous assignment for the same machine."""
+	monkeypatch.chdir(tmpdir)
+	monkeypatch.delenv('HOST',raising=False)
+	monkeypatch.delenv('HOSTNAME',raising=False)
+	tmpdir.join('gromacs_config.py').write("machine_configuration = {'LOCAL':{'nprocs':4}}\n")
+	for flags in ['-nt 4 -ntmpi 1','-nt 4 -ntmpi 2']:
+		assert gmx_set_machine_config('mdrun_tuned',flags)==('./gromacs_config.py','LOCAL')
+	assert gmx_get_machine_config()=={'nprocs':4,'mdrun_tuned':'-nt 4 -ntmpi 2'}
+	assert tmpdir.join('gromacs_config.py').read().count('mdrun_tuned')==1
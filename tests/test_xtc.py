@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+import conftest
+from conftest import sample
+from xtc import xtc_scan,xtc_concatenate
+
+def test_xtc_scan_uncompressed():
+	"""Frames with few atoms store their coordinates without compression."""
+	frames = xtc_scan(sample('small.xtc'))
+	assert frames['step'].tolist()==[0,1,2,3,4]
+	assert np.allclose(frames['time'],[0.,1.,2.,3.,4.])
+	assert frames['offset'][-1]+frames['size'][-1]==os.path.getsize(sample('small.xtc'))
+
+def test_xtc_scan_compressed():
+	"""Compressed frames written by GROMACS are indexed from their headers."""
+	for fn,steps in [('md.part0001.xtc',[0,25000]),('md.part0002.xtc',[25000,50000])]:
+		frames = xtc_scan(sample(fn))
+		assert frames['step'].tolist()==steps
+		assert np.allclose(frames['time'],np.array(steps)*0.002)
+		assert frames['offset'][-1]+frames['size'][-1]==os.path.getsize(sample(fn))
+
+def test_xtc_scan_partial(tmpdir):
+	"""A frame which is still being written is left out."""
+	fn = str(tmpdir.join('md.part0001.xtc'))
+	with open(sample('md.part0001.xtc'),'rb') as fp: data = fp.read()
+	with open(fn,'wb') as fp: fp.write(data[:-100])
+	assert xtc_scan(fn)['step'].tolist()==[0]
+
+def test_xtc_concatenate(tmpdir):
+	"""Parts are joined by copying frames and the first frame of a continuation is dropped."""
+	parts = [sample('md.part0001.xtc'),sample('md.part0002.xtc')]
+	out = str(tmpdir.join('md.xtc'))
+	index = xtc_concatenate(parts,out)
+	assert index['step']==[0,25000,50000] and index['part']==[0,0,1]
+	frames = xtc_scan(out)
+	assert frames['offset'].tolist()==index['offset']
+	with open(parts[0],'rb') as fp: first = fp.read()
+	with open(parts[1],'rb') as fp: second = fp.read()
+	with open(out,'rb') as fp: assert fp.read()==first+second[xtc_scan(parts[1])['size'][0]:]
+	assert xtc_concatenate(parts,out,stride=2)['step']==[0,50000]